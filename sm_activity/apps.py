@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class SmActivityConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "sm_activity"
+
+    def ready(self):
+        from django.db.models.signals import post_migrate, pre_migrate
+
+        from sm_activity.signals import (
+            create_search_index,
+            restore_legacy_reactions,
+            stash_legacy_reactions,
+        )
+
+        post_migrate.connect(create_search_index, sender=self)
+        pre_migrate.connect(stash_legacy_reactions, sender=self)
+        post_migrate.connect(restore_legacy_reactions, sender=self)
@@ -0,0 +1,135 @@
+import time
+
+import django
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from sm_activity import graph
+from sm_activity.models import Comment, Post, Profile
+from sm_activity.seeding import GraphSeeder
+
+
+def scenarios(targets: dict) -> dict:
+    """Endpoint name -> URL, for the objects picked by `pick_targets`"""
+    post, profile, comment = targets["post"], targets["profile"], targets["comment"]
+    urls = {
+        "post-list": reverse("sm_activity:post-list"),
+        "post-search": reverse("sm_activity:post-list") + "?q=summer+coffee",
+        "post-detail": reverse("sm_activity:post-detail", args=[post]),
+        "post-comments": reverse("sm_activity:post-comments", args=[post]),
+        "profile-list": reverse("sm_activity:profile-list"),
+        "profile-detail": reverse("sm_activity:profile-detail", args=[profile]),
+        "profile-posts": reverse("sm_activity:profile-posts", args=[profile]),
+        "profile-suggest": reverse("sm_activity:profile-suggest") + "?prefix=seed1",
+    }
+    if comment is not None:
+        urls["comment-detail"] = reverse("sm_activity:comment-detail", args=[comment])
+        urls["comment-thread"] = reverse("sm_activity:comment-thread", args=[comment])
+    return urls
+
+
+def pick_targets() -> dict:
+    """The heaviest objects of the dataset, where regressions show first"""
+    return {
+        "viewer": Profile.objects.order_by("-following_count", "id").first(),
+        "profile": Profile.objects.order_by("-followers_count", "id")
+        .values_list("id", flat=True)
+        .first(),
+        "post": Post.objects.order_by("-comments_count", "id")
+        .values_list("id", flat=True)
+        .first(),
+        "comment": Comment.objects.filter(parent=None)
+        .order_by("-replies_count", "id")
+        .values_list("id", flat=True)
+        .first(),
+    }
+
+
+def percentile(ordered: list, rank: float) -> float:
+    """Nearest-rank percentile of an ordered list"""
+    index = max(0, min(len(ordered) - 1, round(rank / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(client, url: str, repeat: int) -> dict:
+    """
+    Latency percentiles in milliseconds of `repeat` requests after a cold
+    one, with the queries run by the cold and by the slowest warm request
+    """
+    samples, queries, status_code = [], [], None
+    for _ in range(repeat + 1):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(url)
+            samples.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+        status_code = response.status_code
+
+    cold, warm = samples[0], sorted(samples[1:])
+    return {
+        "status": status_code,
+        "cold_ms": round(cold, 3),
+        "p50_ms": round(percentile(warm, 50), 3),
+        "p90_ms": round(percentile(warm, 90), 3),
+        "p99_ms": round(percentile(warm, 99), 3),
+        "max_ms": round(warm[-1], 3),
+        "cold_queries": queries[0],
+        "warm_queries": max(queries[1:]),
+    }
+
+
+def reset_database() -> None:
+    call_command("flush", interactive=False, verbosity=0)
+    for alias in caches:
+        caches[alias].clear()
+    graph.clear()
+
+
+def run(sizes, repeat: int = 30, seed: int = 1, **seeder_options) -> dict:
+    """
+    Seed a fresh dataset of each size and time every scenario through the
+    test client; the report is plain JSON, stable enough to diff
+    """
+    report = {
+        "meta": {
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "sizes": {},
+    }
+    for size in sizes:
+        reset_database()
+        dataset = GraphSeeder(size, seed=seed, **seeder_options).run()
+        targets = pick_targets()
+
+        client = APIClient()
+        client.force_authenticate(targets["viewer"].user)
+        report["sizes"][str(size)] = {
+            "dataset": dataset,
+            "endpoints": {
+                name: measure(client, url, repeat)
+                for name, url in scenarios(targets).items()
+            },
+        }
+    return report
+
+
+def compare(baseline: dict, report: dict) -> list:
+    """Rows of (size, endpoint, metric, before, after) that changed"""
+    rows = []
+    for size, current in report["sizes"].items():
+        previous = baseline.get("sizes", {}).get(size, {}).get("endpoints", {})
+        for endpoint, metrics in current["endpoints"].items():
+            before = previous.get(endpoint, {})
+            for metric in ("p50_ms", "p99_ms", "cold_queries", "warm_queries"):
+                if metric in before and before[metric] != metrics[metric]:
+                    rows.append(
+                        (size, endpoint, metric, before[metric], metrics[metric])
+                    )
+    return rows
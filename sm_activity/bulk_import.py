@@ -0,0 +1,368 @@
+import json
+import os
+from contextlib import contextmanager
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from sm_activity import caching, graph
+from sm_activity.models import Comment, Post, Profile, Reaction
+from sm_activity.serializer import (
+    CommentThreadSerializer,
+    PostSerializer,
+    ProfileSerializer,
+)
+from user.models import User
+
+Follow = Profile.followers.through
+
+
+class ProfileRowSerializer(ProfileSerializer):
+    id = serializers.IntegerField(min_value=1)
+    user = serializers.IntegerField(min_value=1)
+
+    class Meta(ProfileSerializer.Meta):
+        fields = ("id", "username", "user", "status", "bio")
+        # uniqueness is checked once per batch
+        extra_kwargs = {"username": {"validators": []}}
+
+
+class PostRowSerializer(PostSerializer):
+    id = serializers.IntegerField(min_value=1)
+    author = serializers.IntegerField(min_value=1)
+    created_at = serializers.DateTimeField(required=False)
+
+    class Meta(PostSerializer.Meta):
+        fields = ("id", "author", "title", "body", "created_at")
+
+
+class CommentRowSerializer(CommentThreadSerializer):
+    id = serializers.IntegerField(min_value=1, max_value=Comment.MAX_ID)
+    post = serializers.IntegerField(min_value=1)
+    owner = serializers.IntegerField(min_value=1)
+    parent = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+    created_at = serializers.DateTimeField(required=False)
+
+    class Meta(CommentThreadSerializer.Meta):
+        fields = ("id", "post", "owner", "parent", "body", "created_at")
+
+
+class FollowRowSerializer(serializers.Serializer):
+    follower = serializers.IntegerField(min_value=1)
+    followee = serializers.IntegerField(min_value=1)
+
+
+class ReactionRowSerializer(serializers.Serializer):
+    post = serializers.IntegerField(min_value=1)
+    profile = serializers.IntegerField(min_value=1)
+    kind = serializers.ChoiceField(choices=Reaction.KindChoices.choices)
+
+
+# record types in the order their batches are written, parents first
+ROW_SERIALIZERS = {
+    "profile": ProfileRowSerializer,
+    "post": PostRowSerializer,
+    "comment": CommentRowSerializer,
+    "follow": FollowRowSerializer,
+    "reaction": ReactionRowSerializer,
+}
+
+
+@contextmanager
+def kept_timestamps(*models):
+    """Let bulk_create write the given created_at instead of the current time"""
+    fields = [model._meta.get_field("created_at") for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def existing_ids(model, ids) -> set:
+    return set(model.objects.filter(pk__in=set(ids)).values_list("pk", flat=True))
+
+
+class Importer:
+    """
+    Load `{"type", "data"}` JSON lines into the database in batches: rows
+    are validated with the API serializers' field sets, checked against the
+    database with one query per referenced table and written with
+    bulk_create. After each batch commits, a checkpoint records how far the
+    file was read, so an interrupted import can resume from there; rows
+    already in the database, from a batch that committed just before the
+    crash, are skipped when read again.
+    """
+
+    def __init__(
+        self, batch_size: int, checkpoint: str = None, report=None, progress=None
+    ):
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        # report(message) gets the rejected rows, progress(importer) each batch
+        self.report = report or (lambda message: None)
+        self.progress = progress or (lambda importer: None)
+        self.buffers = {kind: [] for kind in ROW_SERIALIZERS}
+        self.rows = {kind: 0 for kind in ROW_SERIALIZERS}
+        self.errors = 0
+        self.offset = 0
+        self.line_number = 0
+
+    def load_checkpoint(self) -> None:
+        with open(self.checkpoint) as checkpoint:
+            state = json.load(checkpoint)
+        self.offset = state["offset"]
+        self.line_number = state["line"]
+        self.rows.update(state["rows"])
+        self.errors = state["errors"]
+
+    def save_checkpoint(self) -> None:
+        if not self.checkpoint:
+            return
+        state = {
+            "offset": self.offset,
+            "line": self.line_number,
+            "rows": self.rows,
+            "errors": self.errors,
+        }
+        temporary = f"{self.checkpoint}.tmp"
+        with open(temporary, "w") as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(temporary, self.checkpoint)
+
+    def error(self, line_number: int, detail) -> None:
+        self.errors += 1
+        self.report(f"line {line_number}: {detail}")
+
+    def run(self, source) -> dict:
+        """Import the lines of a binary file object, from the checkpoint on"""
+        source.seek(self.offset)
+        pending = 0
+        for raw in iter(source.readline, b""):
+            self.line_number += 1
+            pending += 1
+            if raw.strip():
+                self.add(raw)
+            if pending >= self.batch_size:
+                self.offset = source.tell()
+                self.flush()
+                pending = 0
+        self.offset = source.tell()
+        self.flush()
+        return self.rows
+
+    def add(self, raw: bytes) -> None:
+        try:
+            record = json.loads(raw)
+            kind, data = record["type"], record["data"]
+        except (ValueError, KeyError, TypeError):
+            self.error(self.line_number, "not a {type, data} JSON object")
+            return
+        if kind not in self.buffers:
+            self.error(self.line_number, f"unknown type {kind!r}")
+            return
+        self.buffers[kind].append((self.line_number, data))
+
+    def flush(self) -> None:
+        with transaction.atomic(), kept_timestamps(Post, Comment):
+            for kind, serializer_class in ROW_SERIALIZERS.items():
+                batch, self.buffers[kind] = self.buffers[kind], []
+                if batch:
+                    valid = self.validate(serializer_class(), batch)
+                    self.rows[kind] += getattr(self, f"write_{kind}s")(valid)
+        self.save_checkpoint()
+        self.progress(self)
+
+    def new_rows(self, model, rows) -> list:
+        """The rows whose id is neither in the database nor earlier in the batch"""
+        seen = existing_ids(model, [data["id"] for _, data in rows])
+        new = []
+        for line_number, data in rows:
+            if data["id"] in seen:
+                name = model._meta.model_name
+                self.report(f"line {line_number}: {name} {data['id']} exists, skipped")
+            else:
+                seen.add(data["id"])
+                new.append((line_number, data))
+        return new
+
+    def validate(self, serializer, batch) -> list:
+        """The rows of the batch the serializer accepts, with their line numbers"""
+        valid = []
+        for line_number, data in batch:
+            try:
+                valid.append((line_number, serializer.run_validation(data)))
+            except serializers.ValidationError as error:
+                self.error(line_number, error.detail)
+        return valid
+
+    def write_profiles(self, rows) -> int:
+        rows = self.new_rows(Profile, rows)
+        users = existing_ids(User, [data["user"] for _, data in rows])
+        existing = Profile.objects.filter(
+            Q(username__in=[data["username"] for _, data in rows]) | Q(user__in=users)
+        ).values_list("username", "user_id")
+        taken_usernames = {username for username, _ in existing}
+        taken_users = {user_id for _, user_id in existing}
+        profiles = []
+        for line_number, data in rows:
+            if data["user"] not in users:
+                self.error(line_number, f"user {data['user']} does not exist")
+            elif data["user"] in taken_users:
+                self.error(line_number, f"user {data['user']} has a profile")
+            elif data["username"] in taken_usernames:
+                self.error(line_number, f"username {data['username']!r} is taken")
+            else:
+                taken_usernames.add(data["username"])
+                taken_users.add(data["user"])
+                profiles.append(
+                    Profile(
+                        id=data["id"],
+                        username=data["username"],
+                        username_lower=data["username"].lower(),
+                        user_id=data["user"],
+                        status=data["status"],
+                        bio=data["bio"],
+                    )
+                )
+        Profile.objects.bulk_create(profiles, batch_size=self.batch_size)
+        return len(profiles)
+
+    def write_posts(self, rows) -> int:
+        rows = self.new_rows(Post, rows)
+        authors = existing_ids(Profile, [data["author"] for _, data in rows])
+        now = timezone.now()
+        posts = []
+        for line_number, data in rows:
+            if data["author"] not in authors:
+                self.error(line_number, f"profile {data['author']} does not exist")
+                continue
+            posts.append(
+                Post(
+                    id=data["id"],
+                    author_id=data["author"],
+                    title=data["title"],
+                    body=data["body"],
+                    created_at=data.get("created_at") or now,
+                )
+            )
+        Post.objects.bulk_create(posts, batch_size=self.batch_size)
+        caching.bump(caching.PROFILE, *{post.author_id for post in posts})
+        return len(posts)
+
+    def write_comments(self, rows) -> int:
+        rows = self.new_rows(Comment, rows)
+        posts = existing_ids(Post, [data["post"] for _, data in rows])
+        owners = existing_ids(Profile, [data["owner"] for _, data in rows])
+        parents = {
+            pk: (post_id, path, depth)
+            for pk, post_id, path, depth in Comment.objects.filter(
+                pk__in={data["parent"] for _, data in rows if data.get("parent")}
+            ).values_list("pk", "post_id", "path", "depth")
+        }
+        now = timezone.now()
+        comments = []
+        for line_number, data in rows:
+            parent_id = data.get("parent")
+            if data["post"] not in posts or data["owner"] not in owners:
+                self.error(line_number, "post or owner does not exist")
+                continue
+            path, depth = "", 0
+            if parent_id:
+                # replies follow their parent in the file, maybe in this batch
+                parent = parents.get(parent_id)
+                if parent is None or parent[0] != data["post"]:
+                    self.error(line_number, f"no parent {parent_id} on the post")
+                    continue
+                path, depth = parent[1], parent[2] + 1
+                if depth > Comment.MAX_DEPTH:
+                    self.error(line_number, "replies are nested too deep")
+                    continue
+            path += Comment.path_segment(data["id"])
+            parents[data["id"]] = (data["post"], path, depth)
+            comments.append(
+                Comment(
+                    id=data["id"],
+                    post_id=data["post"],
+                    owner_id=data["owner"],
+                    parent_id=parent_id,
+                    path=path,
+                    depth=depth,
+                    body=data["body"],
+                    created_at=data.get("created_at") or now,
+                )
+            )
+        Comment.objects.bulk_create(comments, batch_size=self.batch_size)
+        caching.bump(caching.POST, *{comment.post_id for comment in comments})
+        return len(comments)
+
+    def write_follows(self, rows) -> int:
+        profiles = existing_ids(
+            Profile,
+            [data[role] for _, data in rows for role in ("follower", "followee")],
+        )
+        # edges already there, or twice in the batch, aren't counted
+        seen = set(
+            Follow.objects.filter(
+                from_profile_id__in=profiles, to_profile_id__in=profiles
+            ).values_list("to_profile_id", "from_profile_id")
+        )
+        follows = []
+        for line_number, data in rows:
+            follower, followee = data["follower"], data["followee"]
+            if follower not in profiles or followee not in profiles:
+                self.error(line_number, "follower or followee does not exist")
+            elif follower == followee:
+                self.error(line_number, "a profile can't follow itself")
+            elif (follower, followee) not in seen:
+                seen.add((follower, followee))
+                follows.append(Follow(from_profile_id=followee, to_profile_id=follower))
+        Follow.objects.bulk_create(
+            follows, batch_size=self.batch_size, ignore_conflicts=True
+        )
+        touched = {follow.from_profile_id for follow in follows}
+        touched.update(follow.to_profile_id for follow in follows)
+        graph.invalidate(*touched)
+        caching.bump(caching.PROFILE, *touched)
+        return len(follows)
+
+    def write_reactions(self, rows) -> int:
+        posts = existing_ids(Post, [data["post"] for _, data in rows])
+        profiles = existing_ids(Profile, [data["profile"] for _, data in rows])
+        # a profile's first reaction to a post wins, as in the database
+        seen = set(
+            Reaction.objects.filter(
+                post_id__in=posts, profile_id__in=profiles
+            ).values_list("post_id", "profile_id")
+        )
+        reactions = []
+        for line_number, data in rows:
+            if data["post"] not in posts or data["profile"] not in profiles:
+                self.error(line_number, "post or profile does not exist")
+                continue
+            if (data["post"], data["profile"]) in seen:
+                continue
+            seen.add((data["post"], data["profile"]))
+            reactions.append(
+                Reaction(
+                    post_id=data["post"], profile_id=data["profile"], kind=data["kind"]
+                )
+            )
+        Reaction.objects.bulk_create(
+            reactions, batch_size=self.batch_size, ignore_conflicts=True
+        )
+        caching.bump(caching.POST, *{reaction.post_id for reaction in reactions})
+        return len(reactions)
+
+
+def reset_sequences(models=(Profile, Post, Comment)) -> None:
+    """Move the id sequences past the ids written explicitly"""
+    statements = connection.ops.sequence_reset_sql(no_style(), list(models))
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
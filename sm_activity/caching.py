@@ -0,0 +1,67 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from sm_activity import metrics
+
+POST = "post"
+PROFILE = "profile"
+
+
+def detail_cache():
+    return caches[getattr(settings, "DETAIL_CACHE_ALIAS", "default")]
+
+
+def timeout() -> int:
+    return getattr(settings, "DETAIL_CACHE_TIMEOUT", 30)
+
+
+def version_key(kind: str, pk) -> str:
+    return f"detail:version:{kind}:{pk}"
+
+
+def payload_key(kind: str, pk) -> str:
+    return f"detail:payload:{kind}:{pk}"
+
+
+def bump(kind: str, *pks) -> None:
+    """
+    Give the objects a new version, so payloads rendered before the change,
+    even ones stored by requests still in flight, are never served again
+    by the processes sharing the cache. Versions only reach other processes
+    through a shared backend: with a process-local one, the others serve
+    their payloads until DETAIL_CACHE_TIMEOUT expires them.
+    """
+    detail_cache().set_many(
+        {version_key(kind, pk): uuid.uuid4().hex for pk in pks}, None
+    )
+
+
+def version(kind: str, pk) -> str:
+    return detail_cache().get_or_set(version_key(kind, pk), uuid.uuid4().hex, None)
+
+
+def get_or_build(kind: str, pk, build) -> dict:
+    """
+    The rendered detail payload of an object, from a single cache round trip
+    when it is current; otherwise `build()` renders it and it is stored
+    along with the version it was rendered for
+    """
+    cache = detail_cache()
+    pk = str(pk)
+    vkey, pkey = version_key(kind, pk), payload_key(kind, pk)
+    found = cache.get_many([vkey, pkey])
+
+    current = found.get(vkey)
+    if current is None:
+        current = version(kind, pk)
+    cached = found.get(pkey)
+    hit = cached is not None and cached["version"] == current
+    metrics.cache_lookup("detail", hit)
+    if hit:
+        return cached["data"]
+
+    data = build()
+    cache.set(pkey, {"version": current, "data": data}, timeout())
+    return data
@@ -0,0 +1,112 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from sm_activity.models import Blob, Comment, Post, Profile, Reaction
+from sm_activity.storage import referenced_names
+
+
+def count_of(queryset: QuerySet, field: str) -> Coalesce:
+    """Correlated COUNT of `queryset` rows whose `field` points to the outer row"""
+    counted = (
+        queryset.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(total=Count("*"))
+        .values("total")
+    )
+    return Coalesce(Subquery(counted), 0)
+
+
+def increment(queryset: QuerySet, **deltas) -> int:
+    """Apply counter deltas in SQL, marking the rows as updated"""
+    return queryset.update(
+        updated_at=timezone.now(),
+        **{field: F(field) + delta for field, delta in deltas.items()},
+    )
+
+
+def recount_posts(queryset: QuerySet = None) -> int:
+    """Recompute the stored reaction and comment counters of posts"""
+    if queryset is None:
+        queryset = Post.objects.all()
+    return queryset.update(
+        updated_at=timezone.now(),
+        likes_count=count_of(
+            Reaction.objects.filter(kind=Reaction.KindChoices.Like), "post"
+        ),
+        dislikes_count=count_of(
+            Reaction.objects.filter(kind=Reaction.KindChoices.Dislike), "post"
+        ),
+        comments_count=count_of(Comment.objects.all(), "post"),
+    )
+
+
+def recount_reactions(post_ids) -> int:
+    """Recompute the like and dislike counters of the given posts"""
+    return Post.objects.filter(pk__in=post_ids).update(
+        updated_at=timezone.now(),
+        likes_count=count_of(
+            Reaction.objects.filter(kind=Reaction.KindChoices.Like), "post"
+        ),
+        dislikes_count=count_of(
+            Reaction.objects.filter(kind=Reaction.KindChoices.Dislike), "post"
+        ),
+    )
+
+
+def recount_profiles(queryset: QuerySet = None) -> int:
+    """Recompute the stored follow, post and comment counters of profiles"""
+    if queryset is None:
+        queryset = Profile.objects.all()
+    follows = Profile.followers.through.objects.all()
+    return queryset.update(
+        updated_at=timezone.now(),
+        followers_count=count_of(follows, "from_profile"),
+        following_count=count_of(follows, "to_profile"),
+        posts_count=count_of(Post.objects.all(), "author"),
+        comments_count=count_of(Comment.objects.all(), "owner"),
+    )
+
+
+def recount_replies(queryset: QuerySet = None) -> int:
+    """Recompute the stored reply counters of comments from their paths"""
+    if queryset is None:
+        queryset = Comment.objects.all()
+    replies = (
+        Comment.objects.filter(
+            post=OuterRef("post"), path__startswith=OuterRef("path")
+        )
+        .exclude(pk=OuterRef("pk"))
+        .order_by()
+        .values("post")
+        .annotate(total=Count("*"))
+        .values("total")
+    )
+    return queryset.update(
+        updated_at=timezone.now(), replies_count=Coalesce(Subquery(replies), 0)
+    )
+
+
+def recount_blobs() -> int:
+    """Recompute the reference counts of blobs from every image field"""
+    references = Counter()
+    for model in (Post, Profile):
+        fields = model.objects.values_list("image", "image_renditions")
+        for image, renditions in fields.iterator(chunk_size=2000):
+            references.update(referenced_names(image, renditions))
+
+    by_count = {}
+    for name, count in references.items():
+        by_count.setdefault(count, []).append(name)
+    with transaction.atomic():
+        updated = Blob.objects.exclude(refcount=0).update(refcount=0)
+        for count, names in by_count.items():
+            for start in range(0, len(names), 500):
+                updated += Blob.objects.filter(
+                    name__in=names[start : start + 500]
+                ).update(refcount=count)
+    return updated
@@ -0,0 +1,75 @@
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.utils.encoders import JSONEncoder
+
+from sm_activity.models import Comment, Post, Profile, Reaction
+from sm_activity.serializer import (
+    CommentThreadSerializer,
+    PostSerializer,
+    ProfileSerializer,
+)
+
+CONTENT_TYPE = "application/x-ndjson"
+
+
+def chunk_size() -> int:
+    return getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+
+
+def line(kind: str, data: dict) -> str:
+    return json.dumps({"type": kind, "data": data}, cls=JSONEncoder) + "\n"
+
+
+def buffered(lines, size: int = 64 * 1024):
+    """Join lines into blocks of about `size` characters, to write fewer chunks"""
+    block, length = [], 0
+    for text in lines:
+        block.append(text)
+        length += len(text)
+        if length >= size:
+            yield "".join(block)
+            block, length = [], 0
+    if block:
+        yield "".join(block)
+
+
+def export_profile(profile: Profile, context: dict = None):
+    """
+    NDJSON lines with the profile, its posts, comments, reactions and follow
+    edges. Every query is read with `.iterator()`, through a server-side
+    cursor where the database has them, so only one chunk of rows is held
+    in memory whatever the size of the history.
+    """
+    context = context or {}
+    size = chunk_size()
+    yield line("profile", ProfileSerializer(profile, context=context).data)
+
+    posts = Post.objects.filter(author=profile).select_related("author")
+    for post in posts.order_by("id").iterator(chunk_size=size):
+        yield line("post", PostSerializer(post, context=context).data)
+
+    comments = Comment.objects.filter(owner=profile).select_related("owner")
+    for comment in comments.order_by("id").iterator(chunk_size=size):
+        data = CommentThreadSerializer(comment, context=context).data
+        yield line("comment", {**data, "post": comment.post_id})
+
+    reactions = (
+        Reaction.objects.filter(profile=profile)
+        .order_by("id")
+        .values("post", "kind", "created_at")
+    )
+    for reaction in reactions.iterator(chunk_size=size):
+        yield line("reaction", reaction)
+
+    # from_profile is the followed profile, to_profile its follower
+    edges = (
+        Profile.followers.through.objects.filter(
+            Q(to_profile=profile) | Q(from_profile=profile)
+        )
+        .order_by("id")
+        .values_list("to_profile", "from_profile")
+    )
+    for follower, followee in edges.iterator(chunk_size=size):
+        yield line("follow", {"follower": follower, "followee": followee})
@@ -0,0 +1,188 @@
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from sm_activity import caching, metrics
+from sm_activity.counters import increment
+from sm_activity.models import Profile
+
+Follow = Profile.followers.through
+
+
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used key"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def set(self, key, value) -> None:
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+
+
+cache_size = getattr(settings, "GRAPH_CACHE_SIZE", 10000)
+# follower profile id -> (version, load time, sorted array of followed ids)
+following_cache = LRUCache(cache_size)
+# ownership never changes, so these need no versioning
+user_by_profile = LRUCache(cache_size)
+profile_by_user = LRUCache(cache_size)
+
+
+def ttl() -> float:
+    return getattr(settings, "GRAPH_CACHE_TTL", 10)
+
+
+def version_key(profile_id: int) -> str:
+    return f"graph:version:{profile_id}"
+
+
+def version(profile_id: int) -> str:
+    """
+    Version of the adjacency set of a profile, kept in the default cache so
+    that, when it is shared, every process notices follows made by the
+    others at once. A process-local cache only sees its own changes; the
+    others reload the set after GRAPH_CACHE_TTL seconds.
+    """
+    return cache.get_or_set(version_key(profile_id), uuid.uuid4().hex, None)
+
+
+def invalidate(*profile_ids: int) -> None:
+    cache.set_many(
+        {version_key(profile_id): uuid.uuid4().hex for profile_id in profile_ids},
+        None,
+    )
+
+
+def forget(profile: Profile) -> None:
+    """Drop everything cached about a profile that was created or deleted"""
+    user_by_profile.pop(profile.pk)
+    profile_by_user.pop(profile.user_id)
+    invalidate(profile.pk)
+
+
+def clear() -> None:
+    """Empty the process-local caches, after the tables were wiped"""
+    for local_cache in (following_cache, user_by_profile, profile_by_user):
+        local_cache.clear()
+
+
+def following_ids(profile_id: int) -> array:
+    current = version(profile_id)
+    now = time.monotonic()
+    cached = following_cache.get(profile_id)
+    hit = cached is not None and cached[0] == current and now - cached[1] < ttl()
+    metrics.cache_lookup("graph", hit)
+    if hit:
+        return cached[2]
+
+    ids = array(
+        "q",
+        Follow.objects.filter(to_profile_id=profile_id)
+        .order_by("from_profile_id")
+        .values_list("from_profile_id", flat=True),
+    )
+    following_cache.set(profile_id, (current, now, ids))
+    return ids
+
+
+def is_following(follower_id: int, followee_id: int) -> bool:
+    """Membership test against the cached adjacency set, no query when warm"""
+    ids = following_ids(follower_id)
+    index = bisect_left(ids, followee_id)
+    return index < len(ids) and ids[index] == followee_id
+
+
+def user_id_for_profile(profile_id: int):
+    user_id = user_by_profile.get(profile_id)
+    if user_id is None:
+        user_id = (
+            Profile.objects.filter(pk=profile_id)
+            .values_list("user_id", flat=True)
+            .first()
+        )
+        user_by_profile.set(profile_id, user_id)
+    return user_id
+
+
+def profile_id_for_user(user_id: int):
+    profile_id = profile_by_user.get(user_id)
+    if profile_id is None:
+        profile_id = (
+            Profile.objects.filter(user_id=user_id).values_list("id", flat=True).first()
+        )
+        if profile_id is not None:
+            profile_by_user.set(user_id, profile_id)
+    return profile_id
+
+
+def edge(follower_id: int, followee_id: int):
+    return Follow.objects.filter(from_profile_id=followee_id, to_profile_id=follower_id)
+
+
+def follow(follower_id: int, followee_id: int) -> bool:
+    """
+    Insert the follow edge, relying on the unique index of the through
+    table to make concurrent duplicates a no-op. Returns whether the edge
+    was created.
+    """
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                Follow.objects.create(
+                    from_profile_id=followee_id, to_profile_id=follower_id
+                )
+        except IntegrityError:
+            return False
+        increment(Profile.objects.filter(pk=followee_id), followers_count=1)
+        increment(Profile.objects.filter(pk=follower_id), following_count=1)
+    invalidate(follower_id)
+    caching.bump(caching.PROFILE, follower_id, followee_id)
+    return True
+
+
+def unfollow(follower_id: int, followee_id: int) -> bool:
+    """Delete the follow edge, returns whether it existed"""
+    with transaction.atomic():
+        removed, _ = edge(follower_id, followee_id).delete()
+        if removed:
+            increment(Profile.objects.filter(pk=followee_id), followers_count=-1)
+            increment(Profile.objects.filter(pk=follower_id), following_count=-1)
+    if removed:
+        invalidate(follower_id)
+        caching.bump(caching.PROFILE, follower_id, followee_id)
+    return bool(removed)
+
+
+def followers_count(profile_id: int) -> int:
+    return (
+        Profile.objects.filter(pk=profile_id)
+        .values_list("followers_count", flat=True)
+        .get()
+    )
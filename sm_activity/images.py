@@ -0,0 +1,217 @@
+import io
+import logging
+import os
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from sm_activity import caching, storage
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+CACHE_KINDS = {"post": caching.POST, "profile": caching.PROFILE}
+
+
+def widths() -> tuple:
+    return tuple(getattr(settings, "IMAGE_RENDITION_WIDTHS", (64, 320, 1080)))
+
+
+def quality() -> int:
+    return getattr(settings, "IMAGE_RENDITION_QUALITY", 80)
+
+
+def workers() -> int:
+    return getattr(settings, "IMAGE_WORKERS", 2)
+
+
+def max_pixels() -> int:
+    return getattr(settings, "IMAGE_MAX_PIXELS", 40_000_000)
+
+
+class ImageTooLarge(ValueError):
+    """An image with more pixels than IMAGE_MAX_PIXELS"""
+
+
+# what Pillow raises for uploads that aren't images it can read
+INVALID_IMAGE_ERRORS = (OSError, SyntaxError, ValueError, Image.DecompressionBombError)
+
+
+def check(data: bytes, max_pixels: int) -> None:
+    """
+    Check an upload without decoding it: its structure with `verify`, then
+    its dimensions against `max_pixels` from the header. Raises
+    ImageTooLarge or another of INVALID_IMAGE_ERRORS.
+    """
+    with Image.open(io.BytesIO(data)) as candidate:
+        candidate.verify()
+        if candidate.width * candidate.height > max_pixels:
+            raise ImageTooLarge(
+                f"{candidate.width}x{candidate.height} is over {max_pixels} pixels"
+            )
+
+
+def render(data: bytes, widths: tuple, quality: int, max_pixels: int) -> dict:
+    """
+    Decode an uploaded image and encode it in every format at each width,
+    never upscaled, oriented from its EXIF tag and stripped of all
+    metadata. Runs in a pool worker, so it only depends on Pillow.
+
+    Uploads are checked by the API before they are stored; stored files
+    are checked again, as they may have been saved some other way.
+    """
+    check(data, max_pixels)
+    with Image.open(io.BytesIO(data)) as original:
+        original.load()
+        image = ImageOps.exif_transpose(original)
+    has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    sizes = {width: min(width, image.width) for width in widths}
+    files = {}
+    for size in set(sizes.values()):
+        height = max(1, round(image.height * size / image.width))
+        resized = image.resize((size, height), Image.Resampling.LANCZOS)
+        resized.info = {}
+        files[size] = {}
+        for extension, image_format in FORMATS.items():
+            frame = resized
+            if image_format == "JPEG" and frame.mode != "RGB":
+                frame = frame.convert("RGB")
+            buffer = io.BytesIO()
+            frame.save(buffer, image_format, quality=quality, optimize=True)
+            files[size][extension] = buffer.getvalue()
+    return {"sizes": sizes, "files": files}
+
+
+class InlineExecutor(Executor):
+    """Runs the work in the calling thread, for IMAGE_WORKERS = 0"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+
+_executors = {}
+
+
+def executor() -> Executor:
+    """
+    The process pool rendering images, created on first use. This module
+    doesn't import the models so the workers can load `render` without
+    setting Django up.
+    """
+    if workers() <= 0:
+        return InlineExecutor()
+    if "pool" not in _executors:
+        _executors["pool"] = ProcessPoolExecutor(max_workers=workers())
+    return _executors["pool"]
+
+
+def run_logged(function, *args) -> None:
+    try:
+        function(*args)
+    except Exception:
+        logger.exception("Image processing failed in %s%r", function.__name__, args)
+    finally:
+        connections.close_all()
+
+
+def in_background(function, *args) -> None:
+    """
+    Run `function` on the thread reading uploads and storing renditions,
+    off the requests and the pool's result handling, which mustn't block
+    on storage or the database; inline when IMAGE_WORKERS is 0
+    """
+    if workers() <= 0:
+        function(*args)
+        return
+    if "store" not in _executors:
+        _executors["store"] = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="image-store"
+        )
+    _executors["store"].submit(run_logged, function, *args)
+
+
+def store(model, pk, name: str, rendered: dict) -> dict:
+    """
+    Save the rendered files and record their names on the object, unless
+    its image was replaced in the meantime
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    folder = f"renditions/{model._meta.model_name}s"
+    saved = {}
+    for size, encoded in rendered.get("files", {}).items():
+        saved[size] = {
+            extension: default_storage.save(
+                f"{folder}/{stem}-{size}w.{extension}", ContentFile(content)
+            )
+            for extension, content in encoded.items()
+        }
+
+    renditions = {
+        str(width): saved[size] for width, size in rendered.get("sizes", {}).items()
+    }
+    stored = model.objects.filter(pk=pk, image=name)
+    with transaction.atomic():
+        previous = (
+            stored.select_for_update()
+            .values_list("image_renditions", flat=True)
+            .first()
+        )
+        if previous is None:
+            # unreferenced, the files are left to the collect_blobs command
+            return {}
+        stored.update(
+            updated_at=timezone.now(),
+            image_renditions={"source": name, "renditions": renditions},
+        )
+        storage.release(storage.referenced_names("", previous))
+        storage.retain(storage.referenced_names("", {"renditions": renditions}))
+    caching.bump(CACHE_KINDS[model._meta.model_name], pk)
+    return renditions
+
+
+def finish(model, pk, name: str, future) -> None:
+    try:
+        rendered = future.result()
+    except Exception:
+        logger.exception("Unable to render %s of %s %s", name, model.__name__, pk)
+        rendered = {}
+    store(model, pk, name, rendered)
+
+
+def process(model, pk, name: str) -> None:
+    """Render the image renditions of an object, in the pool when enabled"""
+    with default_storage.open(name) as source:
+        data = source.read()
+    future = executor().submit(render, data, widths(), quality(), max_pixels())
+    future.add_done_callback(lambda done: in_background(finish, model, pk, name, done))
+
+
+def schedule(instance) -> None:
+    """Process the image of a Post or Profile once the upload is committed"""
+    name = instance.image.name
+    model, pk = type(instance), instance.pk
+    transaction.on_commit(lambda: in_background(process, model, pk, name))
+
+
+def is_current(instance) -> bool:
+    """Whether the stored renditions were rendered from the current image"""
+    return bool(instance.image) and (
+        instance.image_renditions.get("source") == instance.image.name
+    )
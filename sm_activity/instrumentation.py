@@ -0,0 +1,265 @@
+import heapq
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from rest_framework import serializers
+
+from sm_activity import metrics
+from sm_activity.querylog import (
+    add_execute_wrapper,
+    group_queries,
+    remove_execute_wrapper,
+)
+
+logger = logging.getLogger(__name__)
+
+# the Timings of the request being handled, None outside of requests
+current = ContextVar("request_timings", default=None)
+
+
+def slow_ms() -> float:
+    return getattr(settings, "SERVER_TIMING_SLOW_MS", 500)
+
+
+def sample_size() -> int:
+    return getattr(settings, "SERVER_TIMING_SAMPLES", 20)
+
+
+def max_statements() -> int:
+    return getattr(settings, "SERVER_TIMING_MAX_STATEMENTS", 200)
+
+
+class Timings:
+    """
+    What one request spent, in seconds. Only running sums and the raw SQL
+    strings are kept while it runs; everything else is computed once, after
+    the response, and normalizing the SQL only for the sampled requests.
+    """
+
+    __slots__ = (
+        "started",
+        "view",
+        "queries",
+        "db",
+        "serialize",
+        "render",
+        "statements",
+        "depth",
+        "render_started",
+        "limit",
+        "finished",
+    )
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.queries = 0
+        self.db = self.serialize = self.render = 0.0
+        self.statements = []
+        self.depth = 0
+        self.render_started = None
+        self.limit = max_statements()
+        self.finished = False
+
+    def __call__(self, execute, sql, params, many, context):
+        """`connection.execute_wrapper` hook counting and timing every query"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+            if len(self.statements) < self.limit:
+                self.statements.append(sql)
+
+    def start_render(self, response):
+        self.render_started = time.perf_counter()
+        response.add_post_render_callback(self.stop_render)
+
+    def stop_render(self, response):
+        self.render += time.perf_counter() - self.render_started
+
+    def server_timing(self, total: float) -> str:
+        return (
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries", '
+            f"serialize;dur={self.serialize * 1000:.1f}, "
+            f"render;dur={self.render * 1000:.1f}, "
+            f"total;dur={total * 1000:.1f}"
+        )
+
+    def record(self, request, response, total: float) -> dict:
+        return {
+            "method": request.method,
+            "path": request.path,
+            "view": self.view,
+            "status": response.status_code,
+            "queries": self.queries,
+            "db_ms": round(self.db * 1000, 3),
+            "serialize_ms": round(self.serialize * 1000, 3),
+            "render_ms": round(self.render * 1000, 3),
+            "total_ms": round(total * 1000, 3),
+        }
+
+
+class SlowestRequests:
+    """The records of the slowest requests this process served, with their SQL"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.heap = []
+        self.counter = 0
+
+    def offer(self, total: float, build) -> None:
+        """Keep `build()`'s record if the request is among the slowest"""
+        size = sample_size()
+        if len(self.heap) >= size and total <= self.heap[0][0]:
+            return
+        entry = build()
+        with self.lock:
+            self.counter += 1
+            heapq.heappush(self.heap, (total, self.counter, entry))
+            while len(self.heap) > size:
+                heapq.heappop(self.heap)
+
+    def records(self) -> list:
+        with self.lock:
+            return [entry for _, _, entry in sorted(self.heap, reverse=True)]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.heap.clear()
+
+
+slowest = SlowestRequests()
+
+
+def with_sql(record: dict, timings: Timings) -> dict:
+    grouped = group_queries({"sql": sql} for sql in timings.statements)
+    return {**record, "sql": [{"count": n, "sql": sql} for n, sql in grouped]}
+
+
+def view_name(request, view_func) -> str:
+    """`ViewSet.action` for DRF viewsets, the view's qualified name otherwise"""
+    view_class = getattr(view_func, "cls", None)
+    if view_class is None:
+        return f"{view_func.__module__}.{view_func.__qualname__}"
+    actions = getattr(view_func, "actions", None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f"{view_class.__name__}.{action}"
+
+
+class ServerTimingMiddleware:
+    """
+    Time each request and the SQL, serialization and rendering it ran, then
+    report it in a `Server-Timing` header, the request metrics and one JSON
+    log line on the `sm_activity.instrumentation` logger. Requests over
+    SERVER_TIMING_SLOW_MS are logged as warnings with their SQL grouped by
+    normalized statement, and the slowest are kept in `slowest`.
+
+    Headers are sent before a streamed body, so the header of a streaming
+    response only covers the time to its first byte; its metrics and log
+    line wait for the last one and include the SQL run while streaming.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = Timings()
+        token = current.set(timings)
+        add_execute_wrapper(timings)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            remove_execute_wrapper(timings)
+            raise
+        finally:
+            current.reset(token)
+
+        elapsed = time.perf_counter() - timings.started
+        response["Server-Timing"] = timings.server_timing(elapsed)
+        if response.streaming:
+            response.streaming_content = self.streamed(
+                request, response, timings, response.streaming_content
+            )
+            # a generator never started doesn't run its `finally` on close
+            response._resource_closers.append(
+                lambda: self.finish(request, response, timings)
+            )
+        else:
+            self.finish(request, response, timings)
+        return response
+
+    def streamed(self, request, response, timings, content):
+        """The chunks of `content`, produced as part of the request"""
+        content = iter(content)
+        try:
+            while True:
+                token = current.set(timings)
+                try:
+                    chunk = next(content, None)
+                finally:
+                    current.reset(token)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self.finish(request, response, timings)
+
+    def finish(self, request, response, timings) -> None:
+        """Stop timing the request, then record and log it, once"""
+        if timings.finished:
+            return
+        timings.finished = True
+        remove_execute_wrapper(timings)
+
+        total = time.perf_counter() - timings.started
+        metrics.observe_request(
+            timings.view, response.status_code, total, timings.queries
+        )
+        record = timings.record(request, response, total)
+        slowest.offer(total, lambda: with_sql(record, timings))
+        if total * 1000 >= slow_ms():
+            logger.warning(json.dumps(with_sql(record, timings)))
+        elif logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = current.get()
+        if timings is not None:
+            timings.view = view_name(request, view_func)
+
+    def process_template_response(self, request, response):
+        timings = current.get()
+        if timings is not None:
+            timings.start_render(response)
+        return response
+
+
+class TimedSerializerMixin:
+    """
+    Adds the time spent in `to_representation` to the request's Timings;
+    only the outermost call is timed, so nested and list serializers are
+    counted once, and the SQL it runs is left to `db`
+    """
+
+    def to_representation(self, instance):
+        timings = current.get()
+        if timings is None or timings.depth:
+            return super().to_representation(instance)
+        timings.depth += 1
+        started, db_started = time.perf_counter(), timings.db
+        try:
+            return super().to_representation(instance)
+        finally:
+            elapsed = time.perf_counter() - started
+            timings.serialize += elapsed - (timings.db - db_started)
+            timings.depth -= 1
+
+
+class TimedModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """ModelSerializer whose time is reported in the Server-Timing header"""
@@ -0,0 +1,118 @@
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.migrations.operations import RemoveField
+
+from sm_activity.counters import recount_posts
+from sm_activity.models import Post, Reaction
+
+# Likes come first, so a profile found in both tables keeps its like and
+# the dislike is skipped by the unique constraint
+LEGACY_TABLES = (
+    ("sm_activity_post_likes", Reaction.KindChoices.Like),
+    ("sm_activity_post_dislikes", Reaction.KindChoices.Dislike),
+)
+LEGACY_FIELDS = ("likes", "dislikes")
+# the legacy rows, saved before the migration dropping their tables runs
+STASH_TABLE = "sm_activity_legacy_reaction"
+
+
+def drops_legacy_tables(plan) -> bool:
+    """Whether a migration plan removes the likes/dislikes many-to-many"""
+    return any(
+        isinstance(operation, RemoveField)
+        and operation.model_name_lower == "post"
+        and operation.name_lower in LEGACY_FIELDS
+        for migration, backwards in plan or ()
+        if migration.app_label == "sm_activity" and not backwards
+        for operation in migration.operations
+    )
+
+
+def existing_tables(using: str) -> set:
+    return set(connections[using].introspection.table_names())
+
+
+def stash(using: str = DEFAULT_DB_ALIAS) -> int:
+    """
+    Save the rows of the legacy tables in STASH_TABLE, which migrations
+    don't know about, so that they survive the migration adding Reaction
+    and dropping the many-to-many tables in one go
+    """
+    connection = connections[using]
+    tables = [
+        (table, kind)
+        for table, kind in LEGACY_TABLES
+        if table in existing_tables(using)
+    ]
+    if not tables:
+        return 0
+
+    stash_table = connection.ops.quote_name(STASH_TABLE)
+    stashed = 0
+    with transaction.atomic(using), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {stash_table} "
+            "(post_id bigint NOT NULL, profile_id bigint NOT NULL, "
+            "kind varchar(10) NOT NULL)"
+        )
+        for table, kind in tables:
+            cursor.execute(
+                f"INSERT INTO {stash_table} (post_id, profile_id, kind) "
+                f"SELECT post_id, profile_id, %s "
+                f"FROM {connection.ops.quote_name(table)}",
+                [kind],
+            )
+            stashed += cursor.rowcount
+    return stashed
+
+
+def sources(using: str) -> list:
+    """`(table, kind, SELECT of its (post_id, profile_id), params)` to copy"""
+    quote = connections[using].ops.quote_name
+    existing = existing_tables(using)
+    found = []
+    for table, kind in LEGACY_TABLES:
+        if STASH_TABLE in existing:
+            select = (
+                f"SELECT post_id, profile_id FROM {quote(STASH_TABLE)} "
+                "WHERE kind = %s"
+            )
+            found.append((STASH_TABLE, kind, select, [kind]))
+        if table in existing:
+            select = f"SELECT post_id, profile_id FROM {quote(table)}"
+            found.append((table, kind, select, []))
+    return found
+
+
+def copy(
+    using: str = DEFAULT_DB_ALIAS, batch_size: int = 5000, drop: bool = True
+) -> list:
+    """
+    Copy the stashed and legacy rows into Reaction, recount the post
+    counters and drop the copied tables; returns `(table, rows copied)`
+    """
+    connection = connections[using]
+    found = sources(using)
+    copied = {table: 0 for table, _, _, _ in found}
+    if not found:
+        return []
+
+    with transaction.atomic(using):
+        for table, kind, select, params in found:
+            with connection.cursor() as cursor:
+                cursor.execute(select, params)
+                while rows := cursor.fetchmany(batch_size):
+                    Reaction.objects.using(using).bulk_create(
+                        [
+                            Reaction(post_id=post_id, profile_id=profile_id, kind=kind)
+                            for post_id, profile_id in rows
+                        ],
+                        ignore_conflicts=True,
+                    )
+                    copied[table] += len(rows)
+        recount_posts(Post.objects.using(using))
+
+        if drop:
+            with connection.cursor() as cursor:
+                for table in copied:
+                    cursor.execute(f"DROP TABLE {connection.ops.quote_name(table)}")
+    return list(copied.items())
@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from sm_activity import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the post, profile and comment endpoints on seeded datasets of "
+        "several sizes, in a throwaway test database, and write a JSON report "
+        "of latency percentiles and query counts"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000",
+            help="Comma separated numbers of profiles (default: 1000,10000)",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=30, help="Warm requests per endpoint"
+        )
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", help="Write the report to this file")
+        parser.add_argument(
+            "--compare", help="Baseline report to print the differences against"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes takes comma separated integers")
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            report = benchmark.run(sizes, options["repeat"], options["seed"])
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                output.write(text + "\n")
+        else:
+            self.stdout.write(text)
+
+        if baseline is not None:
+            for size, endpoint, metric, before, after in benchmark.compare(
+                baseline, report
+            ):
+                self.stdout.write(
+                    f"{size:>8} {endpoint:<16} {metric:<13} " f"{before} -> {after}"
+                )
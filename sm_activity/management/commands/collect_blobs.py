@@ -0,0 +1,100 @@
+import os
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from sm_activity.counters import recount_blobs
+from sm_activity.models import Blob
+from sm_activity.storage import BLOB_DIR
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the media blobs no post or profile references any more, and "
+        "the blob files left without a record by failed uploads"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-hours",
+            type=float,
+            default=24,
+            help="Keep blobs touched more recently than this (default: 24)",
+        )
+        parser.add_argument(
+            "--recount",
+            action="store_true",
+            help="Recompute the reference counts before collecting",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["recount"]:
+            recount_blobs()
+        cutoff = timezone.now() - timedelta(hours=options["grace_hours"])
+        dry_run = options["dry_run"]
+
+        deleted = freed = 0
+        garbage = Blob.objects.filter(refcount__lte=0, updated_at__lt=cutoff)
+        last_pk = 0
+        while True:
+            batch = list(
+                garbage.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", "name", "size")[: options["batch_size"]]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            for pk, name, size in batch:
+                if not dry_run and not self.collect(garbage, pk, name):
+                    continue
+                deleted += 1
+                freed += size
+
+        orphans = 0
+        for name, modified in self.blob_files(BLOB_DIR):
+            if modified >= cutoff or Blob.objects.filter(name=name).exists():
+                continue
+            if not dry_run:
+                # an upload may have written it again since it was listed
+                if default_storage.get_modified_time(name) >= cutoff:
+                    continue
+                default_storage.delete(name)
+            orphans += 1
+
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {deleted} blobs ({freed} bytes) and {orphans} orphan files"
+            )
+        )
+
+    @staticmethod
+    def collect(garbage, pk, name) -> bool:
+        """
+        Delete the blob if it is still garbage, then its file before the
+        deletion commits: an upload touching the row meanwhile either made
+        it current again, so it stays, or waits for the row lock and finds
+        neither row nor file, so it writes both again
+        """
+        with transaction.atomic():
+            removed, _ = garbage.filter(pk=pk).delete()
+            if removed:
+                default_storage.delete(name)
+        return bool(removed)
+
+    def blob_files(self, directory):
+        """Every file under `directory` with its modification time"""
+        if not default_storage.exists(directory):
+            return
+        directories, files = default_storage.listdir(directory)
+        for name in files:
+            path = os.path.join(directory, name)
+            yield path, default_storage.get_modified_time(path)
+        for subdirectory in directories:
+            yield from self.blob_files(os.path.join(directory, subdirectory))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sm_activity.export import buffered, export_profile
+from sm_activity.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Write the posts, comments, reactions and follows of a profile as NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("profile", help="Profile id or username")
+        parser.add_argument(
+            "--output",
+            help="File to write (default: standard output)",
+        )
+
+    def handle(self, *args, **options):
+        lookup = options["profile"]
+        profiles = Profile.objects.all()
+        try:
+            if lookup.isdigit():
+                profile = profiles.get(pk=int(lookup))
+            else:
+                profile = profiles.get(username=lookup)
+        except Profile.DoesNotExist:
+            raise CommandError(f"Profile {lookup!r} does not exist")
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output:
+                self.write(profile, output)
+            self.stderr.write(
+                self.style.SUCCESS(f"Exported {profile} to {options['output']}")
+            )
+        else:
+            self.write(profile, self.stdout)
+
+    @staticmethod
+    def write(profile, output) -> None:
+        for block in buffered(export_profile(profile)):
+            output.write(block)
@@ -0,0 +1,73 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sm_activity import search
+from sm_activity.bulk_import import Importer, reset_sequences
+from sm_activity.counters import recount_posts, recount_profiles, recount_replies
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk load profiles, posts, comments, follows and reactions from a "
+        'JSONL file of {"type": ..., "data": {...}} lines. Ids are kept, and '
+        "parents must come before the rows referring to them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="JSONL file to import")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--checkpoint",
+            help="Checkpoint file (default: <path>.checkpoint)",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue after the last batch recorded in the checkpoint",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        checkpoint = options["checkpoint"] or f"{path}.checkpoint"
+        importer = Importer(
+            options["batch_size"],
+            checkpoint,
+            report=self.stderr.write,
+            progress=self.progress,
+        )
+        if options["resume"]:
+            if not os.path.exists(checkpoint):
+                raise CommandError(f"No checkpoint at {checkpoint}")
+            importer.load_checkpoint()
+            self.stdout.write(f"Resuming after line {importer.line_number}")
+        elif os.path.exists(checkpoint):
+            raise CommandError(
+                f"{checkpoint} exists: pass --resume to continue that import"
+            )
+
+        self.started = time.monotonic()
+        self.resumed_rows = sum(importer.rows.values())
+        with open(path, "rb") as source:
+            rows = importer.run(source)
+
+        self.stdout.write("Updating ids, counters and the search index")
+        reset_sequences()
+        recount_profiles()
+        recount_posts()
+        recount_replies()
+        search.rebuild_index()
+        os.remove(checkpoint)
+
+        summary = ", ".join(f"{count} {kind}s" for kind, count in rows.items())
+        self.stdout.write(self.style.SUCCESS(f"Imported {summary}"))
+
+    def progress(self, importer) -> None:
+        total = sum(importer.rows.values())
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        self.stdout.write(
+            f"line {importer.line_number}: {total} rows, "
+            f"{(total - self.resumed_rows) / elapsed:.0f} rows/s, "
+            f"{importer.errors} errors"
+        )
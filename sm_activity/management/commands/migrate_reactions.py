@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from sm_activity import legacy_reactions
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy rows of the legacy post likes/dislikes many-to-many tables, or "
+        "the copy `migrate` stashed before dropping them, into Reaction and "
+        "drop the copied tables. `migrate` already runs this when it drops "
+        "the legacy tables; run it to retry or to migrate by hand."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            "--keep-tables",
+            action="store_true",
+            help="Do not drop the legacy tables after copying",
+        )
+
+    def handle(self, *args, **options):
+        copied = legacy_reactions.copy(
+            options["database"],
+            options["batch_size"],
+            drop=not options["keep_tables"],
+        )
+        if not copied:
+            self.stdout.write("No legacy reaction tables found")
+            return
+
+        for table, rows in copied:
+            self.stdout.write(f"Copied {rows} rows from {table}")
+        self.stdout.write(self.style.SUCCESS("Reactions migrated"))
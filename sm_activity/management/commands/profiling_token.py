@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from sm_activity.profiling import HEADER, make_token, profiles_dir, token_max_age
+
+
+class Command(BaseCommand):
+    help = "Print a signed X-Profile-Request header value to profile requests"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{HEADER}: {make_token()}")
+        self.stderr.write(
+            f"Valid for {token_max_age()} seconds, the profiles are written to "
+            f"{profiles_dir()}"
+        )
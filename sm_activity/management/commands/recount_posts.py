@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from sm_activity.counters import recount_posts, recount_replies
+from sm_activity.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the stored like, dislike and comment counters of posts "
+        "and the reply counters of their comments"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "post_ids",
+            nargs="*",
+            type=int,
+            help="Only recount these posts (default: all posts)",
+        )
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.all()
+        if options["post_ids"]:
+            queryset = queryset.filter(pk__in=options["post_ids"])
+
+        updated = recount_posts(queryset)
+        comments = recount_replies(Comment.objects.filter(post__in=queryset))
+        self.stdout.write(
+            self.style.SUCCESS(f"Recounted {updated} posts and {comments} comments")
+        )
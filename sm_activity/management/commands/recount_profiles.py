@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from sm_activity.counters import recount_profiles
+from sm_activity.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored follow, post and comment counters of profiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "profile_ids",
+            nargs="*",
+            type=int,
+            help="Only recount these profiles (default: all profiles)",
+        )
+
+    def handle(self, *args, **options):
+        queryset = Profile.objects.all()
+        if options["profile_ids"]:
+            queryset = queryset.filter(pk__in=options["profile_ids"])
+
+        updated = recount_profiles(queryset)
+        self.stdout.write(self.style.SUCCESS(f"Recounted {updated} profiles"))
@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sm_activity.seeding import PASSWORD, GraphSeeder
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic social graph: profiles with a power-law follower "
+        "distribution, posts, comment threads and reactions"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("profiles", type=int, help="Number of profiles")
+        parser.add_argument(
+            "--following", type=float, default=20, help="Mean follows per profile"
+        )
+        parser.add_argument(
+            "--posts", type=float, default=5, help="Mean posts per profile"
+        )
+        parser.add_argument(
+            "--comments", type=float, default=3, help="Mean comments per post"
+        )
+        parser.add_argument(
+            "--reactions", type=float, default=10, help="Mean reactions per post"
+        )
+        parser.add_argument(
+            "--alpha",
+            type=float,
+            default=1.1,
+            help="Exponent of the Zipf law of profile popularity",
+        )
+        parser.add_argument(
+            "--days", type=int, default=365, help="Spread posts over this many days"
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, help="Seed of the random generator")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        totals = GraphSeeder(
+            options["profiles"],
+            following=options["following"],
+            posts=options["posts"],
+            comments=options["comments"],
+            reactions=options["reactions"],
+            alpha=options["alpha"],
+            days=options["days"],
+            batch_size=options["batch_size"],
+            seed=options["seed"],
+        ).run()
+
+        summary = ", ".join(f"{count} {name}" for name, count in totals.items())
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {summary} in {elapsed:.1f}s "
+                f"(users log in as seed<id>@example.com / {PASSWORD})"
+            )
+        )
@@ -0,0 +1,319 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: a single process, nothing to lock against
+    fcntl = None
+
+USED = struct.Struct("<Q")
+ENTRY = struct.Struct("<II")
+VALUE = struct.Struct("<d")
+INITIAL_SIZE = 1 << 16
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def metrics_file() -> str:
+    default = os.path.join(tempfile.gettempdir(), "sm_activity_metrics.bin")
+    return str(getattr(settings, "METRICS_FILE", default))
+
+
+def padded(length: int) -> int:
+    return (length + 7) & ~7
+
+
+def is_alive(pid: int) -> bool:
+    if fcntl is None:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedValues:
+    """
+    Float values shared by the worker processes through a memory-mapped
+    file: a `used` header, then `(pid, key length, key, value)` entries.
+    Each process appends the entries it writes and then updates them in
+    place, so only appends take the file lock. Entries of dead processes
+    are taken over by the next process writing the same key, keeping both
+    the sums and the file size stable across worker restarts. Readers add
+    up the entries of every process per key.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.file_lock():
+            if os.fstat(self.fd).st_size < INITIAL_SIZE:
+                os.ftruncate(self.fd, INITIAL_SIZE)
+            self.map = mmap.mmap(self.fd, os.fstat(self.fd).st_size)
+        self.adopt_process()
+
+    def adopt_process(self) -> None:
+        """Forget the entries of the parent after a fork"""
+        self.pid = os.getpid()
+        self.offsets = {}
+
+    @contextmanager
+    def file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    def used(self) -> int:
+        return USED.unpack_from(self.map, 0)[0] or USED.size
+
+    def remap(self, size: int) -> None:
+        if len(self.map) < size:
+            self.map.close()
+            self.map = mmap.mmap(self.fd, os.fstat(self.fd).st_size)
+
+    def entries(self):
+        """`(entry offset, pid, key, value offset)` of every entry"""
+        offset, used = USED.size, self.used()
+        self.remap(used)
+        while offset < used:
+            pid, length = ENTRY.unpack_from(self.map, offset)
+            start = offset + ENTRY.size
+            key = bytes(self.map[start : start + length])
+            value_offset = start + padded(length)
+            yield offset, pid, key, value_offset
+            offset = value_offset + VALUE.size
+
+    def claim(self, key: tuple) -> int:
+        """Value offset of this process's entry for the key, taken or added"""
+        encoded = json.dumps(key).encode()
+        with self.file_lock():
+            for offset, pid, entry_key, value_offset in self.entries():
+                if entry_key == encoded and (pid == self.pid or not is_alive(pid)):
+                    ENTRY.pack_into(self.map, offset, self.pid, len(encoded))
+                    return value_offset
+
+            offset = self.used()
+            end = offset + ENTRY.size + padded(len(encoded)) + VALUE.size
+            size = len(self.map)
+            if end > size:
+                while end > size:
+                    size *= 2
+                os.ftruncate(self.fd, size)
+                self.remap(size)
+            ENTRY.pack_into(self.map, offset, self.pid, len(encoded))
+            start = offset + ENTRY.size
+            self.map[start : start + len(encoded)] = encoded
+            VALUE.pack_into(self.map, end - VALUE.size, 0.0)
+            USED.pack_into(self.map, 0, end)
+            return end - VALUE.size
+
+    def add(self, increments) -> None:
+        """Add `amount` to each `(key, amount)` value"""
+        with self.lock:
+            if os.getpid() != self.pid:
+                self.adopt_process()
+            for key, amount in increments:
+                offset = self.offsets.get(key)
+                if offset is None:
+                    offset = self.offsets[key] = self.claim(key)
+                (value,) = VALUE.unpack_from(self.map, offset)
+                VALUE.pack_into(self.map, offset, value + amount)
+
+    def snapshot(self) -> dict:
+        """key -> value summed over every process"""
+        totals = {}
+        with self.lock:
+            for _, _, key, value_offset in self.entries():
+                name, labels = json.loads(key)
+                key = (name, tuple(labels))
+                (value,) = VALUE.unpack_from(self.map, value_offset)
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store() -> SharedValues:
+    path = metrics_file()
+    if path not in _stores:
+        with _stores_lock:
+            if path not in _stores:
+                _stores[path] = SharedValues(path)
+    return _stores[path]
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def sample_line(name: str, labels: dict, value: float) -> str:
+    if labels:
+        pairs = ",".join(f'{label}="{escape(v)}"' for label, v in labels.items())
+        name = f"{name}{{{pairs}}}"
+    return f"{name} {float(value)!r}"
+
+
+class Metric:
+    type = None
+    registry = []
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        Metric.registry.append(self)
+
+    def label_values(self, labels: dict) -> tuple:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self, snapshot: dict) -> list:
+        """`(name, labels, value)` of the metric in a snapshot"""
+        return [
+            (self.name, dict(zip(self.labels, values)), value)
+            for (name, values), value in sorted(snapshot.items())
+            if name == self.name
+        ]
+
+    def exposition(self, snapshot: dict) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(sample_line(*sample) for sample in self.samples(snapshot))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        store().add([((self.name, self.label_values(labels)), amount)])
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        values = self.label_values(labels)
+        index = bisect_left(self.buckets, value)
+        store().add(
+            [
+                ((f"{self.name}_bucket", values + (str(index),)), 1),
+                ((f"{self.name}_sum", values), value),
+                ((f"{self.name}_count", values), 1),
+            ]
+        )
+
+    def samples(self, snapshot: dict) -> list:
+        """Cumulative buckets; each stored bucket only counts its own range"""
+        bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        series = {}
+        for (name, values), value in snapshot.items():
+            if name == f"{self.name}_bucket":
+                counts = series.setdefault(values[:-1], [0.0] * len(bounds))
+                counts[int(values[-1])] += value
+
+        samples = []
+        for values, counts in sorted(series.items()):
+            labels = dict(zip(self.labels, values))
+            total = 0.0
+            for bound, count in zip(bounds, counts):
+                total += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": bound}, total))
+            for suffix in ("sum", "count"):
+                name = f"{self.name}_{suffix}"
+                samples.append((name, labels, snapshot.get((name, values), 0.0)))
+        return samples
+
+
+class HitRatio(Metric):
+    """Gauge computed at scrape time from a counter with a `result` label"""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, counter: Counter):
+        super().__init__(name, documentation, counter.labels[:-1])
+        self.counter = counter
+
+    def samples(self, snapshot: dict) -> list:
+        results = {}
+        for (name, values), value in snapshot.items():
+            if name == self.counter.name:
+                results.setdefault(values[:-1], {})[values[-1]] = value
+
+        samples = []
+        for values, counts in sorted(results.items()):
+            total = sum(counts.values())
+            ratio = counts.get("hit", 0.0) / total if total else 0.0
+            samples.append((self.name, dict(zip(self.labels, values)), ratio))
+        return samples
+
+
+REQUEST_DURATION = Histogram(
+    "sm_activity_request_duration_seconds",
+    "Time to answer a request, per view action and status class.",
+    ("view", "status"),
+)
+DB_QUERIES = Counter(
+    "sm_activity_db_queries_total",
+    "SQL queries run by requests, per view action.",
+    ("view",),
+)
+EVENTS = Counter(
+    "sm_activity_events_total",
+    "Likes, dislikes, follows, their undoing, comments, replies and registrations.",
+    ("event",),
+)
+CACHE_REQUESTS = Counter(
+    "sm_activity_cache_requests_total",
+    "Lookups of the detail and follow graph caches.",
+    ("cache", "result"),
+)
+CACHE_HIT_RATIO = HitRatio(
+    "sm_activity_cache_hit_ratio",
+    "Share of the cache lookups that were hits.",
+    CACHE_REQUESTS,
+)
+
+
+def observe_request(view, status_code: int, seconds: float, queries: int) -> None:
+    view = view or "unresolved"
+    REQUEST_DURATION.observe(seconds, view=view, status=f"{status_code // 100}xx")
+    DB_QUERIES.inc(queries, view=view)
+
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def exposition() -> str:
+    """Every registered metric in the Prometheus text format"""
+    snapshot = store().snapshot()
+    lines = []
+    for metric in Metric.registry:
+        lines.extend(metric.exposition(snapshot))
+    return "\n".join(lines) + "\n"
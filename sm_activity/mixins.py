@@ -0,0 +1,190 @@
+import hashlib
+
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from sm_activity import caching, graph, profiling
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.md5(":".join(str(part) for part in parts).encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def row_stamp(row) -> str:
+    """
+    `pk@updated_at` of a row and of the author or owner whose username it
+    is served with, which the querysets load through `select_related`
+    """
+    stamps = [f"{row.pk}@{row.updated_at.isoformat()}"]
+    for name in ("author", "owner"):
+        related = getattr(row, name, None)
+        if related is not None:
+            stamps.append(f"{name}@{related.updated_at.isoformat()}")
+    return ",".join(stamps)
+
+
+class CachedRetrieveMixin:
+    """
+    Serve `retrieve` from the versioned detail cache under `cache_kind`;
+    only the fields returned by `viewer_fields` are computed per request
+    """
+
+    cache_kind = None
+
+    def viewer_fields(self, viewer_id) -> dict:
+        return {}
+
+    def build_detail(self, instance) -> dict:
+        """The payload of `instance`, rendered on a cache miss only"""
+        return self.get_serializer(instance).data
+
+    def retrieve(self, request, *args, **kwargs):
+        data = caching.get_or_build(
+            self.cache_kind,
+            self.kwargs[self.lookup_field],
+            lambda: self.build_detail(self.get_object()),
+        )
+        viewer_id = graph.profile_id_for_user(request.user.id)
+        return Response({**data, **self.viewer_fields(viewer_id)})
+
+
+class ConditionalGetMixin:
+    """
+    Strong ETags for `retrieve` and, through `page_etag`, for lists and
+    custom actions, computed from the rows about to be served and their
+    authors or owners (and the detail cache version, when the view has a
+    `cache_kind`) before any serializer runs, so a matching If-None-Match
+    is answered with a 304.
+    The object is looked up, and its permissions checked, before comparing.
+    """
+
+    _object = None
+
+    def get_object(self):
+        """The object of the request, looked up and checked only once"""
+        if self._object is None:
+            self._object = super().get_object()
+        return self._object
+
+    def page_etag(self, rows) -> str:
+        """ETag of a page from the `row_stamp` of the rows it holds"""
+        return make_etag(
+            "list",
+            self.request.get_full_path(),
+            getattr(self.paginator, "has_next", None),
+            self.request.user.id,
+            *(row_stamp(row) for row in rows),
+        )
+
+    def detail_etag(self, instance) -> str:
+        version = ""
+        if getattr(self, "cache_kind", None):
+            version = caching.version(self.cache_kind, instance.pk)
+        return make_etag(
+            "detail",
+            instance._meta.label,
+            row_stamp(instance),
+            version,
+            self.request.user.id,
+        )
+
+    def conditional_response(self, request, etag, respond) -> Response:
+        if etag is not None:
+            client_etags = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+            if "*" in client_etags or etag in client_etags:
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+                response["ETag"] = etag
+                return response
+
+        response = respond()
+        if etag is not None and response.status_code == status.HTTP_200_OK:
+            response["ETag"] = etag
+            patch_vary_headers(response, ("Authorization",))
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        etag = self.detail_etag(self.get_object())
+        respond = super().retrieve
+        return self.conditional_response(
+            request, etag, lambda: respond(request, *args, **kwargs)
+        )
+
+    def paginated_response(self, rows) -> Response:
+        serializer = self.get_serializer(rows, many=True)
+        if self.paginator is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
+
+
+class ConditionalListMixin(ConditionalGetMixin):
+    """
+    ConditionalGetMixin for `list` too; kept apart because the router routes
+    `list` for any viewset that has the attribute, even without a parent one
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = self.paginate_queryset(queryset)
+        if rows is None:
+            rows = list(queryset)
+        return self.conditional_response(
+            request, self.page_etag(rows), lambda: self.paginated_response(rows)
+        )
+
+
+class ProfiledViewMixin:
+    """
+    Run a sampling profiler over the requests asking for it with the
+    profiling header (see `profiling.is_requested`), from the permission
+    checks to rendering, or to the last row of a streamed response; the
+    response names the files written in X-Profile-Id. The profile is
+    stopped however the request ends, errors in rendering included.
+    """
+
+    request_profile = None
+
+    def initial(self, request, *args, **kwargs):
+        if profiling.is_requested(request):
+            self.request_profile = profiling.RequestProfile(
+                f"{type(self).__name__}.{self.action}"
+            )
+            self.request_profile.start()
+        super().initial(request, *args, **kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except BaseException:
+            if self.request_profile is not None:
+                self.request_profile.stop()
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        request_profile = self.request_profile
+        if request_profile is None:
+            return response
+
+        response[profiling.RESPONSE_HEADER] = request_profile.name
+        if response.streaming:
+            response.streaming_content = request_profile.stop_after(
+                response.streaming_content
+            )
+            # a generator never started doesn't run its `finally` on close
+            response._resource_closers.append(request_profile.stop)
+        elif getattr(response, "is_rendered", True):
+            request_profile.stop()
+        else:
+            render = response.render
+
+            def render_and_stop():
+                try:
+                    return render()
+                finally:
+                    request_profile.stop()
+
+            response.render = render_and_stop
+        return response
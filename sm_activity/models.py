@@ -1,7 +1,7 @@
 import os
 import uuid
 
-from django.db import models
+from django.db import models, transaction
 from django.utils.text import slugify
 
 from user.models import User
@@ -18,15 +18,45 @@ def image_file_path(instance, filename):
     return os.path.join("uploads", f"{instance.__class__.__name__}s", filename)
 
 
-class Profile(models.Model):
+class CounterCacheModel(models.Model):
+    """
+    Model with denormalized counter columns. Counters are maintained by
+    F() updates only, so a regular save of an existing row must not
+    overwrite them with the possibly stale values loaded in memory.
+    The same holds for the columns in `computed_fields`, written by
+    background jobs.
+    """
+
+    counter_fields = ()
+    computed_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.name not in self.computed_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Profile(CounterCacheModel):
     class StatusChoices(models.TextChoices):
         Active = "Active"
         Abandoned = "Long out of touch"
         Unknown = "Unknown"
 
     username = models.CharField(max_length=30, unique=True)
+    username_lower = models.CharField(max_length=30, db_index=True, editable=False)
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
-    status = models.CharField(max_length=30, choices=StatusChoices.choices)
+    status = models.CharField(
+        max_length=30, choices=StatusChoices.choices, db_index=True
+    )
     followers = models.ManyToManyField(
         "self",
         related_name="follow_to",
@@ -34,39 +64,212 @@ class Profile(models.Model):
         blank=True,
     )
     created_at = models.DateField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     image = models.ImageField(blank=True)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.TextField(max_length=200)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    posts_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+
+    counter_fields = (
+        "followers_count",
+        "following_count",
+        "posts_count",
+        "comments_count",
+    )
+    computed_fields = ("image_renditions",)
 
     def __str__(self):
         return self.username
 
+    def save(self, *args, **kwargs):
+        self.username_lower = self.username.lower()
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = (
             "-created_at",
-            "status",
+            "-id",
         )
+        indexes = [
+            models.Index(
+                fields=("-created_at", "-id"), name="profile_created_id_idx"
+            ),
+        ]
 
 
-class Post(models.Model):
+class Post(CounterCacheModel):
     author = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="posts")
     title = models.CharField(max_length=200)
     body = models.TextField(max_length=1000)
     created_at = models.DateTimeField(auto_now_add=True)
-    likes = models.ManyToManyField(Profile, related_name="liked_posts")
-    dislikes = models.ManyToManyField(Profile, related_name="disliked_posts")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     image = models.ImageField(blank=True)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    likes_count = models.PositiveIntegerField(default=0)
+    dislikes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+
+    counter_fields = ("likes_count", "dislikes_count", "comments_count")
+    computed_fields = ("image_renditions",)
 
     class Meta:
-        ordering = ("-created_at",)
+        ordering = ("-created_at", "-id")
+        indexes = [
+            models.Index(fields=("-created_at", "-id"), name="post_created_id_idx"),
+            models.Index(
+                fields=("author", "-created_at", "-id"),
+                name="post_author_created_id_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.title}({self.author})"
 
 
-class Comment(models.Model):
+class Comment(CounterCacheModel):
+    """
+    Comments form reply threads through `parent`; `path` materializes the
+    chain of ancestor ids as fixed-width segments, so a thread or a subtree
+    is a single range scan of the (post, path) index in depth-first order.
+    Segments hold ids up to MAX_ID, and MAX_DEPTH + 1 of them fit in `path`.
+    """
+
+    PATH_STEP = 10
+    MAX_ID = 10**PATH_STEP - 1
+    MAX_DEPTH = 20
+
     post = models.ForeignKey(Post, related_name="comments", on_delete=models.CASCADE)
     owner = models.ForeignKey(
         Profile, related_name="comments", on_delete=models.CASCADE
     )
+    parent = models.ForeignKey(
+        "self",
+        related_name="replies",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    path = models.CharField(max_length=255, default="", editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     body = models.TextField(max_length=300)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    replies_count = models.PositiveIntegerField(default=0)
+
+    counter_fields = ("replies_count",)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=("post", "created_at", "id"), name="comment_post_created_idx"
+            ),
+            models.Index(fields=("post", "path"), name="comment_post_path_idx"),
+        ]
+
+    @classmethod
+    def path_segment(cls, pk: int) -> str:
+        if not 0 < pk <= cls.MAX_ID:
+            raise ValueError(f"Comment id {pk} doesn't fit in a path segment")
+        return str(pk).zfill(cls.PATH_STEP)
+
+    @classmethod
+    def path_ids(cls, path: str) -> list:
+        """The comment ids a path is made of, root first"""
+        step = cls.PATH_STEP
+        return [int(path[i : i + step]) for i in range(0, len(path), step)]
+
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        if creating and self.parent is not None:
+            self.depth = self.parent.depth + 1
+        if not creating or self.path:
+            return super().save(*args, **kwargs)
+        # the path needs the id, so it is written right after the insert;
+        # a comment is never seen, or left, without it
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+            parent_path = self.parent.path if self.parent is not None else ""
+            self.path = parent_path + self.path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
+
+class Reaction(models.Model):
+    class KindChoices(models.TextChoices):
+        Like = "like"
+        Dislike = "dislike"
+
+    post = models.ForeignKey(Post, related_name="reactions", on_delete=models.CASCADE)
+    profile = models.ForeignKey(
+        Profile, related_name="reactions", on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=7, choices=KindChoices.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("post", "profile"), name="unique_post_reaction"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=("profile", "kind"), name="reaction_profile_kind_idx"),
+            models.Index(
+                fields=("post", "kind", "-created_at"), name="reaction_post_kind_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.profile} {self.kind}s {self.post_id}"
+
+
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(
+        Profile, related_name="timeline", on_delete=models.CASCADE
+    )
+    post = models.ForeignKey(
+        Post, related_name="timeline_entries", on_delete=models.CASCADE
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ("-created_at",)
+        constraints = [
+            models.UniqueConstraint(
+                fields=("owner", "post"), name="unique_timeline_entry"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=("owner", "-created_at"), name="timeline_owner_created_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.owner}: {self.post_id}"
+
+
+class Blob(models.Model):
+    """
+    A stored media file named after the SHA-256 of its content, shared by
+    every Post or Profile that uploaded the same bytes. `refcount` counts the
+    image and rendition fields pointing at it; blobs nobody references are
+    removed by the collect_blobs command.
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    digest = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=("refcount", "updated_at"), name="blob_refcount_idx"),
+        ]
+
+    def __str__(self):
+        return self.name
@@ -1,5 +1,7 @@
 from rest_framework.permissions import SAFE_METHODS, BasePermission
 
+from sm_activity import graph
+
 
 class IsAdminOrIfAuthenticatedReadOnly(BasePermission):
     def has_permission(self, request, view):
@@ -21,14 +23,14 @@ class IsOwnerOrIfAuthenticatedReadOnly(BasePermission):
             and request.user.is_authenticated
         ):
             return True
-        if hasattr(obj, "author"):
-            return obj.author.user == request.user
+        if hasattr(obj, "author_id"):
+            return graph.user_id_for_profile(obj.author_id) == request.user.id
 
-        if hasattr(obj, "owner"):
-            return obj.owner.user == request.user
+        if hasattr(obj, "owner_id"):
+            return graph.user_id_for_profile(obj.owner_id) == request.user.id
 
-        if hasattr(obj, "user"):
-            return obj.user == request.user
+        if hasattr(obj, "user_id"):
+            return obj.user_id == request.user.id
 
         return False
 
@@ -39,13 +41,19 @@ class IsOwnerOrIfFollowerReadOnly(BasePermission):
             request.method in SAFE_METHODS
             and request.user
             and request.user.is_authenticated
-            and request.user.profile
-            and request.user.profile in obj.followers.all()
         ):
-            return True
+            profile_id = graph.profile_id_for_user(request.user.id)
+            if profile_id is not None and graph.is_following(profile_id, obj.pk):
+                return True
 
-        if hasattr(obj, "user"):
-            return obj.user == request.user
+        if hasattr(obj, "user_id"):
+            return obj.user_id == request.user.id
 
         return False
 
+
+class IsOwnerOrAdmin(BasePermission):
+    def has_object_permission(self, request, view, obj):
+        return bool(request.user and request.user.is_staff) or (
+            obj.user_id == request.user.id
+        )
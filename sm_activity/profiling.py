@@ -0,0 +1,220 @@
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+
+from sm_activity.querylog import (
+    add_execute_wrapper,
+    format_queries,
+    remove_execute_wrapper,
+)
+
+HEADER = "X-Profile-Request"
+RESPONSE_HEADER = "X-Profile-Id"
+SALT = "sm_activity.profiling"
+TOKEN_VALUE = "profile"
+
+
+def profiles_dir() -> Path:
+    return Path(getattr(settings, "PROFILING_DIR", "profiles"))
+
+
+def interval() -> float:
+    return getattr(settings, "PROFILING_INTERVAL", 0.005)
+
+
+def token_max_age() -> int:
+    return getattr(settings, "PROFILING_TOKEN_MAX_AGE", 3600)
+
+
+def make_token() -> str:
+    """A value of the profiling header for anyone, until it expires"""
+    return signing.TimestampSigner(salt=SALT).sign(TOKEN_VALUE)
+
+
+def is_requested(request) -> bool:
+    """
+    Whether a DRF request asks to be profiled: staff users only have to
+    send the header, everyone else needs a token from `make_token`
+    """
+    value = request.headers.get(HEADER)
+    if not value:
+        return False
+    if request.user.is_staff:
+        return True
+    try:
+        signed = signing.TimestampSigner(salt=SALT).unsign(
+            value, max_age=token_max_age()
+        )
+    except signing.BadSignature:
+        return False
+    return signed == TOKEN_VALUE
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class StackSampler:
+    """Sample counts of the stacks of one thread, by collapsed stack"""
+
+    mode = None
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+
+    def sample(self, frame) -> None:
+        labels = []
+        while frame is not None:
+            labels.append(frame_label(frame))
+            frame = frame.f_back
+        self.stacks[";".join(reversed(labels))] += 1
+
+    def collapsed(self) -> str:
+        """The `frame;frame;frame count` lines flame graph tools read"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+class SignalSampler(StackSampler):
+    """
+    Samples the main thread from a wall-clock interval timer, so the
+    profiled code runs untouched between samples; one at a time per process
+    """
+
+    mode = "signal timer"
+    lock = threading.Lock()
+
+    @classmethod
+    def available(cls) -> bool:
+        return (
+            hasattr(signal, "setitimer")
+            and threading.current_thread() is threading.main_thread()
+        )
+
+    def start(self) -> bool:
+        if not self.available() or not self.lock.acquire(blocking=False):
+            return False
+        self.previous = signal.signal(signal.SIGALRM, self.handle)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        return True
+
+    def handle(self, signum, frame) -> None:
+        self.sample(frame)
+
+    def stop(self) -> None:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self.previous)
+        self.lock.release()
+
+
+class ProfileHookSampler(StackSampler):
+    """
+    Fallback for worker threads and busy timers: a `sys.setprofile` hook of
+    the current thread that samples on the first call or return after each
+    interval
+    """
+
+    mode = "setprofile"
+
+    def start(self) -> bool:
+        self.next_sample = time.perf_counter() + self.interval
+        sys.setprofile(self.hook)
+        return True
+
+    def hook(self, frame, event, arg) -> None:
+        now = time.perf_counter()
+        if now >= self.next_sample:
+            self.next_sample = now + self.interval
+            self.sample(frame)
+
+    def stop(self) -> None:
+        sys.setprofile(None)
+
+
+class QueryRecorder:
+    """`connection.execute_wrapper` hook keeping every statement and its time"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries.append({"sql": sql, "time": duration})
+
+
+class RequestProfile:
+    """
+    Stack samples and SQL of one request, written to PROFILING_DIR as
+    `<name>.collapsed` and `<name>.sql` when it stops; stopping more than
+    once is harmless, so every way a request can end may stop it
+    """
+
+    def __init__(self, view: str):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.name = f"{stamp}-{view}-{uuid.uuid4().hex[:8]}"
+        self.view = view
+        self.sampler = None
+        self.queries = QueryRecorder()
+        self.running = False
+
+    def start(self) -> None:
+        for sampler_class in (SignalSampler, ProfileHookSampler):
+            sampler = sampler_class(interval())
+            if sampler.start():
+                self.sampler = sampler
+                break
+        add_execute_wrapper(self.queries)
+        self.started = time.perf_counter()
+        self.running = True
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+        self.running = False
+        elapsed = time.perf_counter() - self.started
+        try:
+            self.sampler.stop()
+        finally:
+            remove_execute_wrapper(self.queries)
+        self.write(elapsed)
+
+    def stop_after(self, content):
+        """Streamed `content` that stops the profile once it was sent"""
+        try:
+            yield from content
+        finally:
+            self.stop()
+
+    def write(self, elapsed: float) -> None:
+        directory = profiles_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"{self.name}.collapsed").write_text(self.sampler.collapsed())
+
+        queries = self.queries.queries
+        sql_time = sum(query["time"] for query in queries)
+        lines = [
+            f"# {self.view}: {elapsed * 1000:.1f} ms, "
+            f"{sum(self.sampler.stacks.values())} samples every "
+            f"{self.sampler.interval * 1000:g} ms ({self.sampler.mode}), "
+            f"{len(queries)} queries in {sql_time * 1000:.1f} ms",
+            "",
+            format_queries(queries),
+            "",
+        ]
+        lines.extend(
+            f"{query['time'] * 1000:8.2f} ms  {query['sql']}" for query in queries
+        )
+        (directory / f"{self.name}.sql").write_text("\n".join(lines) + "\n")
@@ -0,0 +1,53 @@
+import re
+from collections import Counter
+
+from django.db import connections
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"(?<![\w.\"])-?\d+(?:\.\d+)?\b")
+PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+SPACES = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    The shape of a statement: literals and placeholders become `?` and IN
+    lists collapse to `(...)`, so the queries of an N+1 loop look the same
+    """
+    sql = STRING.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    sql = NUMBER.sub("?", sql)
+    sql = PLACEHOLDER_LIST.sub("(...)", sql)
+    return SPACES.sub(" ", sql).strip()
+
+
+def group_queries(queries) -> list:
+    """
+    `(count, normalized statement)` pairs, most repeated first, from the
+    `{"sql": ...}` dicts of `connection.queries` or a CaptureQueriesContext
+    """
+    counts = Counter(normalize_sql(query["sql"]) for query in queries)
+    return sorted(
+        ((count, sql) for sql, count in counts.items()), key=lambda row: -row[0]
+    )
+
+
+def format_queries(queries) -> str:
+    return "\n".join(f"{count:>4} x {sql}" for count, sql in group_queries(queries))
+
+
+def add_execute_wrapper(wrapper) -> None:
+    """
+    Install an execute wrapper on every connection of the thread. Unlike
+    `connection.execute_wrapper`, which pops the last wrapper on exit, the
+    wrapper is later removed by identity, so wrappers outliving the view,
+    like those timing streamed responses, may be removed in any order.
+    """
+    for connection in connections.all():
+        connection.execute_wrappers.append(wrapper)
+
+
+def remove_execute_wrapper(wrapper) -> None:
+    for connection in connections.all():
+        if wrapper in connection.execute_wrappers:
+            connection.execute_wrappers.remove(wrapper)
@@ -0,0 +1,273 @@
+import atexit
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from sm_activity import caching
+from sm_activity.counters import increment
+from sm_activity.models import Post, Reaction
+
+LIKE = Reaction.KindChoices.Like.value
+DISLIKE = Reaction.KindChoices.Dislike.value
+
+COUNTERS = {
+    LIKE: "likes_count",
+    DISLIKE: "dislikes_count",
+}
+OPPOSITES = {LIKE: DISLIKE, DISLIKE: LIKE}
+
+
+def counts(post_id: int) -> dict:
+    likes, dislikes = (
+        Post.objects.filter(pk=post_id)
+        .values_list("likes_count", "dislikes_count")
+        .get()
+    )
+    return {"likes": likes, "dislikes": dislikes}
+
+
+def current_kind(post_id: int, profile_id: int):
+    """The reaction of a profile to a post, one probe of the unique index"""
+    return (
+        Reaction.objects.filter(post_id=post_id, profile_id=profile_id)
+        .values_list("kind", flat=True)
+        .first()
+    )
+
+
+def toggle(post_id: int, profile_id: int, kind: str):
+    """
+    Flip the `kind` reaction of a profile to a post with an indexed
+    DELETE and, when nothing was deleted, an INSERT guarded by the unique
+    `(post, profile)` constraint. Returns the new state and counters, or
+    None when the profile already holds the opposite reaction.
+    """
+    counter = COUNTERS[kind]
+    post = Post.objects.filter(pk=post_id)
+    reaction = Reaction.objects.filter(post_id=post_id, profile_id=profile_id)
+
+    with transaction.atomic():
+        removed, _ = reaction.filter(kind=kind).delete()
+        if removed:
+            increment(post, **{counter: -1})
+            caching.bump(caching.POST, post_id)
+            return {"active": False, **counts(post_id)}
+
+        try:
+            with transaction.atomic():
+                Reaction.objects.create(
+                    post_id=post_id, profile_id=profile_id, kind=kind
+                )
+        except IntegrityError:
+            if current_kind(post_id, profile_id) != kind:
+                return None
+            # a concurrent request of the same profile inserted the row first
+        else:
+            increment(post, **{counter: 1})
+            caching.bump(caching.POST, post_id)
+        return {"active": True, **counts(post_id)}
+
+
+class DirectReactionBackend:
+    """Write every reaction to the database within the request"""
+
+    def toggle(self, post_id: int, profile_id: int, kind: str):
+        return toggle(post_id, profile_id, kind)
+
+    def current_kind(self, post_id: int, profile_id: int):
+        return current_kind(post_id, profile_id)
+
+
+class BufferedReactionBackend:
+    """
+    Write-behind reactions for hot posts: toggles are coalesced in an
+    in-process buffer and flushed in batches: one read of the stored rows,
+    one bulk delete and one bulk insert per flush, then one counter update
+    per flushed post with the changes actually written, since the buffer
+    of another process can have stored some of them already. Toggles are
+    flushed at most REACTION_FLUSH_INTERVAL seconds later, by the next
+    toggle or a timer; until then, and until the flush commits, the
+    reacting profile reads its own writes from the buffer.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # one flush at a time, so `flushing` holds a single batch
+        self.flush_lock = threading.Lock()
+        # (post_id, profile_id) -> [kind stored in the database, buffered kind]
+        self.pending = {}
+        # post_id -> {counter: delta}
+        self.deltas = defaultdict(lambda: defaultdict(int))
+        # the batch being written: (post_id, profile_id) -> kind, post deltas
+        self.flushing = {}
+        self.flushing_deltas = {}
+        self.last_flush = time.monotonic()
+        self.timer = None
+        atexit.register(self.flush)
+
+    @property
+    def batch_size(self) -> int:
+        return getattr(settings, "REACTION_BUFFER_SIZE", 500)
+
+    @property
+    def flush_interval(self) -> float:
+        return getattr(settings, "REACTION_FLUSH_INTERVAL", 2.0)
+
+    def buffered_kind(self, key):
+        """`(found, kind)` of a reaction in the buffer or the batch in flight"""
+        if key in self.pending:
+            return True, self.pending[key][1]
+        if key in self.flushing:
+            return True, self.flushing[key]
+        return False, None
+
+    def current_kind(self, post_id: int, profile_id: int):
+        """The reaction of a profile to a post, buffered toggles included"""
+        with self.lock:
+            found, kind = self.buffered_kind((post_id, profile_id))
+        if found:
+            return kind
+        return current_kind(post_id, profile_id)
+
+    def toggle(self, post_id: int, profile_id: int, kind: str):
+        key = (post_id, profile_id)
+        with self.lock:
+            found, _ = self.buffered_kind(key)
+        stored = None if found else current_kind(post_id, profile_id)
+
+        with self.lock:
+            if key in self.pending:
+                stored, current = self.pending[key]
+            else:
+                # what the database holds once the batch in flight commits
+                found, flushing = self.buffered_kind(key)
+                if found:
+                    stored = flushing
+                current = stored
+
+            if current == OPPOSITES[kind]:
+                return None
+
+            new = None if current == kind else kind
+            self.pending[key] = [stored, new]
+            if stored == new:
+                del self.pending[key]
+
+            delta = self.deltas[post_id]
+            if current is not None:
+                delta[COUNTERS[current]] -= 1
+            if new is not None:
+                delta[COUNTERS[new]] += 1
+            in_flight = self.flushing_deltas.get(post_id, {})
+            buffered = {
+                "likes": delta["likes_count"] + in_flight.get("likes_count", 0),
+                "dislikes": delta["dislikes_count"]
+                + in_flight.get("dislikes_count", 0),
+            }
+            should_flush = (
+                len(self.pending) >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval
+            )
+            if not should_flush and self.timer is None:
+                self.timer = threading.Timer(
+                    self.flush_interval, self.flush_in_background
+                )
+                self.timer.daemon = True
+                self.timer.start()
+
+        if should_flush:
+            self.flush()
+            return {"active": new is not None, **counts(post_id)}
+
+        result = counts(post_id)
+        result["likes"] += buffered["likes"]
+        result["dislikes"] += buffered["dislikes"]
+        return {"active": new is not None, **result}
+
+    def flush_in_background(self) -> None:
+        try:
+            self.flush()
+        finally:
+            # the timer thread's own connections
+            connections.close_all()
+
+    def flush(self) -> int:
+        """Write the buffered reactions, returns the number of buffered toggles"""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                self.flushing = {key: new for key, (_, new) in pending.items()}
+                self.flushing_deltas = self.deltas
+                self.deltas = defaultdict(lambda: defaultdict(int))
+                self.last_flush = time.monotonic()
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+            if not pending:
+                return 0
+            try:
+                post_ids = self.write(pending)
+            finally:
+                with self.lock:
+                    self.flushing, self.flushing_deltas = {}, {}
+        caching.bump(caching.POST, *post_ids)
+        return len(pending)
+
+    def write(self, pending: dict) -> list:
+        """
+        Store the buffered kinds and shift the counters by the rows changed,
+        in one transaction; returns the ids of the posts written
+        """
+        keys = Q()
+        for post_id, profile_id in pending:
+            keys |= Q(post_id=post_id, profile_id=profile_id)
+
+        with transaction.atomic():
+            stored = {
+                (post_id, profile_id): kind
+                for post_id, profile_id, kind in Reaction.objects.filter(
+                    keys
+                ).values_list("post_id", "profile_id", "kind")
+            }
+            removals = Q()
+            additions = []
+            deltas = defaultdict(lambda: defaultdict(int))
+            for (post_id, profile_id), (_, new) in pending.items():
+                old = stored.get((post_id, profile_id))
+                if old == new:
+                    continue
+                if old is not None:
+                    removals |= Q(post_id=post_id, profile_id=profile_id)
+                    deltas[post_id][COUNTERS[old]] -= 1
+                if new is not None:
+                    additions.append(
+                        Reaction(post_id=post_id, profile_id=profile_id, kind=new)
+                    )
+                    deltas[post_id][COUNTERS[new]] += 1
+
+            if removals:
+                Reaction.objects.filter(removals).delete()
+            Reaction.objects.bulk_create(
+                additions, batch_size=1000, ignore_conflicts=True
+            )
+            for post_id, counters in deltas.items():
+                increment(Post.objects.filter(pk=post_id), **counters)
+        return sorted({post_id for post_id, _ in pending})
+
+
+_backends = {}
+
+
+def get_backend():
+    """The process-wide reaction backend configured by REACTION_BACKEND"""
+    path = getattr(
+        settings, "REACTION_BACKEND", "sm_activity.reactions.DirectReactionBackend"
+    )
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
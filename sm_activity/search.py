@@ -0,0 +1,174 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+
+from sm_activity.models import Post, Profile
+
+FTS_TABLE = "sm_activity_post_fts"
+PG_INDEX = "sm_activity_post_search_idx"
+PG_DOCUMENT = "to_tsvector('english', title || ' ' || body)"
+PG_TRIGRAM_INDEX = "sm_activity_profile_username_trgm_idx"
+
+
+def max_results() -> int:
+    return getattr(settings, "SEARCH_MAX_RESULTS", 1000)
+
+
+def max_suggestions() -> int:
+    return getattr(settings, "SUGGEST_MAX_RESULTS", 20)
+
+
+def ensure_index(using: str = DEFAULT_DB_ALIAS) -> None:
+    """
+    Create the full-text index of posts: an FTS5 table kept in sync by
+    signals on SQLite, a GIN expression index on PostgreSQL
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                "USING fts5(title, body)"
+            )
+        elif connection.vendor == "postgresql":
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {PG_INDEX} "
+                f"ON {Post._meta.db_table} USING GIN ({PG_DOCUMENT})"
+            )
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {PG_TRIGRAM_INDEX} "
+                f"ON {Profile._meta.db_table} "
+                "USING GIN (username_lower gin_trgm_ops)"
+            )
+
+
+def index_post(post: Post, using: str = DEFAULT_DB_ALIAS) -> None:
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {FTS_TABLE} (rowid, title, body) "
+            "VALUES (%s, %s, %s)",
+            [post.pk, post.title, post.body],
+        )
+
+
+def remove_post(post_id: int, using: str = DEFAULT_DB_ALIAS) -> None:
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [post_id])
+
+
+def rebuild_index(using: str = DEFAULT_DB_ALIAS) -> None:
+    connection = connections[using]
+    ensure_index(using)
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, body) "
+                f"SELECT id, title, body FROM {Post._meta.db_table}"
+            )
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"
+            )
+        elif connection.vendor == "postgresql":
+            cursor.execute(f"REINDEX INDEX {PG_INDEX}")
+            cursor.execute(f"REINDEX INDEX {PG_TRIGRAM_INDEX}")
+
+
+def fts5_query(text: str) -> str:
+    """Quote every term so user input can't use the FTS5 query syntax"""
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in text.split())
+
+
+def search(text: str, using: str = DEFAULT_DB_ALIAS) -> list:
+    """Ids of the posts matching `text` in title or body, best match first"""
+    connection = connections[using]
+    if not text.split():
+        return []
+
+    if connection.vendor == "sqlite":
+        sql = (
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            "ORDER BY rank LIMIT %s"
+        )
+        params = [fts5_query(text), max_results()]
+    elif connection.vendor == "postgresql":
+        sql = (
+            f"SELECT id FROM {Post._meta.db_table} "
+            f"WHERE {PG_DOCUMENT} @@ plainto_tsquery('english', %s) "
+            f"ORDER BY ts_rank({PG_DOCUMENT}, plainto_tsquery('english', %s)) "
+            "DESC, id DESC LIMIT %s"
+        )
+        params = [text, text, max_results()]
+    else:
+        return list(
+            Post.objects.using(using)
+            .filter(Q(title__icontains=text) | Q(body__icontains=text))
+            .values_list("id", flat=True)[: max_results()]
+        )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def username_prefix(prefix: str, using: str = DEFAULT_DB_ALIAS) -> Q:
+    """
+    Sargable prefix match on the lowercase username: a LIKE 'x%' served by
+    the pattern-ops index Django creates on PostgreSQL, and a plain range
+    elsewhere since SQLite's case-insensitive LIKE can't use the index
+    """
+    prefix = prefix.lower()
+    if connections[using].vendor == "postgresql":
+        return Q(username_lower__startswith=prefix)
+    return Q(username_lower__gte=prefix, username_lower__lt=prefix + "\U0010ffff")
+
+
+def username_filter(text: str) -> Q:
+    """
+    Case-insensitive substring match, served by the trigram index on
+    PostgreSQL; prefix matching is left to `suggest_usernames`
+    """
+    return Q(username_lower__contains=text.lower())
+
+
+def suggest_usernames(prefix: str, limit: int, using: str = DEFAULT_DB_ALIAS):
+    """
+    At most `limit` profiles for username typeahead: prefix matches in
+    username order, topped up with the closest trigram matches on PostgreSQL
+    """
+    limit = min(limit, max_suggestions())
+    if not prefix or limit <= 0:
+        return []
+
+    profiles = (
+        Profile.objects.using(using)
+        .filter(username_prefix(prefix, using))
+        .order_by("username_lower")
+        .only("id", "username", "image", "image_renditions")
+    )
+    suggestions = list(profiles[:limit])
+
+    missing = limit - len(suggestions)
+    if missing and connections[using].vendor == "postgresql":
+        found = [profile.pk for profile in suggestions]
+        similar = (
+            Profile.objects.using(using)
+            .extra(
+                where=["username_lower %% %s"],
+                params=[prefix.lower()],
+                select={"similarity": "similarity(username_lower, %s)"},
+                select_params=[prefix.lower()],
+                order_by=["-similarity"],
+            )
+            .exclude(pk__in=found)
+            .only("id", "username", "image", "image_renditions")
+        )
+        suggestions.extend(similar[:missing])
+    return suggestions
@@ -0,0 +1,229 @@
+import random
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from sm_activity import search
+from sm_activity.bulk_import import kept_timestamps, reset_sequences
+from sm_activity.counters import recount_posts, recount_profiles, recount_replies
+from sm_activity.models import Comment, Post, Profile, Reaction
+from user.models import User
+
+Follow = Profile.followers.through
+PASSWORD = "seed-password"
+WORDS = (
+    "summer trip coffee music city night friends photo weekend sunset food "
+    "book movie running mountain beach work project idea travel morning rain "
+    "garden code design art game dog cat walk river snow"
+).split()
+
+
+def next_id(model) -> int:
+    return (model.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+
+
+def insert(model, objects, batch_size: int, **options) -> int:
+    """bulk_create an iterable of unsaved objects without materializing it"""
+    objects = iter(objects)
+    inserted = 0
+    while batch := list(islice(objects, batch_size)):
+        model.objects.bulk_create(batch, **options)
+        inserted += len(batch)
+    return inserted
+
+
+class GraphSeeder:
+    """
+    Synthetic social graph shaped like production: followers follow a
+    Zipf law over profiles (a few celebrities, a long tail), posts, comments
+    and reactions are skewed towards popular authors, and replies nest under
+    earlier comments of the same post. Everything is written with
+    bulk_create using precomputed ids, then the counters and the search
+    index are rebuilt once.
+    """
+
+    def __init__(
+        self,
+        profiles: int,
+        following: int = 20,
+        posts: float = 5,
+        comments: float = 3,
+        reactions: float = 10,
+        alpha: float = 1.1,
+        days: int = 365,
+        batch_size: int = 5000,
+        seed: int = None,
+    ):
+        self.profiles = profiles
+        self.following = following
+        self.posts = posts
+        self.comments = comments
+        self.reactions = reactions
+        self.alpha = alpha
+        self.days = days
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.now = timezone.now()
+
+    def count(self, mean: float) -> int:
+        """A non-negative, right-skewed count with the given mean"""
+        return int(self.random.expovariate(1 / mean)) if mean > 0 else 0
+
+    def past(self, seconds: float):
+        """A random moment of the last `seconds` seconds"""
+        return self.now - timedelta(seconds=self.random.uniform(0, seconds))
+
+    def run(self) -> dict:
+        with transaction.atomic(), kept_timestamps(Post, Comment):
+            profile_ids = self.seed_profiles()
+            # popularity rank is a random permutation of the profiles
+            ranked = self.random.sample(profile_ids, len(profile_ids))
+            weights = [1 / rank**self.alpha for rank in range(1, len(ranked) + 1)]
+            popularity = dict(zip(ranked, weights))
+            cum_weights = list(accumulate(weights))
+
+            totals = {"profiles": len(profile_ids)}
+            totals["follows"] = self.seed_follows(profile_ids, ranked, cum_weights)
+            post_authors = self.seed_posts(profile_ids, popularity)
+            totals["posts"] = len(post_authors)
+            totals["comments"] = self.seed_comments(post_authors, ranked, cum_weights)
+            totals["reactions"] = self.seed_reactions(
+                post_authors, ranked, cum_weights, popularity
+            )
+            reset_sequences((User, Profile, Post, Comment))
+
+        recount_profiles()
+        recount_posts()
+        recount_replies()
+        search.rebuild_index()
+        return totals
+
+    def seed_profiles(self) -> list:
+        first_user, first_profile = next_id(User), next_id(Profile)
+        password = make_password(PASSWORD)
+        statuses = [choice for choice, _ in Profile.StatusChoices.choices]
+        insert(
+            User,
+            (
+                User(
+                    id=first_user + n,
+                    email=f"seed{first_user + n}@example.com",
+                    password=password,
+                )
+                for n in range(self.profiles)
+            ),
+            self.batch_size,
+        )
+        insert(
+            Profile,
+            (
+                Profile(
+                    id=first_profile + n,
+                    user_id=first_user + n,
+                    username=f"seed{first_profile + n}",
+                    username_lower=f"seed{first_profile + n}",
+                    status=self.random.choice(statuses),
+                    bio="Seeded profile",
+                )
+                for n in range(self.profiles)
+            ),
+            self.batch_size,
+        )
+        return list(range(first_profile, first_profile + self.profiles))
+
+    def seed_follows(self, profile_ids, ranked, cum_weights) -> int:
+        def follows():
+            for follower in profile_ids:
+                wanted = min(self.count(self.following), len(ranked) - 1)
+                drawn = set(
+                    self.random.choices(ranked, cum_weights=cum_weights, k=wanted)
+                )
+                drawn.discard(follower)
+                for followee in drawn:
+                    yield Follow(from_profile_id=followee, to_profile_id=follower)
+
+        return insert(Follow, follows(), self.batch_size, ignore_conflicts=True)
+
+    def seed_posts(self, profile_ids, popularity) -> list:
+        """Authors of the new posts, indexed by post id - first post id"""
+        first_post = next_id(Post)
+        mean_weight = sum(popularity.values()) / len(popularity)
+        authors = []
+        for author in profile_ids:
+            boost = min(max(popularity[author] / mean_weight, 0.5), 20)
+            authors.extend([author] * self.count(self.posts * boost))
+        self.random.shuffle(authors)
+
+        self.first_post = first_post
+        self.post_times = [self.past(self.days * 86400) for _ in authors]
+
+        def posts():
+            for n, author in enumerate(authors):
+                yield Post(
+                    id=first_post + n,
+                    author_id=author,
+                    title=f"Seeded post {first_post + n}",
+                    body=" ".join(self.random.choices(WORDS, k=30)),
+                    created_at=self.post_times[n],
+                )
+
+        insert(Post, posts(), self.batch_size)
+        return authors
+
+    def seed_comments(self, post_authors, ranked, cum_weights) -> int:
+        first_comment = next_id(Comment)
+
+        def comments():
+            pk = first_comment
+            for n in range(len(post_authors)):
+                thread = []
+                for _ in range(self.count(self.comments)):
+                    parent = None
+                    if thread and self.random.random() < 0.4:
+                        parent = self.random.choice(thread)
+                        if parent.depth >= Comment.MAX_DEPTH:
+                            parent = None
+                    owner = self.random.choices(ranked, cum_weights=cum_weights)[0]
+                    comment = Comment(
+                        id=pk,
+                        post_id=self.first_post + n,
+                        owner_id=owner,
+                        parent_id=parent.pk if parent else None,
+                        depth=parent.depth + 1 if parent else 0,
+                        path=(parent.path if parent else "") + Comment.path_segment(pk),
+                        body=" ".join(self.random.choices(WORDS, k=8)),
+                        created_at=self.past(
+                            (self.now - self.post_times[n]).total_seconds()
+                        ),
+                    )
+                    thread.append(comment)
+                    pk += 1
+                    yield comment
+
+        return insert(Comment, comments(), self.batch_size)
+
+    def seed_reactions(self, post_authors, ranked, cum_weights, popularity) -> int:
+        mean_weight = sum(popularity.values()) / len(popularity)
+
+        def reactions():
+            for n, author in enumerate(post_authors):
+                boost = min(max(popularity[author] / mean_weight, 0.5), 50)
+                wanted = min(self.count(self.reactions * boost), len(ranked))
+                drawn = set(
+                    self.random.choices(ranked, cum_weights=cum_weights, k=wanted)
+                )
+                for profile in drawn:
+                    kind = (
+                        Reaction.KindChoices.Like
+                        if self.random.random() < 0.85
+                        else Reaction.KindChoices.Dislike
+                    )
+                    yield Reaction(
+                        post_id=self.first_post + n, profile_id=profile, kind=kind
+                    )
+
+        return insert(Reaction, reactions(), self.batch_size, ignore_conflicts=True)
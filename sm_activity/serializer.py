@@ -1,26 +1,110 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import models
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers, status
 from rest_framework.decorators import permission_classes, api_view
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from sm_activity.models import Profile, Comment, Post
+from sm_activity import images
+from sm_activity.instrumentation import TimedModelSerializer
+from sm_activity.models import Profile, Comment, Post, Reaction
 
 
-class CommentSerializer(serializers.ModelSerializer):
+@extend_schema_field(OpenApiTypes.OBJECT)
+class ImageRenditionsField(serializers.Field):
+    """
+    URLs of the renditions of the object's image by width and format,
+    empty until they are rendered from the current image
+    """
+
+    def __init__(self, **kwargs):
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance) -> dict:
+        if not images.is_current(instance):
+            return {}
+        request = self.context.get("request")
+        urls = {}
+        for width, files in instance.image_renditions["renditions"].items():
+            urls[width] = {}
+            for extension, name in files.items():
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                urls[width][extension] = url
+        return urls
+
+
+class UploadedImageField(serializers.ImageField):
+    """
+    ImageField also rejecting the uploads no rendition could be made from,
+    corrupt or over IMAGE_MAX_PIXELS, before they are stored
+    """
+
+    default_error_messages = {
+        "too_large": "Upload an image of at most {max_pixels} pixels.",
+    }
+
+    def to_internal_value(self, data):
+        file = super().to_internal_value(data)
+        file.seek(0)
+        try:
+            images.check(file.read(), images.max_pixels())
+        except images.ImageTooLarge:
+            self.fail("too_large", max_pixels=images.max_pixels())
+        except images.INVALID_IMAGE_ERRORS:
+            self.fail("invalid_image")
+        finally:
+            file.seek(0)
+        return file
+
+
+# for the serializers images are uploaded through
+UPLOAD_FIELD_MAPPING = {
+    **serializers.ModelSerializer.serializer_field_mapping,
+    models.ImageField: UploadedImageField,
+}
+
+
+class CommentSerializer(TimedModelSerializer):
     owner = serializers.CharField(source="owner.username", read_only=True)
 
     class Meta:
         model = Comment
-        fields = ("id", "body", "created_at", "owner")
+        fields = ("id", "body", "created_at", "owner", "replies_count")
+        read_only_fields = ("replies_count",)
+
+
+class CommentThreadSerializer(TimedModelSerializer):
+    owner = serializers.CharField(source="owner.username", read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = (
+            "id",
+            "parent",
+            "depth",
+            "body",
+            "owner",
+            "created_at",
+            "replies_count",
+        )
 
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(TimedModelSerializer):
+    serializer_field_mapping = UPLOAD_FIELD_MAPPING
+    image_renditions = ImageRenditionsField()
     followers = serializers.IntegerField(
-        source="followers.count",
+        source="followers_count",
         read_only=True,
     )
     follow_to = serializers.IntegerField(
-        source="follow_to.count",
+        source="following_count",
         read_only=True,
     )
     comments_count = serializers.IntegerField(read_only=True)
@@ -34,6 +118,7 @@ class ProfileSerializer(serializers.ModelSerializer):
             "user",
             "status",
             "image",
+            "image_renditions",
             "bio",
             "followers",
             "follow_to",
@@ -42,7 +127,8 @@ class ProfileSerializer(serializers.ModelSerializer):
         )
 
 
-class ProfileFollowSerializer(serializers.ModelSerializer):
+class ProfileFollowSerializer(TimedModelSerializer):
+    image_renditions = ImageRenditionsField()
     username = serializers.CharField(read_only=True)
     image = serializers.ImageField(read_only=True)
 
@@ -51,10 +137,25 @@ class ProfileFollowSerializer(serializers.ModelSerializer):
         fields = (
             "username",
             "image",
+            "image_renditions",
         )
 
 
-class ProfileDetailSerializer(serializers.ModelSerializer):
+class ProfileSuggestSerializer(TimedModelSerializer):
+    image_renditions = ImageRenditionsField()
+
+    class Meta:
+        model = Profile
+        fields = (
+            "id",
+            "username",
+            "image",
+            "image_renditions",
+        )
+
+
+class ProfileDetailSerializer(TimedModelSerializer):
+    image_renditions = ImageRenditionsField()
     followers = ProfileFollowSerializer(many=True, read_only=True)
     follow_to = ProfileFollowSerializer(many=True, read_only=True)
     posts = serializers.SerializerMethodField()
@@ -70,6 +171,7 @@ class ProfileDetailSerializer(serializers.ModelSerializer):
             "user",
             "status",
             "image",
+            "image_renditions",
             "followers",
             "follow_to",
             "posts",
@@ -77,11 +179,13 @@ class ProfileDetailSerializer(serializers.ModelSerializer):
         )
 
 
-class PostSerializer(serializers.ModelSerializer):
-    comments = serializers.IntegerField(source="comments.count", read_only=True)
+class PostSerializer(TimedModelSerializer):
+    serializer_field_mapping = UPLOAD_FIELD_MAPPING
+    image_renditions = ImageRenditionsField()
+    comments = serializers.IntegerField(source="comments_count", read_only=True)
     author = serializers.CharField(source="author.username", read_only=True)
-    likes = serializers.IntegerField(source="likes.count", read_only=True)
-    dislikes = serializers.IntegerField(source="dislikes.count", read_only=True)
+    likes = serializers.IntegerField(source="likes_count", read_only=True)
+    dislikes = serializers.IntegerField(source="dislikes_count", read_only=True)
 
     class Meta:
         model = Post
@@ -93,12 +197,13 @@ class PostSerializer(serializers.ModelSerializer):
             "created_at",
             "comments",
             "image",
+            "image_renditions",
             "likes",
             "dislikes",
         )
 
 
-class CommentPostSerializer(serializers.ModelSerializer):
+class CommentPostSerializer(TimedModelSerializer):
     owner = serializers.CharField(source="owner.username", read_only=True)
 
     class Meta:
@@ -110,7 +215,7 @@ class CommentPostSerializer(serializers.ModelSerializer):
         )
 
 
-class LikePostSerializer(serializers.ModelSerializer):
+class LikePostSerializer(TimedModelSerializer):
     owner = serializers.CharField(source="owner.username", read_only=True)
 
     class Meta:
@@ -122,17 +227,41 @@ class LikePostSerializer(serializers.ModelSerializer):
         )
 
 
-class PostDetailSerializer(serializers.ModelSerializer):
+class PostDetailSerializer(TimedModelSerializer):
     author = serializers.CharField(source="author.username", read_only=True)
-    comments = CommentPostSerializer(many=True, read_only=True)
+    comments_count = serializers.IntegerField(read_only=True)
+    comments = serializers.SerializerMethodField()
+    likes_count = serializers.IntegerField(read_only=True)
     likes = serializers.SerializerMethodField()
+    dislikes_count = serializers.IntegerField(read_only=True)
     dislikes = serializers.SerializerMethodField()
 
+    @extend_schema_field(CommentPostSerializer(many=True))
+    def get_comments(self, obj) -> list:
+        """The oldest comments only, the rest is paged by /posts/{id}/comments/"""
+        limit = getattr(settings, "POST_DETAIL_COMMENTS", 10)
+        comments = (
+            obj.comments.filter(parent=None)
+            .select_related("owner")
+            .order_by("created_at", "id")
+        )
+        return CommentPostSerializer(comments[:limit], many=True).data
+
+    @staticmethod
+    def reacted_usernames(obj, kind) -> list:
+        """The latest reacting profiles only, the rest is in the counters"""
+        limit = getattr(settings, "POST_DETAIL_REACTIONS", 10)
+        return list(
+            obj.reactions.filter(kind=kind)
+            .order_by("-created_at", "-id")
+            .values_list("profile__username", flat=True)[:limit]
+        )
+
     def get_likes(self, obj) -> list:
-        return [likes.username for likes in obj.likes.all()]
+        return self.reacted_usernames(obj, Reaction.KindChoices.Like)
 
     def get_dislikes(self, obj) -> list:
-        return [dislikes.username for dislikes in obj.dislikes.all()]
+        return self.reacted_usernames(obj, Reaction.KindChoices.Dislike)
 
     class Meta:
         model = Post
@@ -142,7 +271,10 @@ class PostDetailSerializer(serializers.ModelSerializer):
             "body",
             "author",
             "created_at",
+            "comments_count",
             "comments",
+            "likes_count",
             "likes",
+            "dislikes_count",
             "dislikes",
         )
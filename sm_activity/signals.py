@@ -0,0 +1,255 @@
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.dispatch import receiver
+
+from sm_activity import (
+    caching,
+    graph,
+    images,
+    legacy_reactions,
+    metrics,
+    search,
+    storage,
+)
+from sm_activity.counters import increment
+from sm_activity.models import Comment, Post, Profile, Reaction
+
+
+@receiver(post_save, sender=Comment)
+def count_created_comment(sender, instance, created, **kwargs):
+    if created:
+        increment(Post.objects.filter(pk=instance.post_id), comments_count=1)
+        increment(Profile.objects.filter(pk=instance.owner_id), comments_count=1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    increment(Post.objects.filter(pk=instance.post_id), comments_count=-1)
+    increment(Profile.objects.filter(pk=instance.owner_id), comments_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_created_reply(sender, instance, created, **kwargs):
+    if created and instance.parent_id is not None:
+        ancestor_ids = Comment.path_ids(instance.parent.path)
+        increment(Comment.objects.filter(pk__in=ancestor_ids), replies_count=1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_reply(sender, instance, **kwargs):
+    ancestor_ids = Comment.path_ids(instance.path)[:-1]
+    if ancestor_ids:
+        increment(Comment.objects.filter(pk__in=ancestor_ids), replies_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def count_created_post(sender, instance, created, **kwargs):
+    if created:
+        increment(Profile.objects.filter(pk=instance.author_id), posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    increment(Profile.objects.filter(pk=instance.author_id), posts_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, using, **kwargs):
+    search.index_post(instance, using)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, using, **kwargs):
+    search.remove_post(instance.pk, using)
+
+
+def create_search_index(sender, using, **kwargs):
+    search.ensure_index(using)
+
+
+def stash_legacy_reactions(sender, using, plan=None, **kwargs):
+    """
+    The migration adding Reaction also drops the likes/dislikes tables, and
+    these can't be copied in between without a data migration, so their
+    rows are set aside before it runs and copied over once it has
+    """
+    if legacy_reactions.drops_legacy_tables(plan):
+        legacy_reactions.stash(using)
+
+
+def restore_legacy_reactions(sender, using, **kwargs):
+    if legacy_reactions.STASH_TABLE in legacy_reactions.existing_tables(using):
+        legacy_reactions.copy(using)
+
+
+@receiver(post_save, sender=Profile)
+def forget_created_profile(sender, instance, created, **kwargs):
+    if created:
+        graph.forget(instance)
+
+
+@receiver(post_delete, sender=Profile)
+def forget_deleted_profile(sender, instance, **kwargs):
+    graph.forget(instance)
+
+
+@receiver(m2m_changed, sender=Profile.followers.through)
+def count_follows(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Shift the stored counters by the follows added or removed, in two
+    updates whatever their number; `recount_profiles` repairs drift.
+    `followers.add(ids)` makes `ids` follow `instance`, `follow_to.add(ids)`
+    makes `instance` follow them.
+    """
+    related = instance.follow_to if reverse else instance.followers
+    if action == "pre_clear":
+        instance._changed_follow_ids = set(related.values_list("id", flat=True))
+    elif action == "pre_remove":
+        # removing an id that isn't related is a no-op Django still reports
+        instance._changed_follow_ids = set(
+            related.filter(pk__in=pk_set).values_list("id", flat=True)
+        )
+    elif action in ("post_add", "post_remove", "post_clear"):
+        if action == "post_add":
+            changed_ids, sign = pk_set, 1
+        else:
+            changed_ids, sign = getattr(instance, "_changed_follow_ids", set()), -1
+        if not changed_ids:
+            return
+        own, theirs = (
+            ("following_count", "followers_count")
+            if reverse
+            else ("followers_count", "following_count")
+        )
+        increment(
+            Profile.objects.filter(pk=instance.pk), **{own: sign * len(changed_ids)}
+        )
+        increment(Profile.objects.filter(pk__in=changed_ids), **{theirs: sign})
+        graph.invalidate(instance.pk, *changed_ids)
+        caching.bump(caching.PROFILE, instance.pk, *changed_ids)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def expire_post_detail(sender, instance, **kwargs):
+    caching.bump(caching.POST, instance.pk)
+    caching.bump(caching.PROFILE, instance.author_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def expire_commented_post_detail(sender, instance, **kwargs):
+    caching.bump(caching.POST, instance.post_id)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def expire_profile_detail(sender, instance, **kwargs):
+    caching.bump(caching.PROFILE, instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+def expire_details_showing_profile(sender, instance, created, **kwargs):
+    """
+    Post details show the username of their author, commenters and
+    reacting profiles, profile details the usernames of the follows
+    """
+    if created:
+        return
+    post_ids = Post.objects.filter(
+        Q(author=instance)
+        | Q(pk__in=Comment.objects.filter(owner=instance).values("post_id"))
+        | Q(pk__in=Reaction.objects.filter(profile=instance).values("post_id"))
+    ).values_list("pk", flat=True)
+    caching.bump(caching.POST, *post_ids)
+    follows = Profile.followers.through.objects.filter(
+        Q(from_profile=instance) | Q(to_profile=instance)
+    ).values_list("from_profile_id", "to_profile_id")
+    caching.bump(
+        caching.PROFILE, *{pk for follow in follows for pk in follow} - {instance.pk}
+    )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Profile)
+def render_uploaded_image(sender, instance, **kwargs):
+    if instance.image and not images.is_current(instance):
+        images.schedule(instance)
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Profile)
+def remember_stored_image(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and "image" not in update_fields:
+        return
+    instance._stored_image = ""
+    if not instance._state.adding:
+        instance._stored_image = (
+            sender.objects.filter(pk=instance.pk)
+            .values_list("image", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Profile)
+def count_image_references(sender, instance, **kwargs):
+    """
+    Move the references from a replaced or cleared image, and from its
+    renditions, to the new image. The renditions are read after the save:
+    they are written in the background, and not by a save.
+    """
+    stored = getattr(instance, "_stored_image", None)
+    if stored is None:
+        return
+    del instance._stored_image
+    if stored == instance.image.name:
+        return
+    with transaction.atomic():
+        row = sender.objects.filter(pk=instance.pk)
+        renditions = (
+            row.select_for_update().values_list("image_renditions", flat=True).first()
+        )
+        if renditions:
+            row.update(image_renditions={})
+        instance.image_renditions = {}
+        storage.release(storage.referenced_names(stored, renditions or {}))
+        storage.retain([instance.image.name] if instance.image else [])
+
+
+@receiver(pre_delete, sender=Post)
+@receiver(pre_delete, sender=Profile)
+def remember_deleted_image(sender, instance, **kwargs):
+    # renditions are written in the background, the copy in memory may be stale
+    stored = (
+        sender.objects.filter(pk=instance.pk)
+        .values_list("image", "image_renditions")
+        .first()
+    )
+    instance._stored_files = storage.referenced_names(*stored) if stored else []
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Profile)
+def release_deleted_image(sender, instance, **kwargs):
+    storage.release(getattr(instance, "_stored_files", []))
+
+
+@receiver(post_save, sender=Comment)
+def count_comment_event(sender, instance, created, **kwargs):
+    if created:
+        metrics.EVENTS.inc(event="reply" if instance.parent_id else "comment")
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def count_registration(sender, instance, created, **kwargs):
+    if created:
+        metrics.EVENTS.inc(event="registration")
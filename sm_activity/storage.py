@@ -0,0 +1,97 @@
+import hashlib
+import os
+import tempfile
+from collections import Counter
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+BLOB_DIR = "blobs"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage keeping every distinct content once: uploads are
+    hashed while streamed to a temporary file and renamed to
+    `blobs/ab/cd/<sha256><ext>`, or dropped when that blob already exists.
+    The requested name only contributes its extension, so blob URLs are
+    immutable and can be cached for a year.
+
+    The Blob row is touched, or created, before the file is looked at, in
+    the transaction that writes it: collect_blobs deletes rows only when
+    they weren't touched lately and unlinks their file in the same
+    transaction, so the row lock orders the two and a file is never reused
+    while it is being collected.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        from sm_activity.models import Blob
+
+        extension = os.path.splitext(name)[1].lower()
+        temp_dir = self.path(os.path.join(BLOB_DIR, "tmp"))
+        os.makedirs(temp_dir, exist_ok=True)
+
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=temp_dir, delete=False) as temp:
+            if hasattr(content, "seek"):
+                content.seek(0)
+            for chunk in content.chunks():
+                digest.update(chunk)
+                size += len(chunk)
+                temp.write(chunk)
+
+        digest = digest.hexdigest()
+        blob_name = os.path.join(BLOB_DIR, digest[:2], digest[2:4], digest + extension)
+        path = self.path(blob_name)
+        with transaction.atomic():
+            # keeps a blob being uploaded again out of the collector's reach
+            reused = Blob.objects.filter(name=blob_name).update(
+                updated_at=timezone.now()
+            )
+            if not reused:
+                Blob.objects.get_or_create(
+                    name=blob_name, defaults={"digest": digest, "size": size}
+                )
+            # without a row, a file left there may be an orphan being deleted
+            if reused and os.path.exists(path):
+                os.remove(temp.name)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.chmod(temp.name, self.file_permissions_mode or 0o644)
+                os.replace(temp.name, path)
+        return blob_name
+
+
+def referenced_names(image_name: str, image_renditions: dict) -> list:
+    """The stored files an image field and its renditions point to"""
+    names = [image_name] if image_name else []
+    for files in image_renditions.get("renditions", {}).values():
+        names.extend(files.values())
+    return names
+
+
+def retain(names) -> None:
+    change_refcounts(Counter(names), 1)
+
+
+def release(names) -> None:
+    change_refcounts(Counter(names), -1)
+
+
+def change_refcounts(names: Counter, sign: int) -> None:
+    from sm_activity.models import Blob
+
+    by_count = {}
+    for name, count in names.items():
+        by_count.setdefault(count, []).append(name)
+    for count, batch in by_count.items():
+        Blob.objects.filter(name__in=batch).update(
+            refcount=F("refcount") + sign * count, updated_at=timezone.now()
+        )
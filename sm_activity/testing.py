@@ -0,0 +1,23 @@
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    DiscoverRunner writing the metrics of the requests the tests make to a
+    temporary file, instead of adding them to those of the running server
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.metrics_dir = tempfile.TemporaryDirectory()
+        self.saved_metrics_file = settings.METRICS_FILE
+        settings.METRICS_FILE = Path(self.metrics_dir.name) / "metrics.bin"
+
+    def teardown_test_environment(self, **kwargs):
+        settings.METRICS_FILE = self.saved_metrics_file
+        self.metrics_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
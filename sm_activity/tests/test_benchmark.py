@@ -0,0 +1,46 @@
+from django.db.models import Max, Sum
+from django.test import TestCase
+
+from sm_activity import benchmark
+from sm_activity.models import Comment, Post, Profile, Reaction
+from sm_activity.seeding import GraphSeeder
+
+
+class SeedSocialGraphTest(TestCase):
+    def test_seeded_graph_is_skewed_and_counted(self):
+        totals = GraphSeeder(200, seed=7).run()
+
+        self.assertEqual(Profile.objects.count(), totals["profiles"])
+        self.assertEqual(Post.objects.count(), totals["posts"])
+        self.assertEqual(Comment.objects.count(), totals["comments"])
+        stats = Profile.objects.aggregate(
+            most=Max("followers_count"), follows=Sum("followers_count")
+        )
+        self.assertEqual(stats["follows"], totals["follows"])
+        self.assertGreater(stats["most"], 10 * totals["follows"] / totals["profiles"])
+        self.assertEqual(
+            Post.objects.aggregate(total=Sum("likes_count"))["total"],
+            Reaction.objects.filter(kind="like").count(),
+        )
+
+        reply = Comment.objects.exclude(parent=None).select_related("parent").first()
+        self.assertTrue(reply.path.startswith(reply.parent.path))
+        self.assertEqual(reply.depth, reply.parent.depth + 1)
+
+
+class BenchmarkTest(TestCase):
+    def test_report_has_latency_and_queries_per_endpoint(self):
+        report = benchmark.run([30], repeat=2, seed=3)
+
+        endpoints = report["sizes"]["30"]["endpoints"]
+        self.assertIn("post-detail", endpoints)
+        for metrics in endpoints.values():
+            self.assertEqual(metrics["status"], 200)
+            self.assertLessEqual(metrics["p50_ms"], metrics["max_ms"])
+            self.assertGreater(metrics["cold_queries"], 0)
+
+        baseline = {"sizes": {"30": {"endpoints": {"post-list": {"p50_ms": -1}}}}}
+        self.assertEqual(
+            benchmark.compare(baseline, report)[0][:4],
+            ("30", "post-list", "p50_ms", -1),
+        )
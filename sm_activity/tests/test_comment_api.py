@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from django.contrib.auth import get_user_model
 from django.urls import reverse
@@ -17,6 +17,22 @@ def detail_url(comment_id: int):
     return reverse("sm_activity:comment-detail", args=[comment_id])
 
 
+def comments_url(post_id: int):
+    return reverse("sm_activity:post-comments", args=[post_id])
+
+
+def post_detail_url(post_id: int):
+    return reverse("sm_activity:post-detail", args=[post_id])
+
+
+def reply_url(comment_id: int):
+    return reverse("sm_activity:comment-reply", args=[comment_id])
+
+
+def thread_url(comment_id: int):
+    return reverse("sm_activity:comment-thread", args=[comment_id])
+
+
 def sample_profile(**params):
     defaults = {
         "user": "",
@@ -85,3 +101,131 @@ class CommentApiTest(TestCase):
         self.client.post(comment_url(post.id), payload)
         response_1 = self.client.delete(detail_url(1))
         self.assertEqual(response_1.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_conditional_get_checks_permissions_first(self):
+        profile = sample_profile(user=self.user, username="Test")
+        post = sample_post(author=profile)
+        comment = Comment.objects.create(post=post, owner=profile, body="hi")
+
+        response = self.client.get(detail_url(comment.id))
+        etag = response["ETag"]
+        response = self.client.get(detail_url(comment.id), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.force_authenticate(None)
+        for url in (detail_url(comment.id), thread_url(comment.id)):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH="*")
+            self.assertIn(
+                response.status_code,
+                (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN),
+            )
+        response = self.client.get(detail_url(comment.id + 1), HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(POST_DETAIL_COMMENTS=2)
+    def test_post_comments_are_paginated(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        profile = sample_profile(
+            user=user2,
+            username="Test2",
+        )
+        post = sample_post(author=profile)
+        for body in ("first", "second", "third"):
+            Comment.objects.create(post=post, owner=profile, body=body)
+
+        response = self.client.get(post_detail_url(post.id))
+        self.assertEqual(response.data["comments_count"], 3)
+        self.assertEqual(
+            [comment["body"] for comment in response.data["comments"]],
+            ["first", "second"],
+        )
+
+        response = self.client.get(comments_url(post.id), {"page_size": 2})
+        self.assertEqual(
+            [comment["body"] for comment in response.data["results"]],
+            ["first", "second"],
+        )
+        self.assertEqual(response.data["results"][0]["owner"], "Test2")
+        response = self.client.get(response.data["next"])
+        self.assertEqual(
+            [comment["body"] for comment in response.data["results"]], ["third"]
+        )
+
+        response = self.client.get(comments_url(post.id + 1))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_reply_threads(self):
+        profile = sample_profile(user=self.user, username="Test")
+        post = sample_post(author=profile)
+        root = Comment.objects.create(post=post, owner=profile, body="root")
+        other = Comment.objects.create(post=post, owner=profile, body="other")
+
+        response = self.client.post(reply_url(root.id), {"body": "child"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        child = Comment.objects.get(body="child")
+        self.client.post(reply_url(child.id), {"body": "grandchild"})
+        self.client.post(reply_url(root.id), {"body": "second child"})
+        self.client.post(reply_url(other.id), {"body": "elsewhere"})
+
+        root.refresh_from_db()
+        child.refresh_from_db()
+        self.assertEqual((root.replies_count, child.replies_count), (3, 1))
+        self.assertEqual(child.depth, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 6)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(thread_url(root.id))
+        self.assertEqual(response.data["body"], "root")
+        self.assertEqual(
+            [reply["body"] for reply in response.data["replies"]],
+            ["child", "second child"],
+        )
+        self.assertEqual(
+            response.data["replies"][0]["replies"][0]["body"], "grandchild"
+        )
+
+        response = self.client.get(thread_url(root.id), {"depth": 1})
+        self.assertEqual(response.data["replies"][0]["replies"], [])
+        self.assertEqual(response.data["replies"][0]["replies_count"], 1)
+
+        response = self.client.get(comments_url(post.id))
+        self.assertEqual(
+            [comment["body"] for comment in response.data["results"]],
+            ["root", "other"],
+        )
+
+        self.client.delete(detail_url(child.id))
+        root.refresh_from_db()
+        post.refresh_from_db()
+        self.assertEqual(root.replies_count, 1)
+        self.assertEqual(post.comments_count, 4)
+
+    def test_comment_ids_must_fit_in_the_path(self):
+        profile = sample_profile(user=self.user, username="Test")
+        post = sample_post(author=profile)
+
+        with self.assertRaises(ValueError):
+            Comment.objects.create(
+                id=Comment.MAX_ID + 1, post=post, owner=profile, body="too big"
+            )
+        self.assertFalse(Comment.objects.exists())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+
+        comment = Comment.objects.create(
+            id=Comment.MAX_ID, post=post, owner=profile, body="last"
+        )
+        self.assertEqual(Comment.objects.get().path, str(comment.id))
+
+    @override_settings(COMMENT_MAX_DEPTH=1)
+    def test_reply_depth_is_limited(self):
+        profile = sample_profile(user=self.user, username="Test")
+        post = sample_post(author=profile)
+        root = Comment.objects.create(post=post, owner=profile, body="root")
+        child = Comment.objects.create(
+            post=post, owner=profile, parent=root, body="child"
+        )
+
+        response = self.client.post(reply_url(child.id), {"body": "too deep"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
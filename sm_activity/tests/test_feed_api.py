@@ -0,0 +1,96 @@
+from django.test import TestCase, override_settings
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+from sm_activity.models import Profile, Post, TimelineEntry
+
+FEED_URL = reverse("sm_activity:feed-list")
+POSTS_URL = reverse("sm_activity:post-list")
+
+
+def sample_profile(**params):
+    defaults = {
+        "user": "",
+        "username": "Test",
+        "status": "Active",
+        "bio": "Test",
+    }
+    defaults.update(params)
+
+    return Profile.objects.create(**defaults)
+
+
+class FeedApiTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user("test@test.com", "test1234")
+        self.author_user = get_user_model().objects.create_user(
+            "test@test2.com", "test3234"
+        )
+        self.profile = sample_profile(user=self.user, username="Test1")
+        self.author = sample_profile(user=self.author_user, username="Test2")
+        self.author.followers.add(self.profile)
+
+    def test_feed_contains_posts_of_followed_profiles(self):
+        stranger = sample_profile(
+            user=get_user_model().objects.create_user("test@test3.com", "test3334"),
+            username="Test3",
+        )
+        Post.objects.create(author=stranger, title="stranger", body="body")
+
+        self.client.force_authenticate(self.author_user)
+        self.client.post(POSTS_URL, {"title": "followed", "body": "body"})
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get(FEED_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        titles = [post["title"] for post in response.data["results"]]
+        self.assertEqual(titles, ["followed"])
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.profile).count(), 1)
+
+    @override_settings(FEED_FANOUT_FOLLOWER_LIMIT=0)
+    def test_celebrity_posts_are_merged_on_read(self):
+        self.client.force_authenticate(self.author_user)
+        self.client.post(POSTS_URL, {"title": "celebrity", "body": "body"})
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get(FEED_URL)
+
+        self.assertFalse(TimelineEntry.objects.exists())
+        titles = [post["title"] for post in response.data["results"]]
+        self.assertEqual(titles, ["celebrity"])
+
+    @override_settings(FEED_FANOUT_FOLLOWER_LIMIT=1)
+    def test_feed_pages_merge_timeline_and_celebrity_posts(self):
+        star = sample_profile(
+            user=get_user_model().objects.create_user("test@test3.com", "test3334"),
+            username="Star",
+        )
+        fan = sample_profile(
+            user=get_user_model().objects.create_user("test@test4.com", "test4434"),
+            username="Fan",
+        )
+        star.followers.add(self.profile, fan)
+        for title, author_user in (
+            ("first", self.author_user),
+            ("second", star.user),
+            ("third", star.user),
+            ("fourth", self.author_user),
+        ):
+            self.client.force_authenticate(author_user)
+            self.client.post(POSTS_URL, {"title": title, "body": "body"})
+
+        self.client.force_authenticate(self.user)
+        titles, url = [], FEED_URL + "?page_size=1"
+        while url:
+            response = self.client.get(url)
+            titles.extend(post["title"] for post in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(titles, ["fourth", "third", "second", "first"])
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.profile).count(), 2)
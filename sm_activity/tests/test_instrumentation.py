@@ -0,0 +1,300 @@
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from sm_activity import instrumentation, metrics, profiling
+from sm_activity.models import Post, Profile
+from sm_activity.views import PostViewSet
+
+
+class ServerTimingTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user = get_user_model().objects.create_user("test@test.com", "test1234")
+        self.profile = Profile.objects.create(
+            user=user, username="Author", status="Active", bio="Test"
+        )
+        for n in range(3):
+            Post.objects.create(author=self.profile, title=f"Post {n}", body="body")
+        self.client.force_authenticate(user)
+        instrumentation.slowest.clear()
+
+    def test_response_reports_sql_serializer_and_render_time(self):
+        with self.assertLogs("sm_activity.instrumentation", "INFO") as logs:
+            response = self.client.get(reverse("sm_activity:post-list"))
+
+        timing = dict(
+            re.match(r"(\w+);dur=([\d.]+)", metric.strip()).groups()
+            for metric in response["Server-Timing"].split(",")
+        )
+        self.assertEqual(set(timing), {"db", "serialize", "render", "total"})
+        self.assertGreater(float(timing["serialize"]), 0)
+        self.assertGreater(float(timing["render"]), 0)
+        self.assertLessEqual(float(timing["db"]), float(timing["total"]))
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record["view"], "PostViewSet.list")
+        self.assertEqual(record["status"], 200)
+        self.assertGreater(record["queries"], 0)
+        self.assertIn(f'desc="{record["queries"]} queries"', response["Server-Timing"])
+
+    def test_sql_run_while_serializing_is_only_counted_in_db(self):
+        class CountingSerializer(
+            instrumentation.TimedSerializerMixin, serializers.Serializer
+        ):
+            posts = serializers.SerializerMethodField()
+
+            def get_posts(self, instance):
+                return Post.objects.count()
+
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(0.05)
+            return execute(sql, params, many, context)
+
+        timings = instrumentation.Timings()
+        token = instrumentation.current.set(timings)
+        try:
+            with connection.execute_wrapper(timings):
+                with connection.execute_wrapper(slow_query):
+                    data = CountingSerializer(object()).data
+        finally:
+            instrumentation.current.reset(token)
+
+        self.assertEqual(data, {"posts": 3})
+        self.assertGreaterEqual(timings.db, 0.05)
+        self.assertLess(timings.serialize, 0.05)
+
+    def test_streamed_queries_are_logged_with_the_request(self):
+        url = reverse("sm_activity:profile-export", args=[self.profile.id])
+        response = self.client.get(url)
+        header_queries = int(
+            re.search(r'desc="(\d+) queries"', response["Server-Timing"]).group(1)
+        )
+        with self.assertLogs("sm_activity.instrumentation", "INFO") as logs:
+            b"".join(response.streaming_content)
+            response.close()
+
+        self.assertEqual(len(logs.records), 1)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["view"], "ProfileViewSet.export")
+        self.assertGreater(record["queries"], header_queries)
+        self.assertEqual(connection.execute_wrappers, [])
+
+    @override_settings(SERVER_TIMING_SLOW_MS=0, SERVER_TIMING_SAMPLES=1)
+    def test_slow_requests_are_sampled_with_normalized_sql(self):
+        with self.assertLogs("sm_activity.instrumentation", "WARNING"):
+            self.client.get(reverse("sm_activity:post-list"))
+            self.client.get(reverse("sm_activity:profile-list"))
+
+        records = instrumentation.slowest.records()
+        self.assertEqual(len(records), 1)
+        statements = [query["sql"] for query in records[0]["sql"]]
+        self.assertTrue(statements)
+        self.assertFalse(any(re.search(r"= \d", sql) for sql in statements))
+
+
+def add_in_child(path, amount):
+    metrics.SharedValues(path).add([(("sm_test_total", ()), amount)])
+
+
+class SharedValuesTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "metrics.bin")
+
+    def test_values_are_summed_across_threads_and_processes(self):
+        values = metrics.SharedValues(self.path)
+        key = ("sm_test_total", ())
+        threads = [
+            threading.Thread(
+                target=lambda: [values.add([(key, 1)]) for _ in range(500)]
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        context = multiprocessing.get_context("fork")
+        for amount in (10, 20):
+            child = context.Process(target=add_in_child, args=(self.path, amount))
+            child.start()
+            child.join()
+
+        self.assertEqual(values.snapshot(), {key: 2030})
+        # the second child took over the entry of the first, dead one
+        self.assertEqual(len(list(values.entries())), 2)
+
+
+class MetricsEndpointTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            METRICS_FILE=os.path.join(directory.name, "metrics.bin"),
+            METRICS_TOKEN="scraper",
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.client = APIClient()
+        user = get_user_model().objects.create_user("test@test.com", "test1234")
+        profile = Profile.objects.create(
+            user=user, username="Author", status="Active", bio="Test"
+        )
+        self.post = Post.objects.create(author=profile, title="Post", body="body")
+        self.client.force_authenticate(user)
+
+    def scrape(self) -> str:
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer scraper"
+        )
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_metrics_are_exposed_in_text_format(self):
+        self.client.post(reverse("sm_activity:post-like", args=[self.post.id]))
+        self.client.post(
+            reverse("sm_activity:post-comment", args=[self.post.id]), {"body": "hi"}
+        )
+        for _ in range(2):
+            self.client.get(reverse("sm_activity:post-detail", args=[self.post.id]))
+
+        text = self.scrape()
+        self.assertIn('sm_activity_events_total{event="registration"} 1.0', text)
+        self.assertIn('sm_activity_events_total{event="like"} 1.0', text)
+        self.assertIn('sm_activity_events_total{event="comment"} 1.0', text)
+        self.assertIn("# TYPE sm_activity_request_duration_seconds histogram", text)
+        self.assertIn(
+            'sm_activity_request_duration_seconds_bucket{view="PostViewSet.retrieve",'
+            'status="2xx",le="+Inf"} 2.0',
+            text,
+        )
+        self.assertIn('sm_activity_cache_hit_ratio{cache="detail"} 0.5', text)
+        self.assertRegex(
+            text, r'sm_activity_db_queries_total\{view="PostViewSet.like"\} [1-9]'
+        )
+
+    def test_metrics_need_the_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer scrapér"
+        )
+        self.assertEqual(response.status_code, 403)
+
+        with self.settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+            with self.settings(DEBUG=True):
+                self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+
+
+def busy_loop(deadline):
+    while time.perf_counter() < deadline:
+        sum(range(100))
+
+
+class ProfilingTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings = override_settings(
+            PROFILING_DIR=self.directory, PROFILING_INTERVAL=0.001
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user("test@test.com", "test")
+        profile = Profile.objects.create(
+            user=self.user, username="Author", status="Active", bio="Test"
+        )
+        for n in range(3):
+            Post.objects.create(author=profile, title=f"Post {n}", body="body")
+        self.client.force_authenticate(self.user)
+
+    def get_posts(self, header=None):
+        extra = {"HTTP_X_PROFILE_REQUEST": header} if header else {}
+        return self.client.get(reverse("sm_activity:post-list"), **extra)
+
+    def test_requests_are_profiled_with_a_signed_header_or_by_staff(self):
+        self.assertNotIn(profiling.RESPONSE_HEADER, self.get_posts())
+        self.assertNotIn(profiling.RESPONSE_HEADER, self.get_posts("1"))
+        self.assertNotIn(profiling.RESPONSE_HEADER, self.get_posts("profile:bad"))
+
+        response = self.get_posts(profiling.make_token())
+        self.assertEqual(response.status_code, 200)
+        name = response[profiling.RESPONSE_HEADER]
+        self.assertIn("PostViewSet.list", name)
+        sql = (self.directory / f"{name}.sql").read_text()
+        self.assertRegex(sql.splitlines()[0], r"# PostViewSet.list: .* queries")
+        self.assertIn('FROM "sm_activity_post"', sql)
+        for line in (self.directory / f"{name}.collapsed").read_text().splitlines():
+            self.assertRegex(line, r"^\S.* \d+$")
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertIn(profiling.RESPONSE_HEADER, self.get_posts("1"))
+        self.assertEqual(len(list(self.directory.glob("*.sql"))), 2)
+
+    def assert_profile_stopped(self):
+        self.assertIsNone(sys.getprofile())
+        self.assertEqual(connection.execute_wrappers, [])
+        self.assertTrue(profiling.SignalSampler.lock.acquire(blocking=False))
+        profiling.SignalSampler.lock.release()
+
+    def test_profile_stops_when_the_view_or_rendering_fails(self):
+        failures = (
+            mock.patch.object(PostViewSet, "list", side_effect=RuntimeError),
+            mock.patch.object(JSONRenderer, "render", side_effect=RuntimeError),
+        )
+        for failure in failures:
+            with self.subTest(failure=failure.attribute), failure:
+                with self.assertRaises(RuntimeError):
+                    self.get_posts(profiling.make_token())
+                self.assert_profile_stopped()
+        self.assertEqual(len(list(self.directory.glob("*.sql"))), 2)
+
+    def test_streamed_responses_are_profiled_to_the_last_row(self):
+        url = reverse("sm_activity:profile-export", args=[self.user.profile.id])
+        response = self.client.get(url, HTTP_X_PROFILE_REQUEST=profiling.make_token())
+        self.assertFalse(list(self.directory.glob("*.sql")))
+        b"".join(response.streaming_content)
+        response.close()
+        self.assert_profile_stopped()
+
+        name = response[profiling.RESPONSE_HEADER]
+        sql = (self.directory / f"{name}.sql").read_text()
+        self.assertIn('FROM "sm_activity_post"', sql)
+
+    def test_samplers_record_the_running_stack(self):
+        samplers = [profiling.ProfileHookSampler(0.001)]
+        if profiling.SignalSampler.available():
+            samplers.append(profiling.SignalSampler(0.001))
+        for sampler in samplers:
+            with self.subTest(mode=sampler.mode):
+                self.assertTrue(sampler.start())
+                try:
+                    busy_loop(time.perf_counter() + 0.05)
+                finally:
+                    sampler.stop()
+                self.assertIn(
+                    "busy_loop (test_instrumentation.py:", sampler.collapsed()
+                )
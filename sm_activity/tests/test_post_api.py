@@ -1,12 +1,27 @@
-from django.test import TestCase
+import tempfile
+from datetime import datetime
+from io import BytesIO, StringIO
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations import Migration, RemoveField
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework import status
+from PIL import Image
 from rest_framework.test import APIClient
 
 
-from sm_activity.models import Profile, Post
+from sm_activity import legacy_reactions, reactions, signals
+from sm_activity.models import Blob, Profile, Post, Reaction
+from sm_activity.views import serve_media
 from sm_activity.serializer import (
     ProfileSerializer,
     ProfileDetailSerializer,
@@ -173,3 +188,473 @@ class PostApiTest(TestCase):
         serializer1 = PostSerializer(post)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(1, post.comments.count())
+
+    def test_posts_are_paginated_by_cursor(self):
+        profile_client = sample_profile(
+            user=self.user,
+            username="Test",
+        )
+        for title in ("first", "second", "third"):
+            sample_post(author=profile_client, title=title)
+
+        response = self.client.get(POSTS_URL, {"page_size": 2})
+        titles = [post["title"] for post in response.data["results"]]
+        self.assertEqual(titles, ["third", "second"])
+
+        response = self.client.get(response.data["next"])
+        titles = [post["title"] for post in response.data["results"]]
+        self.assertEqual(titles, ["first"])
+        self.assertIsNone(response.data["next"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(POSTS_URL, {"cursor": "garbage"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_like_and_comment_counters(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        profile = sample_profile(
+            user=user2,
+            username="Test2",
+        )
+        sample_profile(
+            user=self.user,
+            username="Test",
+        )
+        post = sample_post(author=profile)
+
+        self.client.post(like_url(post.id))
+        self.client.post(comment_url(post.id), {"body": "test"})
+        response = self.client.get(POSTS_URL)
+        self.assertEqual(response.data["results"][0]["likes"], 1)
+        self.assertEqual(response.data["results"][0]["comments"], 1)
+
+        self.client.post(like_url(post.id))
+        post.comments.get().delete()
+        post.refresh_from_db()
+        self.assertEqual((post.likes_count, post.comments_count), (0, 0))
+
+    def test_recount_posts_command(self):
+        profile_client = sample_profile(
+            user=self.user,
+            username="Test",
+        )
+        post = sample_post(author=profile_client)
+        Reaction.objects.create(
+            post=post, profile=profile_client, kind=Reaction.KindChoices.Like
+        )
+        Post.objects.filter(pk=post.pk).update(likes_count=42, comments_count=7)
+
+        call_command("recount_posts", stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual((post.likes_count, post.comments_count), (1, 0))
+
+    def test_like_toggle_returns_state_and_counts(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        profile = sample_profile(
+            user=user2,
+            username="Test2",
+        )
+        sample_profile(
+            user=self.user,
+            username="Test",
+        )
+        post = sample_post(author=profile)
+
+        response = self.client.post(like_url(post.id))
+        self.assertEqual(response.data["liked"], True)
+        self.assertEqual((response.data["likes"], response.data["dislikes"]), (1, 0))
+
+        response = self.client.post(dislike_url(post.id))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(like_url(post.id))
+        self.assertEqual(response.data["liked"], False)
+        self.assertEqual(response.data["likes"], 0)
+
+        response = self.client.post(dislike_url(post.id))
+        self.assertEqual(response.data["disliked"], True)
+        self.assertEqual(response.data["dislikes"], 1)
+
+    @override_settings(
+        REACTION_BACKEND="sm_activity.reactions.BufferedReactionBackend",
+        REACTION_BUFFER_SIZE=100,
+        REACTION_FLUSH_INTERVAL=3600,
+    )
+    def test_buffered_reactions_are_written_behind(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        profile = sample_profile(
+            user=user2,
+            username="Test2",
+        )
+        profile_client = sample_profile(
+            user=self.user,
+            username="Test",
+        )
+        post = sample_post(author=profile)
+        backend = reactions.get_backend()
+
+        response = self.client.post(like_url(post.id))
+        self.assertEqual((response.data["liked"], response.data["likes"]), (True, 1))
+        self.assertFalse(post.reactions.exists())
+        self.assertIsNotNone(backend.timer)
+
+        response = self.client.post(dislike_url(post.id))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(backend.flush(), 1)
+        self.assertIsNone(backend.timer)
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 1)
+        self.assertEqual(
+            reactions.current_kind(post.id, profile_client.id), reactions.LIKE
+        )
+
+        response = self.client.post(like_url(post.id))
+        self.assertEqual((response.data["liked"], response.data["likes"]), (False, 0))
+        backend.flush()
+        self.assertFalse(post.reactions.exists())
+
+        # another process stores the same like before this buffer is flushed
+        self.client.post(like_url(post.id))
+        self.assertEqual(
+            self.client.get(detail_url(post.id)).data["my_reaction"], reactions.LIKE
+        )
+        reactions.toggle(post.id, profile_client.id, reactions.LIKE)
+        with CaptureQueriesContext(connection) as flushed:
+            backend.flush()
+        self.assertFalse(
+            any("COUNT" in query["sql"] for query in flushed.captured_queries)
+        )
+        post.refresh_from_db()
+        self.assertEqual((post.likes_count, post.reactions.count()), (1, 1))
+
+        # an unlike arriving while the like is being written
+        write = backend.write
+        self.client.post(like_url(post.id))
+        backend.flush()
+        self.client.post(like_url(post.id))
+
+        def write_during_toggle(pending):
+            response = self.client.post(like_url(post.id))
+            self.assertEqual(response.data["liked"], False)
+            return write(pending)
+
+        with mock.patch.object(backend, "write", write_during_toggle):
+            backend.flush()
+        backend.flush()
+        post.refresh_from_db()
+        self.assertEqual((post.likes_count, post.reactions.count()), (0, 0))
+
+    def test_migrate_reactions_command(self):
+        profile_client = sample_profile(
+            user=self.user,
+            username="Test",
+        )
+        post = sample_post(author=profile_client)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE sm_activity_post_likes "
+                "(id integer PRIMARY KEY, post_id integer, profile_id integer)"
+            )
+            cursor.execute(
+                "INSERT INTO sm_activity_post_likes (post_id, profile_id) "
+                "VALUES (%s, %s)",
+                [post.id, profile_client.id],
+            )
+
+        call_command("migrate_reactions", stdout=StringIO())
+
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 1)
+        self.assertNotIn(
+            "sm_activity_post_likes", connection.introspection.table_names()
+        )
+
+    def test_migrate_keeps_reactions_of_dropped_legacy_tables(self):
+        profile_client = sample_profile(user=self.user, username="Test")
+        post = sample_post(author=profile_client)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE sm_activity_post_dislikes "
+                "(id integer PRIMARY KEY, post_id integer, profile_id integer)"
+            )
+            cursor.execute(
+                "INSERT INTO sm_activity_post_dislikes (post_id, profile_id) "
+                "VALUES (%s, %s)",
+                [post.id, profile_client.id],
+            )
+        migration = Migration("0002_reaction", "sm_activity")
+        migration.operations = [RemoveField("post", "dislikes")]
+
+        self.assertFalse(legacy_reactions.drops_legacy_tables([(migration, True)]))
+        signals.stash_legacy_reactions(None, "default", plan=[(migration, False)])
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE sm_activity_post_dislikes")
+        signals.restore_legacy_reactions(None, "default")
+
+        post.refresh_from_db()
+        self.assertEqual(post.dislikes_count, 1)
+        self.assertNotIn(
+            legacy_reactions.STASH_TABLE, connection.introspection.table_names()
+        )
+
+    @override_settings(TIME_ZONE="Europe/Kiev")
+    def test_filter_posts_by_creation_day(self):
+        profile_client = sample_profile(
+            user=self.user,
+            username="Test",
+        )
+        kyiv = ZoneInfo("Europe/Kiev")
+        for title, created_at in (
+            ("late", datetime(2023, 10, 9, 23, 30, tzinfo=kyiv)),
+            ("on", datetime(2023, 10, 10, 0, 30, tzinfo=kyiv)),
+            ("next", datetime(2023, 10, 11, 0, 0, tzinfo=kyiv)),
+        ):
+            post = sample_post(author=profile_client, title=title)
+            Post.objects.filter(pk=post.pk).update(created_at=created_at)
+
+        def titles(**params):
+            response = self.client.get(POSTS_URL, params)
+            return [post["title"] for post in response.data["results"]]
+
+        self.assertEqual(titles(created_on="2023-10-10"), ["on"])
+        self.assertEqual(titles(created_at="2023-10-10"), ["on"])
+        self.assertEqual(titles(created_after="2023-10-10"), ["next", "on"])
+        self.assertEqual(titles(created_before="2023-10-10"), ["late"])
+
+        response = self.client.get(POSTS_URL, {"created_on": "10.10.2023"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_post_detail_is_served_from_versioned_cache(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        profile = sample_profile(
+            user=user2,
+            username="Test2",
+        )
+        sample_profile(
+            user=self.user,
+            username="Test",
+        )
+        post = sample_post(author=profile)
+
+        response = self.client.get(detail_url(post.id))
+        self.assertEqual(response.data["likes"], [])
+        self.assertIsNone(response.data["my_reaction"])
+
+        # the post, looked up once for its permissions and ETag, and the
+        # viewer's reaction
+        with self.assertNumQueries(2):
+            response = self.client.get(detail_url(post.id))
+        self.assertEqual(response.data["title"], post.title)
+
+        self.client.post(like_url(post.id))
+        response = self.client.get(detail_url(post.id))
+        self.assertEqual(response.data["likes"], ["Test"])
+        self.assertEqual(response.data["my_reaction"], "like")
+
+        self.client.post(comment_url(post.id), {"body": "hi"})
+        self.client.get(detail_url(post.id))
+        for renamed in (profile, self.user.profile):
+            renamed.username = f"Renamed{renamed.pk}"
+            renamed.save()
+        response = self.client.get(detail_url(post.id))
+        self.assertEqual(response.data["author"], f"Renamed{profile.pk}")
+        commenter = f"Renamed{self.user.profile.pk}"
+        self.assertEqual(response.data["likes"], [commenter])
+        self.assertEqual(response.data["comments"][0]["owner"], commenter)
+
+        response = self.client.get(detail_url(post.id + 1))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(POST_DETAIL_REACTIONS=2)
+    def test_post_detail_embeds_the_latest_reactions_only(self):
+        profile = sample_profile(user=self.user, username="Test")
+        post = sample_post(author=profile)
+        for n in range(3):
+            user = get_user_model().objects.create_user(f"{n}@test.com", "test")
+            liker = sample_profile(user=user, username=f"Liker{n}")
+            reactions.toggle(post.id, liker.id, reactions.LIKE)
+
+        response = self.client.get(detail_url(post.id))
+        self.assertEqual(response.data["likes_count"], 3)
+        self.assertEqual(response.data["likes"], ["Liker2", "Liker1"])
+        self.assertEqual(response.data["dislikes_count"], 0)
+
+    def test_conditional_get_with_etag(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        profile = sample_profile(
+            user=user2,
+            username="Test2",
+        )
+        sample_profile(
+            user=self.user,
+            username="Test",
+        )
+        post = sample_post(author=profile)
+
+        for url in (detail_url(post.id), POSTS_URL):
+            response = self.client.get(url)
+            etag = response["ETag"]
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response["ETag"], etag)
+
+            self.client.post(like_url(post.id))
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response["ETag"], etag)
+
+            # the author is served by name, so renaming them changes the ETag
+            etag = response["ETag"]
+            profile.username = "Renamed"
+            profile.save()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(
+        MEDIA_ROOT=tempfile.mkdtemp(),
+        IMAGE_WORKERS=0,
+        IMAGE_RENDITION_WIDTHS=(64, 320),
+    )
+    def test_uploaded_image_gets_stripped_renditions(self):
+        sample_profile(user=self.user, username="Test")
+        exif = Image.Exif()
+        exif[0x010F] = "Camera maker"
+        buffer = BytesIO()
+        Image.new("RGB", (200, 100), "red").save(buffer, "JPEG", exif=exif)
+        upload = SimpleUploadedFile("photo.jpg", buffer.getvalue(), "image/jpeg")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                POSTS_URL,
+                {"title": "photo", "body": "body", "image": upload},
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        post = Post.objects.get(pk=response.data["id"])
+        renditions = post.image_renditions["renditions"]
+        self.assertEqual(post.image_renditions["source"], post.image.name)
+        self.assertEqual(set(renditions), {"64", "320"})
+        with default_storage.open(renditions["64"]["webp"]) as rendition:
+            image = Image.open(rendition)
+            self.assertEqual((image.format, image.size), ("WEBP", (64, 32)))
+        with default_storage.open(renditions["320"]["jpeg"]) as rendition:
+            image = Image.open(rendition)
+            self.assertEqual(image.size, (200, 100))
+            self.assertFalse(image.getexif())
+
+        response = self.client.get(POSTS_URL)
+        urls = response.data["results"][0]["image_renditions"]
+        self.assertTrue(urls["64"]["jpeg"].startswith("http://testserver/media/"))
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_MAX_PIXELS=10_000)
+    def test_invalid_uploads_are_rejected_before_they_are_stored(self):
+        sample_profile(user=self.user, username="Test")
+        buffer = BytesIO()
+        Image.new("RGB", (200, 100), "red").save(buffer, "PNG")
+        uploads = {
+            "big.png": (buffer.getvalue(), "at most 10000 pixels"),
+            "broken.png": (buffer.getvalue()[:60], "Upload a valid image"),
+        }
+
+        for name, (data, message) in uploads.items():
+            with self.subTest(name=name):
+                response = self.client.post(
+                    POSTS_URL,
+                    {
+                        "title": "photo",
+                        "body": "body",
+                        "image": SimpleUploadedFile(name, data, "image/png"),
+                    },
+                    format="multipart",
+                )
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn(message, str(response.data["image"]))
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+
+    @override_settings(
+        MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_WORKERS=0, IMAGE_MAX_PIXELS=10000
+    )
+    def test_oversized_images_are_not_rendered(self):
+        profile = sample_profile(user=self.user, username="Test")
+        buffer = BytesIO()
+        Image.new("RGB", (200, 100), "red").save(buffer, "PNG")
+
+        with self.assertLogs("sm_activity.images", "ERROR") as logs:
+            with self.captureOnCommitCallbacks(execute=True):
+                post = sample_post(
+                    author=profile,
+                    image=SimpleUploadedFile("big.png", buffer.getvalue()),
+                )
+        self.assertIn("200x100 is over 10000 pixels", logs.output[0])
+        post.refresh_from_db()
+        self.assertEqual(post.image_renditions["renditions"], {})
+
+    @override_settings(
+        MEDIA_ROOT=tempfile.mkdtemp(),
+        IMAGE_WORKERS=0,
+        IMAGE_RENDITION_WIDTHS=(64,),
+    )
+    def test_identical_uploads_share_reference_counted_blobs(self):
+        profile = sample_profile(user=self.user, username="Test")
+        buffer = BytesIO()
+        Image.new("RGB", (100, 100), "blue").save(buffer, "PNG")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            posts = [
+                sample_post(
+                    author=profile,
+                    image=SimpleUploadedFile(f"{name}.PNG", buffer.getvalue()),
+                )
+                for name in ("first", "second")
+            ]
+        self.assertEqual(posts[0].image.name, posts[1].image.name)
+        self.assertTrue(posts[0].image.name.startswith("blobs/"))
+        self.assertTrue(posts[0].image.name.endswith(".png"))
+        self.assertEqual(Blob.objects.count(), 3)
+        self.assertEqual(set(Blob.objects.values_list("refcount", flat=True)), {2})
+
+        response = serve_media(RequestFactory().get("/"), posts[0].image.name)
+        self.assertEqual(
+            response["Cache-Control"], "public, max-age=31536000, immutable"
+        )
+        response.close()
+
+        posts[0].delete()
+        self.assertEqual(set(Blob.objects.values_list("refcount", flat=True)), {1})
+        call_command("collect_blobs", "--grace-hours=0", stdout=StringIO())
+        self.assertEqual(Blob.objects.count(), 3)
+
+        posts[1].delete()
+        call_command("collect_blobs", "--grace-hours=0", stdout=StringIO())
+        self.assertEqual(Blob.objects.count(), 0)
+        self.assertFalse(default_storage.exists(posts[1].image.name))
+
+        # clearing an image releases its renditions too
+        with self.captureOnCommitCallbacks(execute=True):
+            post = sample_post(
+                author=profile,
+                image=SimpleUploadedFile("cleared.png", buffer.getvalue()),
+            )
+        self.assertEqual(set(Blob.objects.values_list("refcount", flat=True)), {1})
+        post.image = None
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.image_renditions, {})
+        self.assertEqual(set(Blob.objects.values_list("refcount", flat=True)), {0})
+        call_command("collect_blobs", "--grace-hours=0", stdout=StringIO())
+        self.assertEqual(Blob.objects.count(), 0)
+
+        # a file left without its row isn't reused, it may be collected
+        with open(default_storage.path(posts[1].image.name), "wb") as orphan:
+            orphan.write(b"truncated")
+        with self.captureOnCommitCallbacks(execute=True):
+            post = sample_post(
+                author=profile,
+                image=SimpleUploadedFile("third.png", buffer.getvalue()),
+            )
+        with default_storage.open(post.image.name) as stored:
+            self.assertEqual(stored.read(), buffer.getvalue())
@@ -1,12 +1,21 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
 
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APIClient
+from rest_framework.test import APIClient, APIRequestFactory
 
 
-from sm_activity.models import Profile
+from sm_activity.bulk_import import Importer
+from sm_activity.counters import recount_profiles
+from sm_activity.models import Profile, Post, Comment, Reaction
+from sm_activity.permissions import IsOwnerOrIfFollowerReadOnly
 from sm_activity.serializer import (
     ProfileSerializer,
     ProfileDetailSerializer,
@@ -14,6 +23,7 @@ from sm_activity.serializer import (
 )
 
 PROFILES_URL = reverse("sm_activity:profile-list")
+SUGGEST_URL = reverse("sm_activity:profile-suggest")
 
 
 def detail_url(profile_id: int):
@@ -24,6 +34,14 @@ def like_url(profile_id: int):
     return reverse("sm_activity:profile-liked-posts", args=[profile_id])
 
 
+def follow_url(profile_id: int):
+    return reverse("sm_activity:profile-follow", args=[profile_id])
+
+
+def export_url(profile_id: int):
+    return reverse("sm_activity:profile-export", args=[profile_id])
+
+
 def sample_profile(**params):
     defaults = {
         "user": "",
@@ -117,8 +135,12 @@ class ProfileApiTest(TestCase):
         )
         profile_3 = sample_profile(user=user3, username="Test3", status="None")
 
-        response = self.client.get(PROFILES_URL, {"username": "Test1"}).json()
-        response2 = self.client.get(PROFILES_URL, {"status": "Active"}).json()
+        response = self.client.get(PROFILES_URL, {"username": "Test1"}).json()[
+            "results"
+        ]
+        response2 = self.client.get(PROFILES_URL, {"status": "Active"}).json()[
+            "results"
+        ]
         serializer1 = ProfileSerializer(profile_1, many=False)
         serializer2 = ProfileSerializer(profile_2, many=False)
         serializer3 = ProfileSerializer(profile_3, many=False)
@@ -127,6 +149,11 @@ class ProfileApiTest(TestCase):
         self.assertIn(serializer2.data["username"], response2[0]["username"])
         self.assertNotIn(serializer3.data, response)
 
+        # any part of the username, whatever its case
+        response = self.client.get(PROFILES_URL, {"username": "EST2"})
+        usernames = [profile["username"] for profile in response.data["results"]]
+        self.assertEqual(usernames, ["Test2"])
+
     def test_forbidden_urls(self):
         user2 = get_user_model().objects.create_user(
             "test@test2.com", "test3234"
@@ -141,4 +168,238 @@ class ProfileApiTest(TestCase):
         )
 
         response = self.client.get(like_url(profile_id=user2.profile.id))
-        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_profile_counters(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        profile_1 = sample_profile(user=self.user, username="Test1")
+        profile_2 = sample_profile(user=user2, username="Test2")
+
+        profile_2.followers.add(profile_1)
+        post = Post.objects.create(author=profile_2, title="Test", body="Test")
+        Comment.objects.create(post=post, owner=profile_1, body="Test")
+
+        response = self.client.get(PROFILES_URL)
+        counters = {
+            profile["username"]: (
+                profile["followers"],
+                profile["follow_to"],
+                profile["posts_count"],
+                profile["comments_count"],
+            )
+            for profile in response.data["results"]
+        }
+        self.assertEqual(counters, {"Test1": (0, 1, 0, 1), "Test2": (1, 0, 1, 0)})
+
+        profile_1.follow_to.clear()
+        profile_2.refresh_from_db()
+        self.assertEqual(profile_2.followers_count, 0)
+
+    def test_follow_counters_follow_many_to_many_changes(self):
+        profiles = [
+            sample_profile(
+                user=get_user_model().objects.create_user(f"{n}@test.com", "test"),
+                username=f"Test{n}",
+            )
+            for n in range(4)
+        ]
+        first, second, third, fourth = profiles
+
+        def counters():
+            return [
+                (profile.followers_count, profile.following_count)
+                for profile in Profile.objects.order_by("id")
+            ]
+
+        second.followers.add(first, third)
+        self.assertEqual(counters(), [(0, 1), (2, 0), (0, 1), (0, 0)])
+        second.followers.remove(first, fourth)
+        self.assertEqual(counters(), [(0, 0), (1, 0), (0, 1), (0, 0)])
+        first.follow_to.add(second, third, fourth)
+        self.assertEqual(counters(), [(0, 3), (2, 0), (1, 1), (1, 0)])
+        first.follow_to.remove(third)
+        second.followers.clear()
+        self.assertEqual(counters(), [(0, 1), (0, 0), (0, 0), (1, 0)])
+
+        recount_profiles()
+        self.assertEqual(counters(), [(0, 1), (0, 0), (0, 0), (1, 0)])
+
+    def test_follow_is_idempotent(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        profile_1 = sample_profile(user=self.user, username="Test1")
+        profile_2 = sample_profile(user=user2, username="Test2")
+        url = follow_url(profile_2.id)
+
+        self.client.put(url)
+        response = self.client.put(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        state = (response.data["following"], response.data["followers"])
+        self.assertEqual(state, (True, 1))
+        self.assertIn(profile_1, profile_2.followers.all())
+
+        self.client.delete(url)
+        response = self.client.delete(url)
+        state = (response.data["following"], response.data["followers"])
+        self.assertEqual(state, (False, 0))
+        profile_1.refresh_from_db()
+        self.assertEqual(profile_1.following_count, 0)
+
+        response = self.client.post(url)
+        self.assertEqual(response.data["following"], True)
+        response = self.client.put(follow_url(profile_1.id))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_follower_permission_is_served_from_graph_cache(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        sample_profile(user=self.user, username="Test1")
+        profile_2 = sample_profile(user=user2, username="Test2")
+        permission = IsOwnerOrIfFollowerReadOnly()
+        request = APIRequestFactory().get(like_url(profile_2.id))
+        request.user = self.user
+
+        self.assertFalse(permission.has_object_permission(request, None, profile_2))
+        self.client.put(follow_url(profile_2.id))
+
+        with self.assertNumQueries(1):
+            self.assertTrue(
+                permission.has_object_permission(request, None, profile_2)
+            )
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                permission.has_object_permission(request, None, profile_2)
+            )
+
+        # an unfollow whose invalidation this process never saw
+        Profile.followers.through.objects.all().delete()
+        self.assertTrue(permission.has_object_permission(request, None, profile_2))
+        with self.settings(GRAPH_CACHE_TTL=0):
+            self.assertFalse(
+                permission.has_object_permission(request, None, profile_2)
+            )
+
+    def test_profile_detail_cache_hit_skips_related_rows(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        sample_profile(user=self.user, username="Test1")
+        profile_2 = sample_profile(user=user2, username="Test2")
+        self.client.put(follow_url(profile_2.id))
+
+        response = self.client.get(detail_url(profile_2.id))
+        self.assertEqual(len(response.data["followers"]), 1)
+
+        # only the profile, looked up for its permissions and ETag
+        with self.assertNumQueries(1):
+            response = self.client.get(detail_url(profile_2.id))
+        self.assertEqual(response.data["username"], "Test2")
+        self.assertEqual(len(response.data["followers"]), 1)
+
+        follower = Profile.objects.get(user=self.user)
+        follower.username = "Renamed"
+        follower.save()
+        response = self.client.get(detail_url(profile_2.id))
+        self.assertEqual(response.data["followers"][0]["username"], "Renamed")
+
+    def test_suggest_usernames_by_prefix(self):
+        for number, username in enumerate(("alice", "Alina", "albert", "bob")):
+            sample_profile(
+                user=get_user_model().objects.create_user(
+                    f"test{number}@test.com", "test1234"
+                ),
+                username=username,
+            )
+
+        response = self.client.get(SUGGEST_URL, {"prefix": "AL", "limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [profile["username"] for profile in response.data], ["albert", "alice"]
+        )
+        response = self.client.get(SUGGEST_URL, {"prefix": "ali", "limit": 100})
+        self.assertEqual(
+            [profile["username"] for profile in response.data], ["alice", "Alina"]
+        )
+        response = self.client.get(SUGGEST_URL)
+        self.assertEqual(response.data, [])
+
+    def test_export_streams_profile_history(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        profile_1 = sample_profile(user=self.user, username="Test1")
+        profile_2 = sample_profile(user=user2, username="Test2")
+        profile_2.followers.add(profile_1)
+        post = Post.objects.create(author=profile_1, title="Mine", body="Test")
+        other = Post.objects.create(author=profile_2, title="Theirs", body="Test")
+        Comment.objects.create(post=other, owner=profile_1, body="Nice")
+        Reaction.objects.create(post=other, profile=profile_1, kind="like")
+
+        response = self.client.get(export_url(profile_1.id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        records = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(
+            [record["type"] for record in records],
+            ["profile", "post", "comment", "reaction", "follow"],
+        )
+        self.assertEqual(records[1]["data"]["title"], post.title)
+        self.assertEqual(records[2]["data"]["post"], other.id)
+        self.assertEqual(records[3]["data"]["kind"], "like")
+        self.assertEqual(
+            records[4]["data"], {"follower": profile_1.id, "followee": profile_2.id}
+        )
+
+        output = StringIO()
+        call_command("export_profile", "Test1", stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 5)
+
+        response = self.client.get(export_url(profile_2.id))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import_jsonl(self):
+        user2 = get_user_model().objects.create_user("test@test2.com", "test3234")
+        records = [
+            ("profile", {"id": 10, "username": "Alice", "user": self.user.id}),
+            ("profile", {"id": 11, "username": "Bob", "user": user2.id}),
+            ("profile", {"id": 12, "username": "Nobody", "user": 999}),
+            ("post", {"id": 20, "author": 10, "title": "Imported walrus"}),
+            ("comment", {"id": 30, "post": 20, "owner": 11, "body": "root"}),
+            ("comment", {"id": 31, "post": 20, "owner": 10, "parent": 30}),
+            ("follow", {"follower": 11, "followee": 10}),
+            ("reaction", {"post": 20, "profile": 11, "kind": "like"}),
+        ]
+        for _, data in records[:3]:
+            data.update(status="Active", bio="bio")
+        records[3][1].update(body="body", created_at="2020-01-01T10:00:00Z")
+        records[5][1].update(body="reply")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dump.jsonl")
+            with open(path, "w") as dump:
+                for kind, data in records:
+                    dump.write(json.dumps({"type": kind, "data": data}) + "\n")
+                dump.write("not json\n")
+
+            errors = StringIO()
+            call_command(
+                "import_jsonl", path, "--batch-size=3", stdout=StringIO(), stderr=errors
+            )
+            self.assertFalse(os.path.exists(f"{path}.checkpoint"))
+
+            # read again, as after a crash between a commit and its checkpoint
+            with open(path, "rb") as source:
+                rows = Importer(3).run(source)
+            self.assertEqual(set(rows.values()), {0})
+
+        self.assertIn("line 3: user 999 does not exist", errors.getvalue())
+        self.assertIn("line 9:", errors.getvalue())
+        alice = Profile.objects.get(pk=10)
+        self.assertEqual(alice.username_lower, "alice")
+        self.assertEqual((alice.followers_count, alice.posts_count), (1, 1))
+        post = Post.objects.get(pk=20)
+        self.assertEqual((post.comments_count, post.likes_count), (2, 1))
+        self.assertEqual(post.created_at.year, 2020)
+        root = Comment.objects.get(pk=30)
+        self.assertEqual(root.replies_count, 1)
+        self.assertEqual(Comment.objects.get(pk=31).path, root.path + "0000000031")
+        self.assertEqual(Profile.objects.count(), 2)
+
+        response = self.client.get(reverse("sm_activity:post-list"), {"q": "walrus"})
+        self.assertEqual([post["id"] for post in response.data["results"]], [20])
@@ -0,0 +1,365 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from sm_activity import graph
+from sm_activity.models import Comment, Post, Profile, Reaction
+from sm_activity.querylog import format_queries
+from sm_activity.urls import router
+
+STANDARD_ACTIONS = (
+    "list",
+    "create",
+    "retrieve",
+    "update",
+    "partial_update",
+    "destroy",
+)
+
+# Most SQL queries a request may run, cold caches included, whatever the
+# page size or the amount of related rows, for a client sending its JWT,
+# so looking up the user is counted. Every routed action needs one.
+QUERY_BUDGETS = {
+    "profile": {
+        "list": 2,
+        "create": 5,
+        "retrieve": 8,
+        "update": 9,
+        "partial_update": 6,
+        "destroy": 9,
+        "liked_posts": 5,
+        "posts": 3,
+        "follow": 14,
+        "suggest": 2,
+        "export": 6,
+    },
+    "post": {
+        "list": 2,
+        "create": 7,
+        "retrieve": 7,
+        "update": 6,
+        "partial_update": 6,
+        "destroy": 10,
+        "like": 11,
+        "dislike": 11,
+        "comment": 9,
+        "comments": 3,
+    },
+    "comment": {
+        "retrieve": 3,
+        "update": 5,
+        "partial_update": 5,
+        "destroy": 8,
+        "reply": 10,
+        "thread": 3,
+    },
+    "feed": {
+        "list": 4,
+    },
+}
+USER_ME_BUDGET = 1
+
+# What each action must answer with, so that a budget is never met by a
+# request that failed or served nothing: PAGE for a non-empty page of
+# `results`, ITEMS for a non-empty list, STREAM for NDJSON lines, None for
+# an empty body, otherwise a key of the returned object.
+PAGE, ITEMS, STREAM = "page", "items", "stream"
+RESPONSES = {
+    "profile": {
+        "list": PAGE,
+        "create": "id",
+        "retrieve": "followers",
+        "update": "id",
+        "partial_update": "bio",
+        "destroy": None,
+        "liked_posts": PAGE,
+        "posts": PAGE,
+        "follow": "following",
+        "suggest": ITEMS,
+        "export": STREAM,
+    },
+    "post": {
+        "list": PAGE,
+        "create": "id",
+        "retrieve": "comments",
+        "update": "id",
+        "partial_update": "title",
+        "destroy": None,
+        "like": "liked",
+        "dislike": "disliked",
+        "comment": "detail",
+        "comments": PAGE,
+    },
+    "comment": {
+        "retrieve": "body",
+        "update": "body",
+        "partial_update": "body",
+        "destroy": None,
+        "reply": "detail",
+        "thread": "replies",
+    },
+    "feed": {
+        "list": PAGE,
+    },
+}
+
+
+def routed_actions(viewset) -> set:
+    actions = {name for name in STANDARD_ACTIONS if hasattr(viewset, name)}
+    return actions | {action.__name__ for action in viewset.get_extra_actions()}
+
+
+def sample_profile(user, username):
+    return Profile.objects.create(
+        user=user, username=username, status="Active", bio="Test"
+    )
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Run every routed action against a dataset with several related rows of
+    each kind, at two page sizes, and fail with the grouped SQL when a
+    request goes over its budget
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [
+            get_user_model().objects.create_user(f"user{n}@test.com", "test1234")
+            for n in range(6)
+        ]
+        self.user = self.users[0]
+        self.profiles = [
+            sample_profile(user, f"Profile{n}") for n, user in enumerate(self.users)
+        ]
+        self.profile, self.other = self.profiles[0], self.profiles[1]
+        for profile in self.profiles[1:]:
+            profile.followers.add(self.profile)
+            self.profile.followers.add(profile)
+
+        self.posts = [
+            Post.objects.create(author=profile, title=f"Post {n}", body="summer")
+            for profile in self.profiles
+            for n in range(3)
+        ]
+        self.post = self.posts[0]
+        for post in self.posts[:6]:
+            for profile in self.profiles:
+                root = Comment.objects.create(post=post, owner=profile, body="root")
+                Comment.objects.create(
+                    post=post, owner=profile, parent=root, body="reply"
+                )
+                Reaction.objects.create(post=post, profile=profile, kind="like")
+        self.comment = Comment.objects.filter(owner=self.profile, parent=None).first()
+
+    def new_user(self):
+        count = get_user_model().objects.count()
+        return get_user_model().objects.create_user(f"new{count}@test.com", "test")
+
+    def scenarios(self) -> dict:
+        """(basename, action) -> function preparing (method, url, data, user)"""
+        profile_url = reverse("sm_activity:profile-detail", args=[self.other.id])
+        own_profile_url = reverse("sm_activity:profile-detail", args=[self.profile.id])
+        post_url = reverse("sm_activity:post-detail", args=[self.post.id])
+        comment_url = reverse("sm_activity:comment-detail", args=[self.comment.id])
+        profile_data = {"username": "Renamed", "status": "Active", "bio": "bio"}
+
+        def disposable_profile():
+            user = self.new_user()
+            profile = sample_profile(user, f"Disposable{user.id}")
+            url = reverse("sm_activity:profile-detail", args=[profile.id])
+            return "delete", url, None, user
+
+        def disposable_post():
+            post = Post.objects.create(author=self.profile, title="Bye", body="b")
+            return "delete", reverse("sm_activity:post-detail", args=[post.id]), None
+
+        def disposable_comment():
+            comment = Comment.objects.create(
+                post=self.post, owner=self.profile, parent=self.comment, body="b"
+            )
+            url = reverse("sm_activity:comment-detail", args=[comment.id])
+            return "delete", url, None
+
+        def new_profile():
+            user = self.new_user()
+            data = {**profile_data, "username": f"New{user.id}", "user": user.id}
+            return "post", reverse("sm_activity:profile-list"), data
+
+        return {
+            ("profile", "list"): lambda: ("get", reverse("sm_activity:profile-list")),
+            ("profile", "create"): new_profile,
+            ("profile", "retrieve"): lambda: ("get", profile_url),
+            ("profile", "update"): lambda: (
+                "put",
+                own_profile_url,
+                {**profile_data, "user": self.user.id},
+            ),
+            ("profile", "partial_update"): lambda: (
+                "patch",
+                own_profile_url,
+                {"bio": "new bio"},
+            ),
+            ("profile", "destroy"): disposable_profile,
+            ("profile", "liked_posts"): lambda: (
+                "get",
+                reverse("sm_activity:profile-liked-posts", args=[self.profile.id]),
+            ),
+            ("profile", "posts"): lambda: (
+                "get",
+                reverse("sm_activity:profile-posts", args=[self.other.id]),
+            ),
+            ("profile", "follow"): lambda: (
+                "post",
+                reverse("sm_activity:profile-follow", args=[self.other.id]),
+            ),
+            ("profile", "suggest"): lambda: (
+                "get",
+                reverse("sm_activity:profile-suggest") + "?prefix=prof",
+            ),
+            ("profile", "export"): lambda: (
+                "get",
+                reverse("sm_activity:profile-export", args=[self.profile.id]),
+            ),
+            ("post", "list"): lambda: ("get", reverse("sm_activity:post-list")),
+            ("post", "create"): lambda: (
+                "post",
+                reverse("sm_activity:post-list"),
+                {"title": "New", "body": "new"},
+            ),
+            ("post", "retrieve"): lambda: ("get", post_url),
+            ("post", "update"): lambda: (
+                "put",
+                post_url,
+                {"title": "Updated", "body": "updated"},
+            ),
+            ("post", "partial_update"): lambda: ("patch", post_url, {"title": "U"}),
+            ("post", "destroy"): disposable_post,
+            ("post", "like"): lambda: (
+                "post",
+                reverse("sm_activity:post-like", args=[self.posts[-1].id]),
+            ),
+            ("post", "dislike"): lambda: (
+                "post",
+                reverse("sm_activity:post-dislike", args=[self.posts[-2].id]),
+            ),
+            ("post", "comment"): lambda: (
+                "post",
+                reverse("sm_activity:post-comment", args=[self.post.id]),
+                {"body": "new comment"},
+            ),
+            ("post", "comments"): lambda: (
+                "get",
+                reverse("sm_activity:post-comments", args=[self.post.id]),
+            ),
+            ("comment", "retrieve"): lambda: ("get", comment_url),
+            ("comment", "update"): lambda: ("put", comment_url, {"body": "edited"}),
+            ("comment", "partial_update"): lambda: (
+                "patch",
+                comment_url,
+                {"body": "edited"},
+            ),
+            ("comment", "destroy"): disposable_comment,
+            ("comment", "reply"): lambda: (
+                "post",
+                reverse("sm_activity:comment-reply", args=[self.comment.id]),
+                {"body": "reply"},
+            ),
+            ("comment", "thread"): lambda: (
+                "get",
+                reverse("sm_activity:comment-thread", args=[self.comment.id]),
+            ),
+            ("feed", "list"): lambda: ("get", reverse("sm_activity:feed-list")),
+        }
+
+    def count_queries(self, method, url, data=None, user=None, page_size=None):
+        for alias in caches:
+            caches[alias].clear()
+        graph.clear()
+        token = AccessToken.for_user(user or self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        if page_size is not None:
+            url += ("&" if "?" in url else "?") + f"page_size={page_size}"
+
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(url, data)
+            if response.streaming:
+                response.body = b"".join(response.streaming_content)
+        self.assertLess(response.status_code, 400, f"{method} {url}: {response}")
+        return captured, response
+
+    def assert_response(self, expected, response, page_size):
+        if expected is None:
+            self.assertEqual(response.status_code, 204)
+        elif expected == STREAM:
+            lines = response.body.splitlines()
+            self.assertTrue(lines)
+            self.assertTrue(all("type" in json.loads(line) for line in lines))
+        elif expected == ITEMS:
+            self.assertTrue(response.data)
+        elif expected == PAGE:
+            results = response.data["results"]
+            self.assertTrue(results)
+            if response.data["next"]:
+                self.assertEqual(len(results), page_size)
+            else:
+                self.assertLessEqual(len(results), page_size)
+        else:
+            self.assertIn(expected, response.data)
+
+    def assert_within_budget(self, budget, request, label, expected):
+        for page_size in (2, 20):
+            captured, response = self.count_queries(*request(), page_size=page_size)
+            with self.subTest(page_size=page_size):
+                self.assert_response(expected, response, page_size)
+            queries = format_queries(captured.captured_queries)
+            self.assertLessEqual(
+                len(captured),
+                budget,
+                f"{label} ran {len(captured)} queries for a budget of {budget} "
+                f"(page_size={page_size}):\n{queries}",
+            )
+
+    def test_every_routed_action_has_a_budget(self):
+        routed = {
+            basename: routed_actions(viewset)
+            for _, viewset, basename in router.registry
+        }
+        budgeted = {
+            basename: set(budgets) for basename, budgets in QUERY_BUDGETS.items()
+        }
+        self.assertEqual(routed, budgeted)
+        self.assertEqual(
+            budgeted,
+            {basename: set(actions) for basename, actions in RESPONSES.items()},
+        )
+        self.assertEqual(
+            set(self.scenarios()),
+            {
+                (basename, action)
+                for basename, actions in routed.items()
+                for action in actions
+            },
+        )
+
+    def test_actions_stay_within_query_budgets(self):
+        for (basename, action), request in self.scenarios().items():
+            with self.subTest(basename=basename, action=action):
+                self.assert_within_budget(
+                    QUERY_BUDGETS[basename][action],
+                    request,
+                    f"{basename} {action}",
+                    RESPONSES[basename][action],
+                )
+
+    def test_user_me_stays_within_query_budget(self):
+        self.assert_within_budget(
+            USER_ME_BUDGET, lambda: ("get", reverse("user:manage")), "user me", "email"
+        )
@@ -0,0 +1,59 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+
+from sm_activity.models import Profile, Post
+from sm_activity.search import FTS_TABLE
+
+POSTS_URL = reverse("sm_activity:post-list")
+
+
+class PostSearchApiTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user("test@test.com", "test1234")
+        self.client.force_authenticate(self.user)
+        self.profile = Profile.objects.create(
+            user=self.user, username="Test", status="Active", bio="Test"
+        )
+
+    def search(self, text, **params):
+        response = self.client.get(POSTS_URL, {"q": text, **params})
+        return [post["title"] for post in response.data["results"]]
+
+    def test_search_ranks_title_and_body_matches(self):
+        Post.objects.create(author=self.profile, title="Cats", body="nothing")
+        Post.objects.create(
+            author=self.profile, title="Garden", body="cats cats cats everywhere"
+        )
+        Post.objects.create(author=self.profile, title="Dogs", body="no felines")
+
+        self.assertEqual(self.search("cats"), ["Garden", "Cats"])
+        self.assertEqual(self.search("cats", page_size=1), ["Garden"])
+        self.assertEqual(self.search('"dogs OR'), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        post = Post.objects.create(author=self.profile, title="Cats", body="body")
+        post.title = "Dogs"
+        post.save()
+        self.assertEqual(self.search("cats"), [])
+        self.assertEqual(self.search("dogs"), ["Dogs"])
+
+        post.delete()
+        self.assertEqual(self.search("dogs"), [])
+
+    def test_rebuild_search_index_command(self):
+        Post.objects.create(author=self.profile, title="Cats", body="body")
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        self.assertEqual(self.search("cats"), [])
+
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(self.search("cats"), ["Cats"])
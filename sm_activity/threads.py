@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.db.models import Q
+
+from sm_activity.models import Comment
+
+# sorts after the digits of any path segment
+PATH_END = chr(ord("9") + 1)
+
+
+def max_depth() -> int:
+    return min(
+        getattr(settings, "COMMENT_MAX_DEPTH", Comment.MAX_DEPTH), Comment.MAX_DEPTH
+    )
+
+
+def max_nodes() -> int:
+    return getattr(settings, "COMMENT_THREAD_MAX_NODES", 500)
+
+
+def subtree_filter(comment: Comment, depth: int = None) -> Q:
+    """
+    The comment and its replies down to `depth` levels below it, as a range
+    over the (post, path) index rather than a LIKE, which SQLite can't serve
+    from the index
+    """
+    query = Q(
+        post_id=comment.post_id,
+        path__gte=comment.path,
+        path__lt=comment.path + PATH_END,
+    )
+    if depth is not None:
+        query &= Q(depth__lte=comment.depth + depth)
+    return query
+
+
+def subtree(comment: Comment, depth: int = None):
+    """The subtree of a comment in depth-first order, from one indexed query"""
+    return (
+        Comment.objects.filter(subtree_filter(comment, depth))
+        .select_related("owner")
+        .order_by("path")
+    )
+
+
+def nest(comments, serialize) -> list:
+    """
+    Build the reply trees of comments given in depth-first order; comments
+    whose parent isn't in the list become roots
+    """
+    nodes = {}
+    roots = []
+    for comment in comments:
+        node = {**serialize(comment), "replies": []}
+        nodes[comment.pk] = node
+        parent = nodes.get(comment.parent_id)
+        if parent is None:
+            roots.append(node)
+        else:
+            parent["replies"].append(node)
+    return roots
@@ -0,0 +1,109 @@
+import heapq
+
+from django.conf import settings
+from django.db.models import Q, QuerySet
+
+from sm_activity.models import Post, Profile, TimelineEntry
+
+
+def fanout_limit() -> int:
+    """Authors with more followers than this are merged into feeds on read"""
+    return getattr(settings, "FEED_FANOUT_FOLLOWER_LIMIT", 5000)
+
+
+def backfill_size() -> int:
+    return getattr(settings, "FEED_BACKFILL_SIZE", 50)
+
+
+def is_celebrity(profile: Profile) -> bool:
+    return profile.followers_count > fanout_limit()
+
+
+def celebrity_ids(profile_id: int) -> QuerySet:
+    """Followed profiles whose posts are not fanned out on write"""
+    return Profile.objects.filter(
+        followers=profile_id, followers_count__gt=fanout_limit()
+    ).values("id")
+
+
+def fan_out_post(post: Post) -> None:
+    """Write a new post id into the timeline of every follower of its author"""
+    limit = fanout_limit()
+    follower_ids = list(
+        post.author.followers.values_list("id", flat=True)[: limit + 1]
+    )
+    if len(follower_ids) > limit:
+        return
+
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner_id=follower_id, post=post, created_at=post.created_at)
+            for follower_id in follower_ids
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(follower: Profile, followee: Profile) -> None:
+    """Seed a new follower's timeline with the most recent posts of a profile"""
+    if is_celebrity(followee):
+        return
+
+    posts = followee.posts.order_by("-created_at").values_list("id", "created_at")
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner=follower, post_id=post_id, created_at=created_at)
+            for post_id, created_at in posts[: backfill_size()]
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def purge(follower: Profile, followee: Profile) -> None:
+    TimelineEntry.objects.filter(owner=follower, post__author=followee).delete()
+
+
+def before(position, pk_field: str) -> Q:
+    """Rows older than a `(created_at, post id)` position, newest first"""
+    created_at, pk = position
+    return Q(created_at__lt=created_at) | Q(
+        created_at=created_at, **{f"{pk_field}__lt": pk}
+    )
+
+
+def feed_page(profile_id: int, position, limit: int) -> list:
+    """
+    Up to `limit` posts of the feed of a profile, newest first and strictly
+    after the `(created_at, id)` position, if any: a range scan of its
+    materialized timeline entries merged with the same window of the posts
+    of followed celebrity authors
+    """
+    entries = TimelineEntry.objects.filter(owner_id=profile_id)
+    celebrity_posts = Post.objects.filter(author_id__in=celebrity_ids(profile_id))
+    if position is not None:
+        entries = entries.filter(before(position, "post_id"))
+        celebrity_posts = celebrity_posts.filter(before(position, "id"))
+
+    timeline = [
+        entry.post
+        for entry in entries.select_related("post__author").order_by(
+            "-created_at", "-post_id"
+        )[:limit]
+    ]
+    celebrity_posts = celebrity_posts.select_related("author").order_by(
+        "-created_at", "-id"
+    )[:limit]
+
+    page, seen = [], set()
+    for post in heapq.merge(
+        timeline,
+        celebrity_posts,
+        key=lambda post: (post.created_at, post.id),
+        reverse=True,
+    ):
+        # fanned out before its author became a celebrity
+        if post.id not in seen:
+            seen.add(post.id)
+            page.append(post)
+    return page[:limit]
@@ -4,12 +4,14 @@ from sm_activity.views import (
     ProfileViewSet,
     PostViewSet,
     CommentViewSet,
+    FeedViewSet,
 )
 
 router = routers.DefaultRouter()
 router.register("profiles", ProfileViewSet)
 router.register("posts", PostViewSet)
 router.register("comments", CommentViewSet)
+router.register("feed", FeedViewSet, basename="feed")
 
 urlpatterns = router.urls
 
@@ -1,15 +1,33 @@
-from datetime import datetime
-from django.db.models import Count
+import hmac
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views import static
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
-from sm_activity.models import Profile, Comment, Post
+from sm_activity import caching, graph, metrics, reactions, threads
+from sm_activity.export import CONTENT_TYPE, buffered, export_profile
+from sm_activity.mixins import (
+    CachedRetrieveMixin,
+    ConditionalGetMixin,
+    ConditionalListMixin,
+    ProfiledViewMixin,
+)
+from sm_activity.models import Profile, Comment, Post, Reaction
 from sm_activity.permissions import (
+    IsOwnerOrAdmin,
     IsOwnerOrIfAuthenticatedReadOnly,
     IsOwnerOrIfFollowerReadOnly,
 )
@@ -19,21 +37,56 @@ from sm_activity.serializer import (
     PostSerializer,
     ProfileDetailSerializer,
     ProfileFollowSerializer,
+    ProfileSuggestSerializer,
     PostDetailSerializer,
     LikePostSerializer,
     CommentPostSerializer,
+    CommentThreadSerializer,
 )
+from sm_activity.search import search, suggest_usernames, username_filter
+from sm_activity.storage import BLOB_DIR, CACHE_CONTROL
+from sm_activity.timeline import backfill, fan_out_post, feed_page, purge
+
+
+def start_of_day(value: str, param: str) -> datetime:
+    """
+    Midnight of a `YYYY-MM-DD` day in TIME_ZONE, so day filters become
+    half-open ranges over the created_at index instead of a per-row cast
+    """
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({param: "Enter a date in YYYY-MM-DD format."})
+    return timezone.make_aware(
+        datetime.combine(day, time.min), timezone.get_default_timezone()
+    )
+
+
+REACTION_MESSAGES = {
+    reactions.LIKE: {
+        "on": "You like this post",
+        "off": "you didn't like this post anymore",
+        "conflict": "Unable to like the post",
+    },
+    reactions.DISLIKE: {
+        "on": "You dislike this post",
+        "off": "you didn't dislike this post anymore",
+        "conflict": "Unable to dislike the post",
+    },
+}
 
 
 class ProfileViewSet(
+    ProfiledViewMixin,
+    ConditionalListMixin,
+    CachedRetrieveMixin,
     viewsets.ModelViewSet,
 ):
-    queryset = (
-        Profile.objects.prefetch_related("posts", "follow_to")
-        .annotate(posts_count=Count("posts"))
-        .annotate(comments_count=Count("comments"))
-    )
+    queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
+    cache_kind = caching.PROFILE
     permission_classes = (IsOwnerOrIfAuthenticatedReadOnly, IsAuthenticated)
 
     def get_serializer_class(self):
@@ -41,8 +94,18 @@ class ProfileViewSet(
             return ProfileDetailSerializer
         if self.action == "follow":
             return ProfileFollowSerializer
+        if self.action in ("posts", "liked_posts"):
+            return PostSerializer
+        if self.action == "suggest":
+            return ProfileSuggestSerializer
         return ProfileSerializer
 
+    def paginated_posts(self, posts) -> Response:
+        posts = posts.select_related("author")
+        page = self.paginate_queryset(posts)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(
         methods=["GET"],
         detail=True,
@@ -51,9 +114,12 @@ class ProfileViewSet(
     )
     def liked_posts(self, request, pk=None):
         profile_for_action = self.get_object()
-        posts = profile_for_action.liked_posts.all()
-        serializer = PostSerializer(posts, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.paginated_posts(
+            Post.objects.filter(
+                reactions__profile=profile_for_action,
+                reactions__kind=Reaction.KindChoices.Like,
+            )
+        )
 
     @action(
         methods=["GET"],
@@ -62,48 +128,132 @@ class ProfileViewSet(
     )
     def posts(self, request, pk=None):
         profile_for_action = Profile.objects.get(pk=pk)
-        posts = profile_for_action.posts.all()
-        serializer = PostSerializer(posts, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.paginated_posts(profile_for_action.posts.all())
 
     @action(
-        methods=["POST"],
+        methods=["POST", "PUT", "DELETE"],
         detail=True,
         url_name="follow",
     )
     def follow(self, request, pk=None):
+        """
+        PUT follows the profile and DELETE unfollows it, both idempotent;
+        POST toggles the follow
+        """
         user_profile = self.request.user.profile
-        profile_for_action = Profile.objects.get(pk=pk)
+        profile_for_action = get_object_or_404(Profile, pk=pk)
 
-        if (
-            user_profile != profile_for_action
-            and user_profile not in profile_for_action.followers.all()
-        ):
-            profile_for_action.followers.add(user_profile)
-            return Response(
-                {"detail": "Profile followed successfully."}, status=status.HTTP_200_OK
-            )
-        elif user_profile in profile_for_action.followers.all():
-            profile_for_action.followers.remove(profile_for_action)
+        if user_profile == profile_for_action:
             return Response(
-                {"detail": "you no longer follow this profile."},
-                status=status.HTTP_200_OK,
+                {"detail": "Unable to follow the profile."},
+                status=status.HTTP_400_BAD_REQUEST,
             )
+
+        if request.method == "POST":
+            edge = graph.edge(user_profile.pk, profile_for_action.pk)
+            following = not edge.exists()
+        else:
+            following = request.method == "PUT"
+
+        if following:
+            if graph.follow(user_profile.pk, profile_for_action.pk):
+                backfill(user_profile, profile_for_action)
+                metrics.EVENTS.inc(event="follow")
+            detail = "Profile followed successfully."
+        else:
+            if graph.unfollow(user_profile.pk, profile_for_action.pk):
+                purge(user_profile, profile_for_action)
+                metrics.EVENTS.inc(event="unfollow")
+            detail = "you no longer follow this profile."
+
         return Response(
-            {"detail": "Unable to follow the profile."},
-            status=status.HTTP_400_BAD_REQUEST,
+            {
+                "detail": detail,
+                "following": following,
+                "followers": graph.followers_count(profile_for_action.pk),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @action(
+        methods=["GET"],
+        detail=True,
+        url_path="export",
+        url_name="export",
+        permission_classes=(IsAuthenticated, IsOwnerOrAdmin),
+    )
+    def export(self, request, pk=None):
+        """
+        Everything the profile created, streamed as NDJSON (one
+        `{"type", "data"}` object per line)
+        """
+        profile = self.get_object()
+        response = StreamingHttpResponse(
+            buffered(export_profile(profile, {"request": request})),
+            content_type=CONTENT_TYPE,
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="profile-{profile.pk}.ndjson"'
         )
+        return response
+
+    def build_detail(self, instance) -> dict:
+        profile = Profile.objects.prefetch_related(
+            "followers", "follow_to", "posts"
+        ).get(pk=instance.pk)
+        return super().build_detail(profile)
+
+    def viewer_fields(self, viewer_id) -> dict:
+        is_following = viewer_id is not None and graph.is_following(
+            viewer_id, int(self.kwargs["pk"])
+        )
+        return {"is_following": is_following}
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "prefix",
+                type=OpenApiTypes.STR,
+                description="Beginning of the username (ex. ?prefix=jo)",
+            ),
+            OpenApiParameter(
+                "limit",
+                type=OpenApiTypes.INT,
+                description="Number of suggestions, at most SUGGEST_MAX_RESULTS",
+            ),
+        ]
+    )
+    @action(
+        methods=["GET"],
+        detail=False,
+        url_path="suggest",
+    )
+    def suggest(self, request):
+        try:
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            limit = 10
+        profiles = suggest_usernames(request.query_params.get("prefix", ""), limit)
+        serializer = self.get_serializer(profiles, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
     def get_queryset(self):
         username = self.request.query_params.get("username")
         status_ = self.request.query_params.get("status")
         queryset = self.queryset
 
+        if self.action == "retrieve":
+            # enough for the permission checks and the ETag; the related
+            # rows are only loaded by `build_detail`, on a cache miss
+            queryset = queryset.only("pk", "user_id", "updated_at")
+
         if username:
-            queryset = queryset.filter(username__icontains=username)
+            queryset = queryset.filter(username_filter(username))
 
         if status_:
-            queryset = queryset.filter(status__icontains=status_)
+            if status_ in Profile.StatusChoices.names:
+                status_ = Profile.StatusChoices[status_].value
+            queryset = queryset.filter(status=status_)
 
         return queryset
 
@@ -111,13 +261,14 @@ class ProfileViewSet(
         parameters=[
             OpenApiParameter(
                 "username",
-                type=OpenApiTypes.DATE,
-                description="Filter by username (ex. ?Joe)",
+                type=OpenApiTypes.STR,
+                description="Filter by part of the username (ex. ?Joe), "
+                "prefixes are matched by /profiles/suggest/",
             ),
             OpenApiParameter(
                 "status",
-                type=OpenApiTypes.DATE,
-                description="Filter by status (ex. ?Active)",
+                type=OpenApiTypes.STR,
+                description="Filter by exact status (ex. ?Active)",
             ),
         ]
     )
@@ -126,17 +277,23 @@ class ProfileViewSet(
         this method is created for documentation, to use extend_schema
         for filtering
         """
-        return super().list(self, request, *args, **kwargs)
+        return super().list(request, *args, **kwargs)
 
 
-class PostViewSet(viewsets.ModelViewSet):
-    queryset = Post.objects.select_related(
-        "author",
-    ).prefetch_related("comments", "likes", "dislikes")
+class PostViewSet(
+    ProfiledViewMixin,
+    ConditionalListMixin,
+    CachedRetrieveMixin,
+    viewsets.ModelViewSet,
+):
+    queryset = Post.objects.select_related("author")
     permission_classes = (IsOwnerOrIfAuthenticatedReadOnly, IsAuthenticated)
+    cache_kind = caching.POST
+    reaction_backend = None
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user.profile)
+        post = serializer.save(author=self.request.user.profile)
+        fan_out_post(post)
 
     @action(
         methods=["POST"],
@@ -145,25 +302,7 @@ class PostViewSet(viewsets.ModelViewSet):
         permission_classes=(IsAuthenticated,),
     )
     def like(self, request, pk=None) -> Response:
-        post = self.get_object()
-        user_profile = self.request.user.profile
-
-        if (
-            user_profile not in post.likes.all()
-            and user_profile not in post.dislikes.all()
-        ):
-            post.likes.add(user_profile)
-            return Response({"detail": "You like this post"}, status=status.HTTP_200_OK)
-        elif user_profile in post.likes.all():
-            post.likes.remove(user_profile)
-            return Response(
-                {"detail": "you didn't like this post anymore"},
-                status=status.HTTP_200_OK,
-            )
-        return Response(
-            {"detail": "Unable to follow the profile."},
-            status=status.HTTP_400_BAD_REQUEST,
-        )
+        return self.toggle_reaction(reactions.LIKE)
 
     @action(
         methods=["POST"],
@@ -172,34 +311,43 @@ class PostViewSet(viewsets.ModelViewSet):
         permission_classes=(IsAuthenticated,),
     )
     def dislike(self, request, pk=None) -> Response:
+        return self.toggle_reaction(reactions.DISLIKE)
+
+    def toggle_reaction(self, kind: str) -> Response:
         post = self.get_object()
-        user_profile = self.request.user.profile
+        backend = self.reaction_backend or reactions.get_backend()
+        result = backend.toggle(post.pk, self.request.user.profile.pk, kind)
+        messages = REACTION_MESSAGES[kind]
 
-        if (
-            user_profile not in post.likes.all()
-            and user_profile not in post.dislikes.all()
-        ):
-            post.dislikes.add(user_profile)
+        if result is None:
             return Response(
-                {"detail": "You dislike this post"}, status=status.HTTP_200_OK
-            )
-        elif user_profile in post.likes.all():
-            post.dislikes.remove(user_profile)
-            return Response(
-                {"detail": "you didn't dislike this post anymore"},
-                status=status.HTTP_200_OK,
+                {"detail": messages["conflict"]},
+                status=status.HTTP_400_BAD_REQUEST,
             )
+        metrics.EVENTS.inc(event=kind if result["active"] else f"un{kind}")
         return Response(
-            {"detail": "Unable to dislike the post"},
-            status=status.HTTP_400_BAD_REQUEST,
+            {
+                "detail": messages["on" if result["active"] else "off"],
+                f"{kind}d": result["active"],
+                "likes": result["likes"],
+                "dislikes": result["dislikes"],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    def viewer_fields(self, viewer_id) -> dict:
+        backend = self.reaction_backend or reactions.get_backend()
+        my_reaction = viewer_id and backend.current_kind(
+            int(self.kwargs["pk"]), viewer_id
         )
+        return {"my_reaction": my_reaction}
 
     def get_serializer_class(self):
         if self.action == "retrieve":
             return PostDetailSerializer
         if self.action in ("like", "dislike"):
             return LikePostSerializer
-        if self.action == "comment":
+        if self.action in ("comment", "comments"):
             return CommentSerializer
         return PostSerializer
 
@@ -217,38 +365,99 @@ class PostViewSet(viewsets.ModelViewSet):
 
         serializer = CommentSerializer(data=data)
         serializer.is_valid(raise_exception=True)
-        comment = Comment.objects.create(
+        Comment.objects.create(
             post=post, owner=user_profile, body=serializer.data.get("body")
         )
-        post.comments.add(comment)
         return Response({"detail": "Added your comment"}, status=status.HTTP_200_OK)
 
+    @action(
+        methods=["GET"],
+        detail=True,
+        url_path="comments",
+        url_name="comments",
+    )
+    def comments(self, request, pk=None) -> Response:
+        post = get_object_or_404(Post.objects.only("id"), pk=pk)
+        comments = Comment.objects.filter(post=post, parent=None).select_related(
+            "owner"
+        )
+        self.pagination_ordering = ("created_at", "id")
+        page = self.paginate_queryset(comments)
+        return self.conditional_response(
+            request, self.page_etag(page), lambda: self.paginated_response(page)
+        )
+
     def get_queryset(self):
-        title = self.request.query_params.get("title")
-        created_at = self.request.query_params.get("created_at")
+        text = self.request.query_params.get("q") or self.request.query_params.get(
+            "title"
+        )
+        params = self.request.query_params
+        created_on = params.get("created_on") or params.get("created_at")
+        created_after = params.get("created_after")
+        created_before = params.get("created_before")
 
         queryset = self.queryset
 
-        if title:
-            queryset = queryset.filter(title__icontains=title)
+        if text:
+            ranked_ids = search(text)
+            queryset = queryset.filter(id__in=ranked_ids).annotate(
+                search_rank=Case(
+                    *[
+                        When(id=post_id, then=Value(position))
+                        for position, post_id in enumerate(ranked_ids)
+                    ],
+                    output_field=IntegerField(),
+                )
+            )
+            self.pagination_ordering = ("search_rank", "id")
+
+        if created_on:
+            day = start_of_day(created_on, "created_on")
+            queryset = queryset.filter(
+                created_at__gte=day, created_at__lt=day + timedelta(days=1)
+            )
 
-        if created_at:
-            post_date = datetime.strptime(created_at, "%Y-%m-%d").date()
-            queryset = queryset.filter(created_at=post_date)
+        if created_after:
+            queryset = queryset.filter(
+                created_at__gte=start_of_day(created_after, "created_after")
+            )
+
+        if created_before:
+            queryset = queryset.filter(
+                created_at__lt=start_of_day(created_before, "created_before")
+            )
 
         return queryset
 
     @extend_schema(
         parameters=[
+            OpenApiParameter(
+                "q",
+                type=OpenApiTypes.STR,
+                description="Full-text search in title and body, best match "
+                "first (ex. ?q=summer trip)",
+            ),
             OpenApiParameter(
                 "title",
                 type=OpenApiTypes.DATE,
-                description="Filter by title (ex. ?title=emmm..)",
+                description="Deprecated alias of q (ex. ?title=emmm..)",
             ),
             OpenApiParameter(
-                "created_at",
+                "created_on",
                 type=OpenApiTypes.DATE,
-                description="Filter by creation day (ex. ?date=2020-10-10)",
+                description="Filter by creation day (ex. ?created_on=2020-10-10)",
+            ),
+            OpenApiParameter(
+                "created_after",
+                type=OpenApiTypes.DATE,
+                description="Created on or after this day "
+                "(ex. ?created_after=2020-10-10)",
+            ),
+            OpenApiParameter(
+                "created_before",
+                type=OpenApiTypes.DATE,
+                description="Created before this day "
+                "(ex. ?created_before=2020-11-01)",
             ),
         ]
     )
@@ -257,15 +466,130 @@ class PostViewSet(viewsets.ModelViewSet):
         this method is created for documentation, to use extend_schema
         for filtering
         """
-        return super().list(self, request, *args, **kwargs)
+        return super().list(request, *args, **kwargs)
 
 
 class CommentViewSet(
+    ProfiledViewMixin,
+    ConditionalGetMixin,
     mixins.UpdateModelMixin,
     mixins.DestroyModelMixin,
     mixins.RetrieveModelMixin,
     GenericViewSet,
 ):
-    queryset = Comment.objects.all()
+    queryset = Comment.objects.select_related("owner")
     permission_classes = (IsOwnerOrIfAuthenticatedReadOnly,)
     serializer_class = CommentPostSerializer
+
+    def get_serializer_class(self):
+        if self.action == "reply":
+            return CommentSerializer
+        if self.action == "thread":
+            return CommentThreadSerializer
+        return CommentPostSerializer
+
+    @action(
+        methods=["POST"],
+        detail=True,
+        url_path="reply",
+        url_name="reply",
+        permission_classes=(IsAuthenticated,),
+    )
+    def reply(self, request, pk=None) -> Response:
+        parent = self.get_object()
+        if parent.depth >= threads.max_depth():
+            raise ValidationError({"detail": "This thread can't be nested any deeper"})
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        Comment.objects.create(
+            post_id=parent.post_id,
+            parent=parent,
+            owner=request.user.profile,
+            body=serializer.validated_data["body"],
+        )
+        return Response({"detail": "Added your reply"}, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "depth",
+                type=OpenApiTypes.INT,
+                description="Levels of replies to load below the comment "
+                "(ex. ?depth=2, default: the whole thread)",
+            ),
+        ]
+    )
+    @action(
+        methods=["GET"],
+        detail=True,
+        url_path="thread",
+        url_name="thread",
+    )
+    def thread(self, request, pk=None) -> Response:
+        """
+        The comment with its replies nested under `replies`, loaded by a
+        single range scan of the materialized paths whatever the depth;
+        replies below `depth` are left out and only counted in replies_count
+        """
+        comment = self.get_object()
+        depth = request.query_params.get("depth")
+        if depth is not None:
+            try:
+                depth = int(depth)
+            except ValueError:
+                raise ValidationError({"depth": "Enter a whole number."})
+            if depth < 0:
+                raise ValidationError({"depth": "Enter a positive number."})
+        nodes = list(threads.subtree(comment, depth)[: threads.max_nodes()])
+
+        def respond():
+            serialize = self.get_serializer_class()
+            tree = threads.nest(nodes, lambda node: serialize(node).data)
+            return Response(tree[0])
+
+        return self.conditional_response(request, self.page_etag(nodes), respond)
+
+
+class FeedViewSet(ProfiledViewMixin, mixins.ListModelMixin, GenericViewSet):
+    serializer_class = PostSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def list(self, request, *args, **kwargs):
+        profile_id = graph.profile_id_for_user(request.user.id)
+        page = self.paginator.paginate_rows(
+            lambda position, limit: feed_page(profile_id, position, limit),
+            request,
+            Post,
+        )
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+def serve_media(request, path):
+    """
+    Serve uploaded media in development; blobs are named after their
+    content, so their responses can be cached for good
+    """
+    response = static.serve(request, path, document_root=settings.MEDIA_ROOT)
+    if path.startswith(f"{BLOB_DIR}/") and response.status_code == 200:
+        response["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+def export_metrics(request):
+    """
+    Every metric in the Prometheus text format, for scrapers sending
+    METRICS_TOKEN as a bearer token; without a token, only in DEBUG
+    """
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    # header values are decoded as latin-1, encoding them back gives the bytes sent
+    elif not hmac.compare_digest(
+        request.headers.get("Authorization", "").encode("latin-1"),
+        f"Bearer {token}".encode(),
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/4.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
@@ -47,8 +48,13 @@ INSTALLED_APPS = [
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Uploads are stored once per distinct content, named after its SHA-256;
+# the collect_blobs command deletes the ones nothing references any more
+DEFAULT_FILE_STORAGE = "sm_activity.storage.ContentAddressedStorage"
+
 
 MIDDLEWARE = [
+    "sm_activity.instrumentation.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -65,6 +71,8 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
+    "DEFAULT_PAGINATION_CLASS": "sm_activity.pagination.KeysetPagination",
+    "PAGE_SIZE": 20,
 }
 
 SIMPLE_JWT = {
@@ -73,6 +81,72 @@ SIMPLE_JWT = {
     "ROTATE_REFRESH_TOKENS": True,
 }
 
+# Authors with more followers than this are merged into feeds on read
+# instead of being fanned out into every follower's timeline on write
+FEED_FANOUT_FOLLOWER_LIMIT = 5000
+FEED_BACKFILL_SIZE = 50
+
+# Use "sm_activity.reactions.BufferedReactionBackend" to batch likes and
+# dislikes of hot posts in memory and write them behind the request; they
+# are flushed after REACTION_FLUSH_INTERVAL seconds at most, so a killed
+# process loses the toggles of that window
+REACTION_BACKEND = "sm_activity.reactions.DirectReactionBackend"
+REACTION_BUFFER_SIZE = 500
+REACTION_FLUSH_INTERVAL = 2.0
+
+# Profiles whose followed set and ownership are kept in each process;
+# the versions invalidating them live in the default cache. With the
+# process-local LocMemCache a worker doesn't see the follows and unfollows
+# made by the others, so the sets are reloaded after GRAPH_CACHE_TTL
+# seconds; raise it only with a shared cache (Redis, Memcached)
+GRAPH_CACHE_SIZE = 10000
+GRAPH_CACHE_TTL = 10
+
+# Upper bound of ranked post ids returned by a full-text search
+SEARCH_MAX_RESULTS = 1000
+# Upper bound of profiles returned by /profiles/suggest/
+SUGGEST_MAX_RESULTS = 20
+
+# Comments embedded in a post detail, the rest is paged separately
+POST_DETAIL_COMMENTS = 10
+# Latest liking and disliking usernames embedded in a post detail, next to
+# the counters
+POST_DETAIL_REACTIONS = 10
+# Reply nesting limit and comments loaded by one /comments/{id}/thread/
+COMMENT_MAX_DEPTH = 20
+COMMENT_THREAD_MAX_NODES = 500
+
+# Image renditions rendered in a process pool after upload (0 workers
+# renders them on commit, in the request)
+IMAGE_RENDITION_WIDTHS = (64, 320, 1080)
+IMAGE_RENDITION_QUALITY = 80
+IMAGE_WORKERS = 2
+# Uploads with more pixels than this are rejected before they are decoded
+IMAGE_MAX_PIXELS = 40_000_000
+
+# Rows fetched per round trip by the NDJSON profile export
+EXPORT_CHUNK_SIZE = 2000
+
+# Requests slower than this are logged with their SQL; the slowest ones of
+# each process are kept, and at most this many statements per request
+SERVER_TIMING_SLOW_MS = 500
+SERVER_TIMING_SAMPLES = 20
+SERVER_TIMING_MAX_STATEMENTS = 200
+
+# Metrics of all worker processes are summed through this memory-mapped
+# file, deleting it resets them (the test runner uses a file of its own).
+# /metrics asks for METRICS_TOKEN as a bearer token, and is only served
+# without one in DEBUG
+METRICS_FILE = Path(tempfile.gettempdir()) / "sm_activity_metrics.bin"
+METRICS_TOKEN = None
+
+# Requests sent with an X-Profile-Request header, by a staff user or with a
+# token from `manage.py profiling_token`, are sampled every
+# PROFILING_INTERVAL seconds into collapsed stacks and SQL files
+PROFILING_DIR = Path(tempfile.gettempdir()) / "sm_activity_profiles"
+PROFILING_INTERVAL = 0.005
+PROFILING_TOKEN_MAX_AGE = 3600
+
 
 SPECTACULAR_SETTINGS = {
     "TITLE": "SOCIAL MEDIA API",
@@ -107,6 +181,22 @@ TEMPLATES = [
 WSGI_APPLICATION = "social_media_api.wsgi.application"
 
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# Rendered post/profile detail payloads; versions are bumped on every
+# change, the timeout bounds staleness of nested usernames/images. The
+# default LocMemCache is per process, so a change only invalidates the
+# payloads of the worker that made it: the others serve theirs for up to
+# DETAIL_CACHE_TIMEOUT seconds. Point DETAIL_CACHE_ALIAS at a shared cache
+# (Redis, Memcached) to invalidate everywhere at once.
+DETAIL_CACHE_ALIAS = "default"
+DETAIL_CACHE_TIMEOUT = 30
+
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
@@ -123,6 +213,8 @@ DATABASES = {
 
 AUTH_USER_MODEL = "user.User"
 
+TEST_RUNNER = "sm_activity.testing.TestRunner"
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
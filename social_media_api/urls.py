@@ -14,16 +14,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from drf_spectacular.views import (
     SpectacularSwaggerView,
     SpectacularAPIView,
     SpectacularRedocView,
 )
 
+from sm_activity.views import export_metrics, serve_media
+
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics", export_metrics, name="metrics"),
     path("api/sm_activity/", include("sm_activity.urls", namespace="sm_activity")),
     path("api/user/", include("user.urls", namespace="user")),
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
@@ -36,3 +40,12 @@ urlpatterns = [
         "api/doc/redoc/", SpectacularRedocView.as_view(url_name="schema"), name="redoc"
     ),
 ]
+
+if settings.DEBUG:
+    urlpatterns += [
+        re_path(
+            rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>.*)$",
+            serve_media,
+            name="media",
+        ),
+    ]